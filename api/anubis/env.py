@@ -11,6 +11,7 @@ class EnvConfig(object):
         self.DB_HOST = os.environ.get("DB_HOST", "db")
         self.DOMAIN = os.environ.get("DOMAIN", default="localhost")
         self.SENTRY_DSN = os.environ.get("SENTRY_DSN", default=None)
+        self.PIPELINE_INGEST = os.environ.get("PIPELINE_INGEST", default="0") == "1"
 
         if not self.MINDEBUG:
             # sqlalchemy
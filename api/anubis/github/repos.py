@@ -4,7 +4,18 @@ import traceback
 from parse import parse
 
 from anubis.github.api import github_graphql, github_rest
-from anubis.models import Assignment, AssignmentRepo, Submission, SubmissionBuild, SubmissionTestResult, User, db
+from anubis.models import (
+    Assignment,
+    AssignmentRepo,
+    AutogradeSnapshot,
+    BestSubmission,
+    PipelineProfile,
+    Submission,
+    SubmissionBuild,
+    SubmissionTestResult,
+    User,
+    db,
+)
 from anubis.rpc.safety_nets import create_repo_safety_net
 from anubis.utils.data import is_debug
 from anubis.utils.logging import logger
@@ -177,6 +188,21 @@ def delete_assignment_repo(user: User, assignment: Assignment, commit: bool = Tr
         logger.info(f'Deleting submission results')
         SubmissionTestResult.query.filter(SubmissionTestResult.submission_id.in_(submission_ids)).delete()
 
+        logger.info(f'Deleting best submissions')
+        BestSubmission.query.filter(BestSubmission.submission_id.in_(submission_ids)).delete(
+            synchronize_session=False
+        )
+
+        logger.info(f'Deleting autograde snapshots')
+        AutogradeSnapshot.query.filter(AutogradeSnapshot.submission_id.in_(submission_ids)).delete(
+            synchronize_session=False
+        )
+
+        logger.info(f'Deleting pipeline profiles')
+        PipelineProfile.query.filter(PipelineProfile.submission_id.in_(submission_ids)).delete(
+            synchronize_session=False
+        )
+
         # Delete submissions themselves
         logger.info(f'Deleting submissions')
         Submission.query.filter(
@@ -1,6 +1,8 @@
-from kubernetes import config, client
+from kubernetes import client
 
+from anubis.k8s.api import get_core_v1_api
 from anubis.k8s.theia.create import create_theia_k8s_pod_pvc
+from anubis.k8s.theia.pool import claim_theia_pool_pod
 from anubis.models import TheiaSession, db
 from anubis.utils.auth.user import current_user
 from anubis.utils.config import get_config_int
@@ -26,9 +28,7 @@ def initialize_theia_session(theia_session_id: str):
     :return:
     """
 
-    # Load the kubernetes incluster config
-    config.load_incluster_config()
-    v1 = client.CoreV1Api()
+    v1 = get_core_v1_api()
 
     # Log the initialization event
     logger.info(
@@ -81,6 +81,14 @@ def initialize_theia_session(theia_session_id: str):
         extra={"submission": theia_session.data},
     )
 
+    # Plain student sessions are given a pod from the warm pool of
+    # their image tag if there is one free. Those are already running,
+    # and have the repo of the session cloned by the time this returns.
+    if claim_theia_pool_pod(theia_session):
+        theia_session.k8s_requested = True
+        db.session.commit()
+        return
+
     # Create pod, and pvc object from the options specified for the
     # theia session.
     pod, pvc = create_theia_k8s_pod_pvc(theia_session)
@@ -1,5 +1,7 @@
 from datetime import datetime
 
+from sqlalchemy import or_
+
 from anubis.models import TheiaSession
 
 
@@ -14,3 +16,28 @@ def mark_session_ended(theia_session: TheiaSession):
     theia_session.active = False
     theia_session.state = "Ended"
     theia_session.ended = datetime.now()
+
+
+def mark_sessions_ended(theia_session_ids: list[str]):
+    """
+    Mark the database entries for many theia sessions as ended
+    in one update. Sessions that already ended keep their end
+    time. Changes are not committed.
+
+    :param theia_session_ids:
+    :return:
+    """
+    if len(theia_session_ids) == 0:
+        return
+
+    TheiaSession.query.filter(
+        TheiaSession.id.in_(list(theia_session_ids)),
+        or_(TheiaSession.active == True, TheiaSession.ended == None),
+    ).update(
+        {
+            TheiaSession.active: False,
+            TheiaSession.state: "Ended",
+            TheiaSession.ended: datetime.now(),
+        },
+        synchronize_session=False,
+    )
@@ -1,6 +1,6 @@
 from anubis.constants import REAPER_TXT
 from anubis.lms.assignments import get_recent_assignments
-from anubis.lms.autograde import bulk_autograde
+from anubis.lms.autograde import run_sharded_bulk_autograde
 from anubis.utils.data import with_context
 from anubis.utils.visuals.assignments import get_assignment_sundial
 from anubis.utils.logging import logger
@@ -23,7 +23,7 @@ def autograde_recalculate():
             assignment.name,
             assignment.course.course_code,
         ))
-        bulk_autograde(assignment.id, limit=None, offset=None)
+        run_sharded_bulk_autograde(assignment.id)
 
     for assignment in recent_assignments:
         logger.info('Running sundial recalc on {:<20} :: {:<20}'.format(
@@ -0,0 +1,34 @@
+from datetime import datetime
+
+from anubis.lms.assignments import get_recent_assignments
+from anubis.lms.snapshots import take_assignment_snapshots
+from anubis.utils.data import with_context
+from anubis.utils.logging import logger
+
+
+@with_context
+def snapshot():
+    """
+    Capture the deadline snapshots for recent assignments
+    whose deadlines have passed.
+
+    :return:
+    """
+
+    now = datetime.now()
+
+    for assignment in get_recent_assignments(autograde_enabled=True):
+        # Nothing to capture until the due date has passed
+        if assignment.due_date > now:
+            continue
+
+        logger.info('Capturing autograde snapshots for {:<20} :: {:<20}'.format(
+            assignment.name,
+            assignment.course.course_code,
+        ))
+        take_assignment_snapshots(assignment, now=now)
+
+
+if __name__ == "__main__":
+    print(f"Running autograde snapshot job - {datetime.now()}")
+    snapshot()
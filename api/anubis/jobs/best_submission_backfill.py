@@ -0,0 +1,40 @@
+import sys
+from datetime import datetime
+
+from anubis.lms.autograde import rebuild_best_submissions
+from anubis.models import Assignment
+from anubis.utils.data import with_context
+from anubis.utils.logging import logger
+
+
+@with_context
+def backfill(assignment_ids: list[str] = None):
+    """
+    Rebuild the best submission table from the submission history.
+    If no assignment ids are given, every assignment is rebuilt.
+
+    :param assignment_ids:
+    :return:
+    """
+
+    # Get the assignments to rebuild
+    query = Assignment.query
+    if assignment_ids:
+        query = query.filter(Assignment.id.in_(assignment_ids))
+    assignments: list[Assignment] = query.all()
+
+    for assignment in assignments:
+        logger.info('Rebuilding best submissions for {:<20} :: {:<20}'.format(
+            assignment.name,
+            assignment.course.course_code,
+        ))
+
+        # Each assignment is committed on its own
+        best_submission_ids = rebuild_best_submissions(assignment.id, commit=True)
+
+        logger.info('Rebuilt {} best submissions'.format(len(best_submission_ids)))
+
+
+if __name__ == "__main__":
+    print(f"Running best submission backfill - {datetime.now()}")
+    backfill(sys.argv[1:])
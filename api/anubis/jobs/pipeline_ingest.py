@@ -0,0 +1,77 @@
+import argparse
+import time
+
+from anubis.lms.pipeline_ingest import (
+    INGEST_CONSUMER,
+    claim_stale_pipeline_reports,
+    consume_pipeline_reports,
+    drain_pipeline_reports,
+    ensure_ingest_group,
+    get_pipeline_ingest_lag,
+)
+from anubis.utils.data import with_context
+from anubis.utils.logging import logger
+
+# How often the consumer logs its lag
+LAG_LOG_INTERVAL = 30
+
+# How often the consumer takes over entries left pending by other consumers
+CLAIM_INTERVAL = 60
+
+
+@with_context
+def drain(consumer: str):
+    """
+    Apply everything in the ingest stream, then exit.
+
+    :param consumer:
+    :return:
+    """
+    applied = drain_pipeline_reports(consumer)
+    logger.info(f"Drained {applied} pipeline reports", extra={"lag": get_pipeline_ingest_lag()})
+
+
+@with_context
+def consume(consumer: str):
+    """
+    Apply reports from the ingest stream forever. Reports are applied
+    in the order they were posted, so this should run as a single
+    consumer.
+
+    :param consumer:
+    :return:
+    """
+    ensure_ingest_group()
+
+    last_lag_log = 0.0
+    last_claim = 0.0
+    while True:
+        # Finish anything that was read but not applied before a restart,
+        # or by a consumer that is gone
+        if time.time() - last_claim > CLAIM_INTERVAL:
+            claim_stale_pipeline_reports(consumer)
+            while consume_pipeline_reports(consumer, pending=True) > 0:
+                pass
+            last_claim = time.time()
+
+        consume_pipeline_reports(consumer)
+
+        if time.time() - last_lag_log > LAG_LOG_INTERVAL:
+            logger.info("pipeline ingest lag", extra={"type": "pipeline_ingest_lag", **get_pipeline_ingest_lag()})
+            last_lag_log = time.time()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Apply queued pipeline reports")
+    parser.add_argument("--drain", action="store_true", help="apply everything queued, then exit")
+    parser.add_argument("--consumer", default=INGEST_CONSUMER)
+    args = parser.parse_args()
+
+    if args.drain:
+        drain(args.consumer)
+    else:
+        consume(args.consumer)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,22 +1,42 @@
 import os
+import queue
+import signal
+import sys
 import time
 
 if 'SENTRY_DSN' in os.environ:
     del os.environ['SENTRY_DSN']
 
-from kubernetes import config
-
+from anubis.k8s.api import get_k8s_api_client
 from anubis.utils.data import with_context
-from anubis.k8s.pipeline.reap import reap_pipeline_jobs
+from anubis.utils.lease import PollerLease
+from anubis.k8s.pipeline.reap import PIPELINE_POLLER_LEASE_GROUP, reap_pipeline_jobs
+from anubis.k8s.pipeline.watch import run_pipeline_poller, start_pipeline_watches
 
 
 def main():
-    config.load_incluster_config()
+    get_k8s_api_client()
+
+    # Replicas split the pipeline jobs between them. Give up the
+    # lease on shutdown so the others take over right away.
+    lease = PollerLease(PIPELINE_POLLER_LEASE_GROUP)
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+
+    try:
+        # Fall back to listing every pipeline job each second
+        if os.environ.get('PIPELINE_POLLER_WATCH', default='1') == '0':
+            while True:
+                lease.renew()
+                with_context(reap_pipeline_jobs)(lease=lease)
+                time.sleep(1)
 
-    while True:
-        with_context(reap_pipeline_jobs)()
-        time.sleep(1)
+        # React to job and pod events from watch streams
+        events = queue.Queue()
+        start_pipeline_watches(events)
+        run_pipeline_poller(events, lease)
+    finally:
+        lease.leave()
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
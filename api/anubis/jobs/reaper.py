@@ -5,6 +5,7 @@ from datetime import datetime, timedelta
 from anubis.constants import REAPER_TXT
 from anubis.github.fix import fix_github_missing_submissions, fix_github_broken_repos
 from anubis.lms.assignments import get_recent_assignments
+from anubis.lms.autograde import update_best_submission
 from anubis.lms.courses import get_active_courses
 from anubis.lms.students import get_students
 from anubis.lms.submissions import init_submission
@@ -31,16 +32,27 @@ def reap_stale_submissions():
 
     print("Reaping stale submissions")
 
-    # Find and update stale submissions
-    Submission.query.filter(
+    stale_filters = [
         Submission.last_updated < datetime.now() - timedelta(minutes=60),
         Submission.processed == False,
         Submission.state != 'regrading',
-    ).update({
+    ]
+
+    # Get the students whose best submission may change from the reap
+    stale_owners = db.session.query(Submission.owner_id, Submission.assignment_id).filter(
+        *stale_filters
+    ).distinct().all()
+
+    # Find and update stale submissions
+    Submission.query.filter(*stale_filters).update({
         'processed': True,
         'state':     "Reaped after timeout",
     }, False)
 
+    # Reaped submissions are now processed, so update the best submissions
+    for owner_id, assignment_id in stale_owners:
+        update_best_submission(owner_id, assignment_id)
+
     # Commit any changes
     db.session.commit()
 
@@ -0,0 +1,94 @@
+import argparse
+import gzip
+from datetime import datetime
+
+import sqlalchemy as sa
+
+from anubis.models import Submission, SubmissionBuild, SubmissionTestResult, db
+from anubis.models.sqltypes import GZIP_MAGIC
+from anubis.utils.data import with_context
+from anubis.utils.logging import logger
+
+# Compressed text columns that may have plain text rows from
+# before they were compressed
+COLUMNS = [
+    (SubmissionTestResult, "output"),
+    (SubmissionBuild, "stdout"),
+    (Submission, "pipeline_log"),
+]
+
+
+def recompress_column(model, column_name: str, batch_size: int = 500, decompress: bool = False) -> int:
+    """
+    Walk a compressed text column in batches of primary keys, and
+    compress any rows that are still plain text. With decompress,
+    compressed rows are written back as plain text instead. Each
+    batch is committed on its own, so the job can be stopped and
+    started again.
+
+    :param model:
+    :param column_name:
+    :param batch_size:
+    :param decompress:
+    :return: number of rows rewritten
+    """
+
+    table = model.__table__
+    id_column = table.c.id
+
+    # Read the raw stored bytes, skipping the compressed text type
+    raw_column = sa.type_coerce(table.c[column_name], sa.LargeBinary)
+
+    rewritten = 0
+    last_id = ""
+    while True:
+        rows = db.session.execute(
+            sa.select(id_column, raw_column)
+            .where(id_column > last_id, table.c[column_name].isnot(None))
+            .order_by(id_column)
+            .limit(batch_size)
+        ).all()
+        if len(rows) == 0:
+            break
+
+        last_id = rows[-1][0]
+
+        for row_id, value in rows:
+            if isinstance(value, str):
+                value = value.encode()
+
+            compressed = value.startswith(GZIP_MAGIC)
+            if compressed == (not decompress):
+                continue
+
+            # Write the bytes directly, so the column type does
+            # not compress them again
+            new_value = gzip.decompress(value) if decompress else gzip.compress(value, compresslevel=6)
+            db.session.execute(
+                sa.update(table)
+                .where(id_column == row_id)
+                .values({column_name: sa.type_coerce(new_value, sa.LargeBinary)})
+            )
+            rewritten += 1
+
+        db.session.commit()
+
+    return rewritten
+
+
+@with_context
+def main():
+    parser = argparse.ArgumentParser(description="Compress plain text submission outputs")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--decompress", action="store_true", help="write compressed rows back as plain text")
+    args = parser.parse_args()
+
+    for model, column_name in COLUMNS:
+        logger.info(f"Rewriting {model.__tablename__}.{column_name}")
+        rewritten = recompress_column(model, column_name, batch_size=args.batch_size, decompress=args.decompress)
+        logger.info(f"Rewrote {rewritten} rows in {model.__tablename__}.{column_name}")
+
+
+if __name__ == "__main__":
+    print(f"Running output recompress - {datetime.now()}")
+    main()
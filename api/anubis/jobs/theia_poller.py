@@ -1,21 +1,37 @@
 import os
+import signal
+import sys
 import time
 
 if 'SENTRY_DSN' in os.environ:
     del os.environ['SENTRY_DSN']
 
-from kubernetes import config
-
+from anubis.k8s.api import get_k8s_api_client
 from anubis.utils.data import with_context
-from anubis.k8s.theia.update import update_all_theia_sessions
+from anubis.utils.lease import PollerLease
+from anubis.k8s.theia.pool import reconcile_theia_pools
+from anubis.k8s.theia.update import THEIA_POLLER_LEASE_GROUP, update_all_theia_sessions
 
 
 def main():
-    config.load_incluster_config()
-
-    while True:
-        with_context(update_all_theia_sessions)()
-        time.sleep(1)
+    get_k8s_api_client()
+
+    # Replicas split the theia sessions between them. Give up the
+    # lease on shutdown so the others take over right away.
+    lease = PollerLease(THEIA_POLLER_LEASE_GROUP)
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+
+    try:
+        while True:
+            lease.renew()
+            with_context(update_all_theia_sessions)(lease)
+
+            # Refill the warm IDE pools
+            if lease.is_leader():
+                with_context(reconcile_theia_pools)()
+            time.sleep(1)
+    finally:
+        lease.leave()
 
 
 if __name__ == "__main__":
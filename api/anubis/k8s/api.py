@@ -0,0 +1,185 @@
+import os
+import socket
+import threading
+import time
+
+from kubernetes import client, config
+from urllib3.connection import HTTPConnection
+from urllib3.util.retry import Retry
+
+from anubis.utils.logging import logger
+
+# Most connections kept open to the api server. The pipeline poller
+# watch threads and bursts of IDE starts share the pool.
+K8S_API_POOL_MAXSIZE = int(os.environ.get("K8S_API_POOL_MAXSIZE", default="32"))
+
+# Default (connect, read) timeouts in seconds, for calls that do not set
+# their own. Streaming calls like watches only get the connect timeout.
+K8S_API_CONNECT_TIMEOUT = 5.0
+K8S_API_READ_TIMEOUT = 30.0
+
+# Retries with exponential backoff. Throttled calls (429) were never
+# processed, so they are retried for every method. Server errors are only
+# retried for methods that are safe to repeat.
+K8S_API_RETRIES = 3
+K8S_API_RETRY_BACKOFF = 0.5
+K8S_API_RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# How often the api latency metrics of a process are logged
+K8S_API_STATS_LOG_SECONDS = 60
+
+# Calls slower than this are logged on their own
+K8S_API_SLOW_CALL_SECONDS = 5.0
+
+
+class K8sRetry(Retry):
+    """
+    Retry throttled kube api calls for any method, and server errors
+    for idempotent methods only.
+    """
+
+    def is_retry(self, method, status_code, has_retry_after=False):
+        if status_code == 429 and self.total:
+            return True
+        return super().is_retry(method, status_code, has_retry_after)
+
+
+class K8sApiClient(client.ApiClient):
+    """
+    Kube api client that fills in the default request timeout, and
+    records the latency of every call.
+    """
+
+    def call_api(self, resource_path, method, *args, **kwargs):
+        if kwargs.get("_request_timeout", None) is None:
+            if kwargs.get("_preload_content", True):
+                kwargs["_request_timeout"] = (K8S_API_CONNECT_TIMEOUT, K8S_API_READ_TIMEOUT)
+            else:
+                kwargs["_request_timeout"] = (K8S_API_CONNECT_TIMEOUT, None)
+
+        start = time.perf_counter()
+        error = False
+        try:
+            return super().call_api(resource_path, method, *args, **kwargs)
+        except Exception:
+            error = True
+            raise
+        finally:
+            record_k8s_api_call(f"{method} {resource_path}", time.perf_counter() - start, error)
+
+
+_lock = threading.Lock()
+_api_client: tuple[int, K8sApiClient] | None = None
+_stats: dict[str, list] = {}
+_stats_since = time.time()
+
+
+def _create_k8s_api_client() -> K8sApiClient:
+    configuration = client.Configuration()
+    config.load_incluster_config(client_configuration=configuration)
+
+    configuration.connection_pool_maxsize = K8S_API_POOL_MAXSIZE
+    configuration.retries = K8sRetry(
+        total=K8S_API_RETRIES,
+        backoff_factor=K8S_API_RETRY_BACKOFF,
+        status_forcelist=K8S_API_RETRY_STATUSES,
+        raise_on_status=False,
+        respect_retry_after_header=True,
+    )
+
+    api_client = K8sApiClient(configuration)
+
+    # Keep idle connections to the api server alive between poll loops
+    api_client.rest_client.pool_manager.connection_pool_kw["socket_options"] = [
+        *HTTPConnection.default_socket_options,
+        (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1),
+    ]
+
+    return api_client
+
+
+def get_k8s_api_client() -> K8sApiClient:
+    """
+    Get the kube api client of this process. The incluster config is
+    loaded, and the connection pool created, once per process. Forked
+    processes like rq work horses get a client of their own, as the
+    connections of the parent can not be shared.
+
+    :return:
+    """
+    global _api_client
+
+    pid = os.getpid()
+    if _api_client is not None and _api_client[0] == pid:
+        return _api_client[1]
+
+    with _lock:
+        if _api_client is None or _api_client[0] != pid:
+            _api_client = (pid, _create_k8s_api_client())
+        return _api_client[1]
+
+
+def get_core_v1_api() -> client.CoreV1Api:
+    return client.CoreV1Api(api_client=get_k8s_api_client())
+
+
+def get_batch_v1_api() -> client.BatchV1Api:
+    return client.BatchV1Api(api_client=get_k8s_api_client())
+
+
+def get_custom_objects_api() -> client.CustomObjectsApi:
+    return client.CustomObjectsApi(api_client=get_k8s_api_client())
+
+
+def _format_stats(stats: dict[str, list]) -> dict[str, dict]:
+    return {
+        operation: {
+            "calls":   calls,
+            "errors":  errors,
+            "mean_ms": round(total / calls * 1000, 1),
+            "max_ms":  round(longest * 1000, 1),
+        }
+        for operation, (calls, errors, total, longest) in stats.items()
+    }
+
+
+def record_k8s_api_call(operation: str, seconds: float, error: bool = False):
+    """
+    Record the latency of a kube api call. Each operation keeps its
+    call count, error count, total and max seconds. The metrics of the
+    process are logged and reset every K8S_API_STATS_LOG_SECONDS.
+
+    :param operation: method and path template of the call
+    :param seconds:
+    :param error: the call raised
+    :return:
+    """
+    global _stats, _stats_since
+
+    if seconds >= K8S_API_SLOW_CALL_SECONDS:
+        logger.warning(f"slow kube api call {operation} {seconds:.2f}s")
+
+    with _lock:
+        stats = _stats.setdefault(operation, [0, 0, 0.0, 0.0])
+        stats[0] += 1
+        stats[1] += int(error)
+        stats[2] += seconds
+        stats[3] = max(stats[3], seconds)
+
+        now = time.time()
+        if now - _stats_since < K8S_API_STATS_LOG_SECONDS:
+            return
+        logged, _stats, _stats_since = _stats, {}, now
+
+    logger.info("kube api latency", extra={"type": "k8s_api_latency", "operations": _format_stats(logged)})
+
+
+def get_k8s_api_stats() -> dict:
+    """
+    Get the kube api latency metrics recorded by this process since
+    they were last logged.
+
+    :return:
+    """
+    with _lock:
+        return {"since": _stats_since, "operations": _format_stats(_stats)}
@@ -0,0 +1,407 @@
+import time
+
+from anubis.utils.config import get_config_dict, get_config_int
+from anubis.utils.logging import logger
+from anubis.utils.redis import redis
+
+# Pipeline priority classes, from most to least urgent by default
+PIPELINE_PRIORITY_PUSH = "push"
+PIPELINE_PRIORITY_REGRADE = "regrade"
+PIPELINE_PRIORITY_BULK = "bulk"
+PIPELINE_PRIORITIES = (PIPELINE_PRIORITY_PUSH, PIPELINE_PRIORITY_REGRADE, PIPELINE_PRIORITY_BULK)
+
+# Push pipelines are enqueued on their own rq queue, so they do not
+# wait behind regrade and bulk work on the regrade workers
+PIPELINE_PUSH_QUEUE = "default"
+
+# Scheduling policy. Can be overridden with the PIPELINE_SCHEDULER config
+# entry. Classes are admitted in the order of priorities. A class can be
+# capped to a number of slots in max_jobs, so that it can not take every
+# slot from the classes after it.
+DEFAULT_PIPELINE_SCHEDULER = {
+    "priorities": list(PIPELINE_PRIORITIES),
+    "max_jobs":   {},
+}
+
+# All the admission keys share this prefix:
+#
+#   slots:<class>           zset of submission id -> lease expiry
+#   owners:<class>          zset of owner id -> turn, for round robin
+#   queue:<class>:<owner>   list of waiting submission ids for an owner
+#   since                   hash of submission id -> time it started waiting
+#   queues                  hash of submission id -> rq queue to enqueue it on
+#   waiting                 hash of class -> number of waiting submissions
+#   latest                  hash of coalesce key -> newest submission id
+#   coalesce                hash of submission id -> coalesce key
+#   wait-times              list of recent wait times in seconds
+PIPELINE_ADMISSION_PREFIX = "pipeline-admission:"
+PIPELINE_WAIT_TIMES_KEPT = 1000
+
+# Add a submission to the back of its owner's queue. Owners that were
+# not waiting join the round robin at the front. If a coalesce key is
+# given, and the last submission with that key is still waiting in the
+# same queue, it is taken out and returned as superseded.
+#
+# ARGV: prefix, submission id, owner id, class, queue, now, coalesce key
+_WAIT_SCRIPT = """
+local p = ARGV[1]
+if redis.call('HSETNX', p .. 'since', ARGV[2], ARGV[6]) == 0 then
+    return ''
+end
+local queue_key = p .. 'queue:' .. ARGV[4] .. ':' .. ARGV[3]
+redis.call('HSET', p .. 'queues', ARGV[2], ARGV[5])
+redis.call('RPUSH', queue_key, ARGV[2])
+local first = redis.call('ZRANGE', p .. 'owners:' .. ARGV[4], 0, 0, 'WITHSCORES')
+local turn = 0
+if #first > 0 then
+    turn = tonumber(first[2])
+end
+redis.call('ZADD', p .. 'owners:' .. ARGV[4], 'NX', turn, ARGV[3])
+redis.call('HINCRBY', p .. 'waiting', ARGV[4], 1)
+
+local superseded = ''
+if ARGV[7] ~= '' then
+    local previous = redis.call('HGET', p .. 'latest', ARGV[7])
+    redis.call('HSET', p .. 'latest', ARGV[7], ARGV[2])
+    redis.call('HSET', p .. 'coalesce', ARGV[2], ARGV[7])
+    if previous and previous ~= ARGV[2] and redis.call('LREM', queue_key, 0, previous) > 0 then
+        redis.call('HDEL', p .. 'since', previous)
+        redis.call('HDEL', p .. 'queues', previous)
+        redis.call('HDEL', p .. 'coalesce', previous)
+        redis.call('HINCRBY', p .. 'waiting', ARGV[4], -1)
+        superseded = previous
+    end
+end
+return superseded
+"""
+
+# Move waiting submissions into free slots. Classes are visited in
+# priority order. Within a class, owners take turns, and an owner that
+# still has submissions waiting goes to the back of the round robin.
+#
+# ARGV: prefix, now, lease expiry, max jobs, then (class, class max jobs) pairs
+# Returns a flat list of submission id, wait start, queue, class
+_ADMIT_SCRIPT = """
+local p = ARGV[1]
+local now = tonumber(ARGV[2])
+local max_jobs = tonumber(ARGV[4])
+
+local classes = {}
+local total = 0
+for i = 5, #ARGV, 2 do
+    local slots = p .. 'slots:' .. ARGV[i]
+    redis.call('ZREMRANGEBYSCORE', slots, '-inf', now)
+    local active = redis.call('ZCARD', slots)
+    table.insert(classes, {ARGV[i], tonumber(ARGV[i + 1]), active})
+    total = total + active
+end
+
+local admitted = {}
+for _, class in ipairs(classes) do
+    local name, class_max, active = class[1], class[2], class[3]
+    local owners = p .. 'owners:' .. name
+    while total < max_jobs and (class_max < 0 or active < class_max) do
+        local popped = redis.call('ZPOPMIN', owners)
+        if #popped == 0 then
+            break
+        end
+        local owner, turn = popped[1], tonumber(popped[2])
+        local queue_key = p .. 'queue:' .. name .. ':' .. owner
+        local submission_id = redis.call('LPOP', queue_key)
+        if submission_id then
+            if redis.call('LLEN', queue_key) > 0 then
+                local last = redis.call('ZRANGE', owners, -1, -1, 'WITHSCORES')
+                local next_turn = turn + 1
+                if #last > 0 then
+                    next_turn = math.max(next_turn, tonumber(last[2]) + 1)
+                end
+                redis.call('ZADD', owners, next_turn, owner)
+            end
+            local since = redis.call('HGET', p .. 'since', submission_id) or ARGV[2]
+            local queue = redis.call('HGET', p .. 'queues', submission_id) or 'regrade'
+            redis.call('HDEL', p .. 'since', submission_id)
+            redis.call('HDEL', p .. 'queues', submission_id)
+            local coalesce_key = redis.call('HGET', p .. 'coalesce', submission_id)
+            if coalesce_key then
+                redis.call('HDEL', p .. 'coalesce', submission_id)
+                if redis.call('HGET', p .. 'latest', coalesce_key) == submission_id then
+                    redis.call('HDEL', p .. 'latest', coalesce_key)
+                end
+            end
+            redis.call('HINCRBY', p .. 'waiting', name, -1)
+            redis.call('ZADD', p .. 'slots:' .. name, ARGV[3], submission_id)
+            table.insert(admitted, submission_id)
+            table.insert(admitted, since)
+            table.insert(admitted, queue)
+            table.insert(admitted, name)
+            active = active + 1
+            total = total + 1
+        end
+    end
+end
+return admitted
+"""
+
+_wait_script = redis.register_script(_WAIT_SCRIPT) if redis is not None else None
+_admit_script = redis.register_script(_ADMIT_SCRIPT) if redis is not None else None
+
+
+def _key(name: str) -> str:
+    return PIPELINE_ADMISSION_PREFIX + name
+
+
+def _get_max_jobs() -> int:
+    return get_config_int("PIPELINE_MAX_JOBS", default=10)
+
+
+def get_pipeline_scheduler() -> dict:
+    """
+    Get the pipeline scheduling policy from the PIPELINE_SCHEDULER config
+    entry. Unknown classes are dropped, and classes left out of the
+    priorities are added at the end in their default order.
+
+        {"priorities": ["push", "regrade", "bulk"], "max_jobs": {"bulk": 8}}
+
+    :return:
+    """
+    scheduler = get_config_dict("PIPELINE_SCHEDULER", default=DEFAULT_PIPELINE_SCHEDULER)
+    if not isinstance(scheduler, dict):
+        scheduler = DEFAULT_PIPELINE_SCHEDULER
+
+    priorities = [priority for priority in scheduler.get("priorities", []) if priority in PIPELINE_PRIORITIES]
+    priorities += [priority for priority in PIPELINE_PRIORITIES if priority not in priorities]
+
+    max_jobs = scheduler.get("max_jobs", {})
+    if not isinstance(max_jobs, dict):
+        max_jobs = {}
+
+    # Caps that are not whole numbers are dropped like unknown classes,
+    # which leaves the class uncapped. So are negative caps.
+    class_max_jobs = {}
+    for priority in priorities:
+        if priority not in max_jobs:
+            continue
+        value = max_jobs[priority]
+        try:
+            if isinstance(value, bool):
+                raise ValueError
+            cap = int(value)
+        except (TypeError, ValueError):
+            logger.error(f"invalid PIPELINE_SCHEDULER max_jobs for {priority}: {value!r}")
+            continue
+        if cap >= 0:
+            class_max_jobs[priority] = cap
+
+    return {
+        "priorities": priorities,
+        "max_jobs":   class_max_jobs,
+    }
+
+
+def _get_lease_expiry(now: float) -> float:
+    """
+    Leases last a minute past the pipeline timeout. The pipeline poller
+    renews them for jobs that are still running, and releases them
+    when jobs are reaped. If a job disappears without being reaped,
+    its lease runs out on its own.
+
+    :param now:
+    :return:
+    """
+    timeout_minutes = get_config_int("AUTOGRADE_PIPELINE_TIMEOUT_MINUTES", default=5)
+    return now + timeout_minutes * 60 + 60
+
+
+def holds_pipeline_slot(submission_id: str) -> bool:
+    """
+    Check if a submission was already given a pipeline slot.
+
+    :param submission_id:
+    :return:
+    """
+    if redis is None:
+        return False
+
+    now = time.time()
+    pipe = redis.pipeline()
+    for priority in PIPELINE_PRIORITIES:
+        pipe.zscore(_key(f"slots:{priority}"), submission_id)
+    return any(expiry is not None and expiry > now for expiry in pipe.execute())
+
+
+def acquire_pipeline_slot(
+    submission_id: str,
+    owner_id: str,
+    priority: str = PIPELINE_PRIORITY_BULK,
+    queue: str = "regrade",
+    coalesce_key: str = None,
+) -> tuple[bool, str | None]:
+    """
+    Try to take a pipeline slot for a submission. The submission is added
+    to the back of its owner's queue in its priority class, then waiting
+    submissions are admitted by the scheduling policy. If this submission
+    was not one of them, it waits, and will be enqueued again once it
+    is admitted.
+
+    With a coalesce key, an older submission with the same key that is
+    still waiting is dropped from the queue, as it is superseded by
+    this one.
+
+    :param submission_id:
+    :param owner_id:
+    :param priority: push, regrade or bulk
+    :param queue: rq queue to enqueue the submission on when it is admitted
+    :param coalesce_key: key that submissions superseding each other share
+    :return: True if a slot was taken, and the id of the superseded submission
+    """
+    if redis is None:
+        return True, None
+
+    # Submissions that were admitted while waiting already have a slot
+    if holds_pipeline_slot(submission_id):
+        return True, None
+
+    if priority not in PIPELINE_PRIORITIES:
+        priority = PIPELINE_PRIORITY_BULK
+
+    superseded = _wait_script(
+        args=[PIPELINE_ADMISSION_PREFIX, submission_id, owner_id, priority, queue, time.time(), coalesce_key or ""],
+    )
+    superseded = superseded.decode() if superseded else None
+
+    return submission_id in admit_waiting_pipelines(skip_enqueue=submission_id), superseded
+
+
+def release_pipeline_slot(submission_id: str):
+    """
+    Give back the pipeline slot held by a submission.
+
+    :param submission_id:
+    :return:
+    """
+    if redis is None:
+        return
+
+    pipe = redis.pipeline()
+    for priority in PIPELINE_PRIORITIES:
+        pipe.zrem(_key(f"slots:{priority}"), submission_id)
+    pipe.execute()
+
+
+def renew_pipeline_slots(submission_ids: list[str]):
+    """
+    Push back the lease expiry of submissions that still have
+    a running pipeline job.
+
+    :param submission_ids:
+    :return:
+    """
+    if redis is None or len(submission_ids) == 0:
+        return
+
+    expiry = _get_lease_expiry(time.time())
+    pipe = redis.pipeline()
+    for priority in PIPELINE_PRIORITIES:
+        pipe.zadd(_key(f"slots:{priority}"), {submission_id: expiry for submission_id in submission_ids}, xx=True)
+    pipe.execute()
+
+
+def admit_waiting_pipelines(skip_enqueue: str = None) -> list[str]:
+    """
+    Give free pipeline slots to waiting submissions by the scheduling
+    policy, and enqueue their pipelines.
+
+    :param skip_enqueue: submission id that should not be enqueued, as
+                         the caller is going to create its pipeline
+    :return: submission ids admitted
+    """
+    from anubis.k8s.pipeline.batch import is_pipeline_batch
+    from anubis.rpc.enqueue import enqueue_autograde_pipeline, enqueue_batch_pipeline
+
+    if redis is None:
+        return []
+
+    scheduler = get_pipeline_scheduler()
+    class_args = []
+    for priority in scheduler["priorities"]:
+        class_args.extend([priority, scheduler["max_jobs"].get(priority, -1)])
+
+    now = time.time()
+    admitted = _admit_script(
+        args=[PIPELINE_ADMISSION_PREFIX, now, _get_lease_expiry(now), _get_max_jobs(), *class_args],
+    )
+
+    admitted_ids = []
+    wait_times = []
+    for index in range(0, len(admitted), 4):
+        submission_id = admitted[index].decode()
+        waited = now - float(admitted[index + 1])
+        queue = admitted[index + 2].decode()
+
+        # Pushes that waited before they had a queue of their own
+        if admitted[index + 3].decode() == PIPELINE_PRIORITY_PUSH:
+            queue = PIPELINE_PUSH_QUEUE
+
+        admitted_ids.append(submission_id)
+        wait_times.append(round(waited, 3))
+
+        if submission_id == skip_enqueue:
+            continue
+
+        logger.info(
+            f"Admitting pipeline {submission_id} after {waited:.1f}s",
+            extra={"submission_id": submission_id, "waited": waited},
+        )
+        if is_pipeline_batch(submission_id):
+            enqueue_batch_pipeline(submission_id, queue=queue)
+        else:
+            enqueue_autograde_pipeline(submission_id, queue=queue)
+
+    if len(wait_times) > 0:
+        pipe = redis.pipeline()
+        pipe.lpush(_key("wait-times"), *wait_times)
+        pipe.ltrim(_key("wait-times"), 0, PIPELINE_WAIT_TIMES_KEPT - 1)
+        pipe.execute()
+
+    return admitted_ids
+
+
+def get_pipeline_admission_stats() -> dict:
+    """
+    Get the running and waiting pipelines in each priority class,
+    and the recent wait times for pipeline admission.
+
+    :return:
+    """
+    if redis is None:
+        return {"enabled": False}
+
+    now = time.time()
+
+    pipe = redis.pipeline()
+    for priority in PIPELINE_PRIORITIES:
+        pipe.zcount(_key(f"slots:{priority}"), now, "+inf")
+    pipe.hgetall(_key("waiting"))
+    pipe.hvals(_key("since"))
+    pipe.lrange(_key("wait-times"), 0, -1)
+    *active, waiting, since, wait_times = pipe.execute()
+
+    waiting = {key.decode(): int(value) for key, value in waiting.items()}
+    wait_times = sorted(float(wait_time) for wait_time in wait_times)
+
+    def percentile(p: float) -> float:
+        if len(wait_times) == 0:
+            return 0.0
+        return wait_times[min(int(len(wait_times) * p), len(wait_times) - 1)]
+
+    return {
+        "enabled":     True,
+        "max_jobs":    _get_max_jobs(),
+        "scheduler":   get_pipeline_scheduler(),
+        "active":      dict(zip(PIPELINE_PRIORITIES, active)),
+        "waiting":     {priority: waiting.get(priority, 0) for priority in PIPELINE_PRIORITIES},
+        "oldest_wait": now - min(float(value) for value in since) if len(since) > 0 else 0.0,
+        "wait_p50":    percentile(0.5),
+        "wait_p95":    percentile(0.95),
+        "wait_max":    wait_times[-1] if len(wait_times) > 0 else 0.0,
+    }
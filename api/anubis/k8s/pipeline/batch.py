@@ -0,0 +1,270 @@
+from kubernetes import client
+
+from anubis.k8s.api import get_batch_v1_api
+from anubis.k8s.pipeline.admission import PIPELINE_PRIORITY_BULK, acquire_pipeline_slot, release_pipeline_slot
+from anubis.k8s.pipeline.create import create_pipeline_container
+from anubis.models import Submission, db
+from anubis.utils.config import get_config_int
+from anubis.utils.data import rand
+from anubis.utils.logging import logger
+from anubis.utils.redis import redis
+
+# Batch ids start with this prefix. A batch holds a single pipeline
+# slot under its batch id.
+PIPELINE_BATCH_PREFIX = "batch-"
+
+# Submission ids of a batch job are kept in this annotation, in the
+# order their containers run
+PIPELINE_BATCH_ANNOTATION = "anubis/submission-ids"
+
+# Batches waiting for a slot are kept in redis for a day
+PIPELINE_BATCH_TTL = 60 * 60 * 24
+
+
+def _pipeline_batch_key(batch_id: str) -> str:
+    return f"pipeline-batch-{batch_id}"
+
+
+def _pipeline_batch_done_key(batch_id: str) -> str:
+    return f"pipeline-batch-done-{batch_id}"
+
+
+def get_pipeline_batch_size() -> int:
+    """
+    Get the number of submissions graded in one batch pipeline pod. Batch
+    pipelines are turned off with a PIPELINE_BATCH_SIZE of 1 or less, and
+    without redis.
+
+    :return:
+    """
+    if redis is None:
+        return 1
+    return get_config_int("PIPELINE_BATCH_SIZE", default=10)
+
+
+def is_pipeline_batch(batch_id: str) -> bool:
+    return batch_id.startswith(PIPELINE_BATCH_PREFIX)
+
+
+def get_pipeline_batch_container_name(index: int) -> str:
+    return f"pipeline-{index}"
+
+
+def get_pipeline_batch(batch_id: str) -> list[str]:
+    """
+    Get the submission ids of a batch that has not been created yet.
+
+    :param batch_id:
+    :return:
+    """
+    return [submission_id.decode() for submission_id in redis.lrange(_pipeline_batch_key(batch_id), 0, -1)]
+
+
+def get_pipeline_batch_done(batch_id: str) -> set[str]:
+    """
+    Get the submission ids of a running batch whose containers have
+    finished, and whose logs were saved.
+
+    :param batch_id:
+    :return:
+    """
+    return {submission_id.decode() for submission_id in redis.smembers(_pipeline_batch_done_key(batch_id))}
+
+
+def mark_pipeline_batch_done(batch_id: str, submission_id: str):
+    pipe = redis.pipeline()
+    pipe.sadd(_pipeline_batch_done_key(batch_id), submission_id)
+    pipe.expire(_pipeline_batch_done_key(batch_id), PIPELINE_BATCH_TTL)
+    pipe.execute()
+
+
+def clear_pipeline_batch(batch_id: str):
+    redis.delete(_pipeline_batch_key(batch_id), _pipeline_batch_done_key(batch_id))
+
+
+def create_pipeline_batch(submission_ids: list[str], use_cache: bool = True):
+    """
+    Grade a batch of submissions in one pipeline pod. The submissions should
+    all be for the same assignment, as they share the pipeline image.
+    Submissions that can be graded from the result cache are left out.
+
+    :param submission_ids:
+    :param use_cache: check the pipeline result cache first
+    :return:
+    """
+    from anubis.lms.pipeline_cache import use_cached_pipeline_result
+
+    submissions: list[Submission] = Submission.query.filter(Submission.id.in_(submission_ids)).all()
+
+    pending_ids = []
+    for submission in submissions:
+        if use_cache and use_cached_pipeline_result(submission):
+            continue
+        pending_ids.append(submission.id)
+
+    if len(pending_ids) == 0:
+        return
+
+    batch_id = f"{PIPELINE_BATCH_PREFIX}{rand(12)}"
+    logger.info(f"Creating pipeline batch {batch_id} of {len(pending_ids)} submissions")
+
+    pipe = redis.pipeline()
+    pipe.rpush(_pipeline_batch_key(batch_id), *pending_ids)
+    pipe.expire(_pipeline_batch_key(batch_id), PIPELINE_BATCH_TTL)
+    pipe.execute()
+
+    create_batch_pipeline(batch_id)
+
+
+def create_batch_pipeline(batch_id: str, queue: str = "regrade"):
+    """
+    Create the pipeline job of a batch once it has a pipeline slot. The
+    batch waits for a slot in the bulk class, as one pipeline.
+
+    :param batch_id:
+    :param queue: rq queue the batch was enqueued on
+    :return:
+    """
+    submission_ids = get_pipeline_batch(batch_id)
+    if len(submission_ids) == 0:
+        logger.error(f"Unable to find pipeline batch {batch_id}")
+        release_pipeline_slot(batch_id)
+        return
+
+    acquired, _ = acquire_pipeline_slot(batch_id, batch_id, priority=PIPELINE_PRIORITY_BULK, queue=queue)
+    if not acquired:
+        logger.info(f"No pipeline slots free - waiting {batch_id}")
+        return
+
+    try:
+        _create_batch_pipeline(batch_id, submission_ids)
+    except Exception:
+        # Give the slot back if the job was never created
+        release_pipeline_slot(batch_id)
+        raise
+
+    redis.delete(_pipeline_batch_key(batch_id))
+
+
+def _create_batch_pipeline(batch_id: str, submission_ids: list[str]):
+    """
+    Create the pipeline job for a batch that holds a slot.
+
+    :param batch_id:
+    :param submission_ids:
+    :return:
+    """
+    from anubis.lms.pipeline_cache import get_pipeline_cache_key
+    from anubis.lms.submissions import init_submission
+
+    submissions: list[Submission] = Submission.query.filter(Submission.id.in_(submission_ids)).all()
+    submissions.sort(key=lambda submission: submission_ids.index(submission.id))
+    if len(submissions) == 0:
+        release_pipeline_slot(batch_id)
+        return
+
+    for submission in submissions:
+        # If the build field is not present, then
+        # we need to initialize the submission.
+        if submission.build is None:
+            init_submission(submission, commit=False)
+
+        submission.processed = False
+        submission.state = "Initializing Pipeline"
+        submission.pipeline_cache_key = get_pipeline_cache_key(submission)
+        db.session.add(submission)
+    db.session.commit()
+
+    # Create k8s job object
+    job = create_pipeline_batch_job_obj(batch_id, submissions)
+
+    # Log the pipeline job creation
+    logger.debug("creating pipeline batch job: " + job.to_str())
+
+    # Send to kube api
+    batch_v1 = get_batch_v1_api()
+    batch_v1.create_namespaced_job(body=job, namespace="anubis")
+
+
+def create_pipeline_batch_job_obj(batch_id: str, submissions: list[Submission]) -> client.V1Job:
+    """
+    Create k8s job object for a batch of submission pipelines.
+
+    Each submission gets its own container in the one pod. All but the
+    last are init containers, so k8s runs them one after another. The
+    pod is scheduled once and the image is pulled once, but every
+    submission still gets a fresh container filesystem, so nothing is
+    left over from the student directory of the submission before it.
+
+    :param batch_id:
+    :param submissions:
+    :return:
+    """
+
+    # The image is pulled for the first container. The rest
+    # use the image that is now on the node.
+    containers = [
+        create_pipeline_container(
+            submission,
+            name=get_pipeline_batch_container_name(index),
+            image_pull_policy=None if index == 0 else "IfNotPresent",
+        )
+        for index, submission in enumerate(submissions)
+    ]
+
+    # Each submission gets the usual pipeline timeout. The reaper
+    # enforces it per container, this is the backstop for the pod.
+    timeout_minutes = get_config_int("AUTOGRADE_PIPELINE_TIMEOUT_MINUTES", default=5)
+    active_deadline_seconds = len(submissions) * timeout_minutes * 60 + 60
+
+    # Create and configure a spec section
+    template = client.V1PodTemplateSpec(
+        metadata=client.V1ObjectMeta(
+            labels={
+                "app.kubernetes.io/name": "submission-pipeline",
+                "role":                   "submission-pipeline-worker",
+                "network-policy":         "submission-pipeline",
+                "submission-batch":       batch_id,
+            }
+        ),
+        spec=client.V1PodSpec(
+            restart_policy="Never",
+            init_containers=containers[:-1] or None,
+            containers=containers[-1:],
+            # Minimal service account with no extra permissions
+            service_account_name='theia-ide',
+            # Disable service information from being injected into the environment
+            enable_service_links=False,
+            # Don't mount service account tokens
+            automount_service_account_token=False,
+        ),
+    )
+
+    # Failed batches are not retried. The reaper gives the submissions
+    # that never started their own pipelines instead.
+    spec = client.V1JobSpec(
+        template=template,
+        backoff_limit=0,
+        active_deadline_seconds=active_deadline_seconds,
+        ttl_seconds_after_finished=300,
+    )
+
+    # Instantiate the job object
+    job = client.V1Job(
+        api_version="batch/v1",
+        kind="Job",
+        metadata=client.V1ObjectMeta(
+            name=f"submission-pipeline-{batch_id}",
+            labels={
+                "app.kubernetes.io/name": "submission-pipeline",
+                "role":                   "submission-pipeline-worker",
+                "submission-batch":       batch_id,
+            },
+            annotations={
+                PIPELINE_BATCH_ANNOTATION: ",".join(submission.id for submission in submissions),
+            },
+        ),
+        spec=spec,
+    )
+
+    return job
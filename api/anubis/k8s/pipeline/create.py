@@ -1,24 +1,45 @@
 import os
 import time
 
-from kubernetes import client, config
+from kubernetes import client
 
-from anubis.k8s.pipeline.get import get_active_pipeline_jobs
-from anubis.models import Submission, db
-from anubis.utils.config import get_config_int
+from anubis.k8s.api import get_batch_v1_api
+from anubis.k8s.pipeline.admission import (
+    PIPELINE_PRIORITY_BULK,
+    PIPELINE_PRIORITY_PUSH,
+    acquire_pipeline_slot,
+    holds_pipeline_slot,
+    release_pipeline_slot,
+)
+from anubis.models import Assignment, Submission, db
 from anubis.utils.data import is_debug
 from anubis.utils.logging import logger
 
 
-def create_submission_pipeline(submission_id: str):
+def create_submission_pipeline(
+    submission_id: str,
+    queue: str = "regrade",
+    priority: str = PIPELINE_PRIORITY_BULK,
+    use_cache: bool = True,
+):
     """
     This function should launch the appropriate testing container
     for the assignment, passing along the function arguments.
 
+    If there is no pipeline slot for the submission, it waits for
+    one. The pipeline poller enqueues it again once it is admitted.
+
+    If an identical submission was already graded, the results are
+    copied from it and no pipeline is created.
+
     :param submission_id: submission.id of to test
+    :param queue: rq queue the pipeline was enqueued on
+    :param priority: push, regrade or bulk
+    :param use_cache: check the pipeline result cache first
     """
-    from anubis.lms.submissions import init_submission
-    from anubis.rpc.enqueue import enqueue_autograde_pipeline
+    from anubis.lms.pipeline_cache import use_cached_pipeline_result
+    from anubis.lms.pipeline_pool import record_pipeline_push
+    from anubis.lms.submissions import get_pipeline_coalesce_key, supersede_submission
 
     # Log the creation event
     logger.info(
@@ -28,23 +49,6 @@ def create_submission_pipeline(submission_id: str):
         },
     )
 
-    # Calculate the maximum number of jobs allowed in the cluster
-    max_jobs = get_config_int("PIPELINE_MAX_JOBS", default=10)
-
-    # Initialize kube client
-    config.load_incluster_config()
-
-    # Cleanup finished jobs
-    active_jobs = len(get_active_pipeline_jobs())
-
-    if active_jobs > max_jobs:
-        logger.info(
-            "TOO many jobs - re-enqueue {}".format(submission_id),
-            extra={"submission_id": submission_id},
-        )
-        enqueue_autograde_pipeline(submission_id)
-        exit(0)
-
     # Get the database entry for the submission
     submission = Submission.query.filter(Submission.id == submission_id).first()
 
@@ -56,8 +60,111 @@ def create_submission_pipeline(submission_id: str):
                 "submission_id": submission_id,
             },
         )
+
+        # Give back the slot if the submission was admitted
+        release_pipeline_slot(submission_id)
+        return
+
+    # Submissions that were already admitted checked the cache before waiting
+    if use_cache and not holds_pipeline_slot(submission.id):
+        if use_cached_pipeline_result(submission):
+            logger.info(
+                "Pipeline result cache hit {}".format(submission.id),
+                extra={"submission_id": submission.id},
+            )
+            return
+
+    # Pushes can supersede older pushes that are still waiting,
+    # and size the warm pool of the assignment
+    coalesce_key = None
+    if priority == PIPELINE_PRIORITY_PUSH:
+        coalesce_key = get_pipeline_coalesce_key(submission)
+        record_pipeline_push(submission.assignment_id, submission.id)
+
+    # Take a pipeline slot, or wait for one
+    acquired, superseded_id = acquire_pipeline_slot(
+        submission.id,
+        submission.owner_id or "",
+        priority=priority,
+        queue=queue,
+        coalesce_key=coalesce_key,
+    )
+
+    # Skip the submission that this one superseded
+    if superseded_id is not None:
+        superseded = Submission.query.filter(Submission.id == superseded_id).first()
+        if superseded is not None:
+            logger.info(
+                "Superseded pipeline {} with {}".format(superseded_id, submission.id),
+                extra={"submission_id": superseded_id},
+            )
+            supersede_submission(superseded)
+            db.session.commit()
+
+    if not acquired:
+        logger.info(
+            "No pipeline slots free - waiting {}".format(submission_id),
+            extra={"submission_id": submission_id, "priority": priority},
+        )
         return
 
+    try:
+        if offer_submission_pipeline(submission):
+            return
+        _create_submission_pipeline(submission)
+    except Exception:
+        # Give the slot back if the job was never created
+        release_pipeline_slot(submission.id)
+        raise
+
+
+def offer_submission_pipeline(submission: Submission) -> bool:
+    """
+    Offer a submission that holds a slot to the warm pool of its
+    assignment, instead of creating a pipeline job for it.
+
+    :param submission:
+    :return: True if a pool job will claim it
+    """
+    from anubis.lms.pipeline_cache import get_pipeline_cache_key
+    from anubis.lms.pipeline_pool import is_pipeline_pool_enabled, offer_pipeline_to_pool
+    from anubis.lms.submissions import init_submission
+
+    if not is_pipeline_pool_enabled(submission.assignment_id):
+        return False
+
+    # If the build field is not present, then
+    # we need to initialize the submission.
+    if submission.build is None:
+        init_submission(submission, commit=True)
+
+    # Update the submission before a pool job can claim it
+    submission.processed = False
+    submission.state = "Waiting for a warm pipeline"
+    submission.pipeline_cache_key = get_pipeline_cache_key(submission)
+    db.session.commit()
+
+    if not offer_pipeline_to_pool(submission):
+        return False
+
+    logger.info(
+        "Offered pipeline to warm pool {}".format(submission.id),
+        extra={"submission_id": submission.id},
+    )
+
+    return True
+
+
+def _create_submission_pipeline(submission: Submission):
+    """
+    Create the pipeline job for a submission that holds a slot.
+
+    :param submission:
+    :return:
+    """
+    from anubis.lms.pipeline_cache import get_pipeline_cache_key
+    from anubis.lms.submissions import init_submission
+
     # If the build field is not present, then
     # we need to initialize the submission.
     if submission.build is None:
@@ -65,6 +172,7 @@ def create_submission_pipeline(submission_id: str):
 
     submission.processed = False
     submission.state = "Initializing Pipeline"
+    submission.pipeline_cache_key = get_pipeline_cache_key(submission)
     db.session.commit()
 
     # Create k8s job object
@@ -74,34 +182,53 @@ def create_submission_pipeline(submission_id: str):
     logger.debug("creating pipeline job: " + job.to_str())
 
     # Send to kube api
-    batch_v1 = client.BatchV1Api()
+    batch_v1 = get_batch_v1_api()
     batch_v1.create_namespaced_job(body=job, namespace="anubis")
 
 
-def create_pipeline_job_obj(submission: Submission) -> client.V1Job:
+def get_pipeline_resource_requirements(assignment: Assignment) -> client.V1ResourceRequirements:
     """
-    Create k8s job object for a submission pipeline.
+    Get the resource requests and limits of pipeline containers for an
+    assignment. These are the assignment override, or the ones learned
+    from previous pipelines, or conservative defaults.
 
-    :param submission:
+    :param assignment:
     :return:
     """
+    from anubis.lms.pipeline_resources import get_pipeline_resources
 
-    # set some conservative resources requests and limits
-    resource_requirements = {
-        "limits":   {"cpu": "2", "memory": "750Mi"},
-        "requests": {"cpu": "500m", "memory": "500Mi"},
-    }
+    resource_requirements = get_pipeline_resources(assignment)
 
     # If we are running in debug mode (like in minikube) then
     # we should skip setting resource requests and limits.
     if is_debug():
         resource_requirements = {}
 
+    return client.V1ResourceRequirements(**resource_requirements)
+
+
+def create_pipeline_container(
+    submission: Submission,
+    name: str = "pipeline",
+    image_pull_policy: str = None,
+) -> client.V1Container:
+    """
+    Create the pipeline container for a submission.
+
+    :param submission:
+    :param name: container name
+    :param image_pull_policy: defaults to the IMAGE_PULL_POLICY env var
+    :return:
+    """
+
+    if image_pull_policy is None:
+        image_pull_policy = os.environ.get("IMAGE_PULL_POLICY", default="Always")
+
     # Create the pipeline container from the submission object
-    container = client.V1Container(
-        name="pipeline",
+    return client.V1Container(
+        name=name,
         image=submission.assignment.pipeline_image,
-        image_pull_policy=os.environ.get("IMAGE_PULL_POLICY", default="Always"),
+        image_pull_policy=image_pull_policy,
         # setup the environment to include everything necessary for the
         # pipeline to be able to clone, test and report to the pipeline api.
         env=[
@@ -122,13 +249,25 @@ def create_pipeline_job_obj(submission: Submission) -> client.V1Job:
             f"--submission-id={submission.id}",
         ],
         # set the resource requirements
-        resources=client.V1ResourceRequirements(**resource_requirements),
+        resources=get_pipeline_resource_requirements(submission.assignment),
         # Add a security context to disable privilege escalation
         # security_context=client.V1SecurityContext(
         #     allow_privilege_escalation=False,
         # )
     )
 
+
+def create_pipeline_job_obj(submission: Submission) -> client.V1Job:
+    """
+    Create k8s job object for a submission pipeline.
+
+    :param submission:
+    :return:
+    """
+
+    # Create the pipeline container from the submission object
+    container = create_pipeline_container(submission)
+
     # Create and configure a spec section
     template = client.V1PodTemplateSpec(
         metadata=client.V1ObjectMeta(
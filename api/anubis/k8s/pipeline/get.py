@@ -1,8 +1,10 @@
 from kubernetes import client
 
+from anubis.k8s.api import get_batch_v1_api
+
 
 def get_active_pipeline_jobs() -> list[client.V1Job]:
-    batch_v1 = client.BatchV1Api()
+    batch_v1 = get_batch_v1_api()
 
     # Get all pipeline jobs in the anubis namespace
     jobs = batch_v1.list_namespaced_job(
@@ -0,0 +1,161 @@
+import traceback
+from datetime import datetime, timezone
+
+import kubernetes
+from kubernetes import client
+
+from anubis.k8s.api import get_core_v1_api
+from anubis.lms.pipeline_logs import append_pipeline_log, get_pipeline_log_cursor
+from anubis.utils.logging import logger
+
+# Most bytes read from a pipeline pod log at once
+PIPELINE_LOG_READ_BYTES = 2 ** 20
+
+# Extra seconds read back past the cursor, to cover clock skew
+# between the poller and the node. Lines already captured are
+# skipped by timestamp.
+PIPELINE_LOG_SINCE_SLACK = 5
+
+
+def _normalize_log_timestamp(timestamp: str) -> str:
+    """
+    Pod log timestamps are RFC3339 with up to nanoseconds, and trailing
+    zeros trimmed. Pad the fraction so timestamps compare as strings.
+
+    :param timestamp:
+    :return:
+    """
+    timestamp = timestamp.rstrip("Z")
+    seconds, _, fraction = timestamp.partition(".")
+    return f"{seconds}.{fraction:0<9}"
+
+
+def get_pipeline_job_pod(job: client.V1Job, pending: bool = False) -> client.V1Pod | None:
+    """
+    Get the newest pod of a pipeline job that has started. Failed pods
+    are included, so that their logs can be captured.
+
+    Batch pipeline pods stay pending while their init containers run,
+    so they are looked up with pending.
+
+    :param job:
+    :param pending: include pods that are still pending
+    :return:
+    """
+    v1 = get_core_v1_api()
+    pods = v1.list_namespaced_pod(
+        namespace=job.metadata.namespace,
+        label_selector=f"job-name={job.metadata.name}",
+    )
+
+    return pick_pipeline_job_pod(pods.items, pending=pending)
+
+
+def pick_pipeline_job_pod(pods: list[client.V1Pod], pending: bool = False) -> client.V1Pod | None:
+    """
+    Pick the newest pod that has started out of the pods of a pipeline
+    job. The pipeline poller keeps the pods of each job from its watch
+    stream, so it does not need to list them.
+
+    :param pods: pods of the job
+    :param pending: include pods that are still pending
+    :return:
+    """
+    phases = ("Pending", "Running", "Succeeded", "Failed") if pending else ("Running", "Succeeded", "Failed")
+    started = [pod for pod in pods if pod.status is not None and pod.status.phase in phases]
+    if len(started) == 0:
+        return None
+
+    return max(started, key=lambda pod: pod.metadata.creation_timestamp)
+
+
+def capture_pipeline_log(
+    job: client.V1Job,
+    submission_id: str,
+    container: str = "pipeline",
+    pod: client.V1Pod = None,
+) -> int:
+    """
+    Read the part of a pipeline pod log that has not been captured yet,
+    and append it to the pipeline log store. The cursor is the timestamp
+    of the last line captured, and the number of lines captured with that
+    timestamp. Only the seconds since the cursor are read from the pod.
+
+    If the job started a new pod (the last one failed), the new pod log
+    is captured from its start.
+
+    :param job:
+    :param submission_id:
+    :param container: container of the submission in the pod
+    :param pod: pod of the job, if it was already looked up
+    :return: number of characters captured
+    """
+    if pod is None:
+        pod = get_pipeline_job_pod(job)
+    if pod is None:
+        return 0
+
+    cursor = get_pipeline_log_cursor(submission_id)
+    header = ""
+    if cursor.get("pod", None) != pod.metadata.name:
+        if "pod" in cursor:
+            header = f"\n--- pipeline pod {pod.metadata.name} ---\n"
+        cursor = {"pod": pod.metadata.name, "time": "", "seen": "0"}
+
+    cursor_time = cursor["time"]
+    cursor_seen = int(cursor["seen"])
+
+    # Only read back to the cursor
+    since_seconds = None
+    if cursor_time != "":
+        cursor_datetime = datetime.strptime(cursor_time[:26], "%Y-%m-%dT%H:%M:%S.%f").replace(tzinfo=timezone.utc)
+        since_seconds = int((datetime.now(timezone.utc) - cursor_datetime).total_seconds()) + PIPELINE_LOG_SINCE_SLACK
+
+    v1 = get_core_v1_api()
+    try:
+        raw_log: str = v1.read_namespaced_pod_log(
+            name=pod.metadata.name,
+            namespace=pod.metadata.namespace,
+            container=container,
+            timestamps=True,
+            since_seconds=since_seconds,
+            limit_bytes=PIPELINE_LOG_READ_BYTES,
+        )
+    except kubernetes.client.exceptions.ApiException:
+        logger.error("failed to get pod logs, continuing" + traceback.format_exc())
+        return 0
+
+    lines = raw_log.splitlines(keepends=True)
+
+    # The read may have stopped in the middle of a line. Leave
+    # it for the next read.
+    if len(lines) > 1 and not lines[-1].endswith("\n"):
+        lines = lines[:-1]
+
+    captured = []
+    for line in lines:
+        timestamp, _, text = line.partition(" ")
+        timestamp = _normalize_log_timestamp(timestamp)
+
+        # Skip lines from before the cursor, and lines at
+        # the cursor that were already captured
+        if timestamp < cursor_time:
+            continue
+        if timestamp == cursor_time:
+            if cursor_seen > 0:
+                cursor_seen -= 1
+                continue
+            cursor["seen"] = str(int(cursor["seen"]) + 1)
+        else:
+            cursor_time = timestamp
+            cursor_seen = 0
+            cursor["time"] = timestamp
+            cursor["seen"] = "1"
+
+        captured.append(text)
+
+    text = header + "".join(captured)
+    if len(captured) > 0:
+        append_pipeline_log(submission_id, text, cursor)
+
+    return len(text)
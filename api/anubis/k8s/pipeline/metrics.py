@@ -0,0 +1,47 @@
+import traceback
+
+import kubernetes
+from kubernetes import client
+
+from anubis.k8s.api import get_custom_objects_api
+from anubis.lms.pipeline_resources import parse_cpu_millicores, parse_memory_mib, record_pipeline_resource_sample
+from anubis.utils.logging import logger
+
+
+def sample_pipeline_resources(pod: client.V1Pod, submission_id: str, container: str = "pipeline"):
+    """
+    Read the current cpu and memory usage of a pipeline container from
+    the metrics api, and keep the peak for the submission. If the
+    cluster has no metrics server, nothing is sampled.
+
+    :param pod:
+    :param submission_id:
+    :param container:
+    :return:
+    """
+    custom_objects = get_custom_objects_api()
+    try:
+        metrics = custom_objects.get_namespaced_custom_object(
+            group="metrics.k8s.io",
+            version="v1beta1",
+            namespace=pod.metadata.namespace,
+            plural="pods",
+            name=pod.metadata.name,
+        )
+    except kubernetes.client.exceptions.ApiException as e:
+        # Pods only show up in the metrics api after their first scrape
+        if e.status != 404:
+            logger.error("failed to get pod metrics, continuing" + traceback.format_exc())
+        return
+
+    for container_metrics in metrics.get("containers", []):
+        if container_metrics.get("name", None) != container:
+            continue
+
+        usage = container_metrics.get("usage", {})
+        cpu_millicores = parse_cpu_millicores(usage.get("cpu", "0"))
+        memory_mib = parse_memory_mib(usage.get("memory", "0"))
+        if cpu_millicores is None or memory_mib is None:
+            return
+
+        record_pipeline_resource_sample(submission_id, cpu_millicores, memory_mib)
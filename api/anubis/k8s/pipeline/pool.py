@@ -0,0 +1,244 @@
+import os
+import time
+import traceback
+from collections import defaultdict
+
+import kubernetes
+from kubernetes import client
+
+from anubis.k8s.api import get_batch_v1_api
+from anubis.k8s.pipeline.admission import release_pipeline_slot
+from anubis.k8s.pipeline.create import _create_submission_pipeline, get_pipeline_resource_requirements
+from anubis.lms.pipeline_pool import (
+    get_pipeline_pool_claims,
+    get_pipeline_pool_config,
+    get_pipeline_pool_size,
+    register_pipeline_pool_job,
+    release_pipeline_pool_claims,
+    retire_pipeline_pool_job,
+    set_pipeline_pool_idle,
+    take_expired_pipeline_offers,
+)
+from anubis.models import Assignment, Submission
+from anubis.utils.data import rand
+from anubis.utils.logging import logger
+from anubis.utils.redis import redis
+
+# Pool jobs are patched with this annotation when they claim a submission.
+# The reaper times claimed jobs from it, instead of from job creation.
+PIPELINE_POOL_CLAIMED_ANNOTATION = "anubis/claimed-at"
+
+
+def create_pipeline_pool_job_obj(assignment: Assignment, job_name: str, token: str) -> client.V1Job:
+    """
+    Create k8s job object for an idle warm pool pipeline. The pipeline
+    starts in claim mode, where it asks the pipeline api for work with
+    its job name and token, and then runs the claimed submission.
+
+    :param assignment:
+    :param job_name:
+    :param token:
+    :return:
+    """
+
+    # Create the pipeline container in claim mode
+    container = client.V1Container(
+        name="pipeline",
+        image=assignment.pipeline_image,
+        image_pull_policy=os.environ.get("IMAGE_PULL_POLICY", default="Always"),
+        env=[
+            client.V1EnvVar(name="TOKEN", value=token),
+            client.V1EnvVar(
+                name="GIT_CRED",
+                value_from=client.V1EnvVarSource(
+                    secret_key_ref=client.V1SecretKeySelector(name="git", key="credentials")
+                ),
+            ),
+        ],
+        args=[
+            f"--prod",
+            f"--claim",
+            f"--pool-job={job_name}",
+            f"--path=./student",
+        ],
+        # set the resource requirements
+        resources=get_pipeline_resource_requirements(assignment),
+    )
+
+    # Create and configure a spec section
+    template = client.V1PodTemplateSpec(
+        metadata=client.V1ObjectMeta(
+            labels={
+                "app.kubernetes.io/name": "submission-pipeline",
+                "role":                   "submission-pipeline-worker",
+                "network-policy":         "submission-pipeline",
+                "pipeline-pool":          assignment.id,
+            }
+        ),
+        spec=client.V1PodSpec(
+            restart_policy="Never",
+            containers=[container],
+            # Minimal service account with no extra permissions
+            service_account_name='theia-ide',
+            # Disable service information from being injected into the environment
+            enable_service_links=False,
+            # Don't mount service account tokens
+            automount_service_account_token=False,
+        ),
+    )
+
+    # Pool jobs are not retried. The controller replaces them instead.
+    spec = client.V1JobSpec(template=template, backoff_limit=0, ttl_seconds_after_finished=300)
+
+    # Instantiate the job object
+    return client.V1Job(
+        api_version="batch/v1",
+        kind="Job",
+        metadata=client.V1ObjectMeta(
+            name=job_name,
+            labels={
+                "app.kubernetes.io/name": "submission-pipeline",
+                "role":                   "submission-pipeline-worker",
+                "pipeline-pool":          assignment.id,
+            },
+        ),
+        spec=spec,
+    )
+
+
+def create_pipeline_pool_job(assignment: Assignment):
+    """
+    Start a new idle pool job for an assignment.
+
+    :param assignment:
+    :return:
+    """
+    job_name = f"submission-pipeline-pool-{rand(12)}"
+    token = register_pipeline_pool_job(job_name, assignment.id)
+    job = create_pipeline_pool_job_obj(assignment, job_name, token)
+
+    logger.info(f"creating pipeline pool job {job_name} for {assignment.name}")
+
+    batch_v1 = get_batch_v1_api()
+    try:
+        batch_v1.create_namespaced_job(body=job, namespace="anubis")
+    except kubernetes.client.exceptions.ApiException:
+        retire_pipeline_pool_job(job_name)
+        logger.error("failed to create pipeline pool job, continuing" + traceback.format_exc())
+
+
+def mark_pipeline_pool_job_claimed(job_name: str, submission_id: str) -> bool:
+    """
+    Label a pool job with the submission it claimed. From then on it is
+    reaped like any other pipeline job.
+
+    If the job is gone before it could be labeled, nothing will reap it,
+    so the pipeline slot of the submission is given back.
+
+    :param job_name:
+    :param submission_id:
+    :return: True if the claim is settled, False if it should be tried again
+    """
+    batch_v1 = get_batch_v1_api()
+    try:
+        batch_v1.patch_namespaced_job(
+            job_name,
+            "anubis",
+            body={
+                "metadata": {
+                    "labels":      {"submission-id": submission_id},
+                    "annotations": {PIPELINE_POOL_CLAIMED_ANNOTATION: str(time.time())},
+                }
+            },
+        )
+    except kubernetes.client.exceptions.ApiException as e:
+        if e.status == 404:
+            logger.error(f"claimed pipeline pool job {job_name} is gone, releasing {submission_id}")
+            release_pipeline_slot(submission_id)
+            return True
+        logger.error("failed to label claimed pipeline pool job, continuing" + traceback.format_exc())
+        return False
+
+    return True
+
+
+def reconcile_pipeline_pools(jobs: list[client.V1Job]):
+    """
+    Bring the warm pools in line with recent pushes. Pool jobs that
+    claimed a submission are labeled with it, finished idle jobs are
+    cleaned up, and idle jobs are started or retired so each pooled
+    assignment has the pool size for its push rate. Offers that were
+    not claimed in time get pipeline jobs of their own.
+
+    :param jobs: all pipeline jobs
+    :return:
+    """
+    from anubis.k8s.pipeline.reap import _pipeline_job_failed, delete_pipeline_job
+
+    if redis is None:
+        return
+
+    # Label jobs that claimed a submission. Claims are only let go once
+    # the label is on, so that a failed patch is tried again next pass.
+    claims = get_pipeline_pool_claims()
+    settled = []
+    for job_name, submission_id in claims.items():
+        if mark_pipeline_pool_job_claimed(job_name, submission_id):
+            settled.append(job_name)
+    release_pipeline_pool_claims(settled)
+
+    # Idle pool jobs, by assignment id
+    idle: dict[str, list[client.V1Job]] = defaultdict(list)
+    for job in jobs:
+        labels = job.metadata.labels or {}
+        if 'pipeline-pool' not in labels or 'submission-id' in labels:
+            continue
+
+        # Jobs that claimed a submission are not idle, labeled or not
+        if job.metadata.name in claims:
+            continue
+
+        # Clean up idle jobs that exited without claiming anything
+        finished = job.status.succeeded is not None and job.status.succeeded >= 1
+        if finished or _pipeline_job_failed(job):
+            if retire_pipeline_pool_job(job.metadata.name):
+                delete_pipeline_job(job)
+            continue
+
+        idle[labels['pipeline-pool']].append(job)
+
+    pool_config = get_pipeline_pool_config()
+    for assignment_id in set(pool_config["assignments"]) | set(idle.keys()):
+        size = get_pipeline_pool_size(assignment_id)
+        assignment_jobs = sorted(idle[assignment_id], key=lambda job: job.metadata.creation_timestamp)
+
+        # Start idle jobs up to the pool size
+        if len(assignment_jobs) < size:
+            assignment = Assignment.query.filter(Assignment.id == assignment_id).first()
+            if assignment is None or assignment.pipeline_image is None:
+                continue
+            for _ in range(size - len(assignment_jobs)):
+                create_pipeline_pool_job(assignment)
+
+        # Retire the oldest idle jobs past the pool size
+        retired = 0
+        for job in assignment_jobs[: max(len(assignment_jobs) - size, 0)]:
+            if retire_pipeline_pool_job(job.metadata.name):
+                delete_pipeline_job(job)
+                retired += 1
+
+        set_pipeline_pool_idle(assignment_id, max(len(assignment_jobs), size) - retired)
+
+    # Offers that no pool job claimed get their own pipeline job.
+    # They already hold a pipeline slot.
+    for submission_id in take_expired_pipeline_offers():
+        submission = Submission.query.filter(Submission.id == submission_id).first()
+        if submission is None:
+            continue
+
+        logger.info(f"pipeline pool offer expired, creating pipeline job {submission_id}")
+        try:
+            _create_submission_pipeline(submission)
+        except Exception:
+            logger.error("failed to create pipeline job for expired offer" + traceback.format_exc())
+            release_pipeline_slot(submission_id)
@@ -1,28 +1,74 @@
 import traceback
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 
 import kubernetes
 from kubernetes import client
 
+from anubis.k8s.api import get_batch_v1_api
+from anubis.k8s.pipeline.admission import (
+    PIPELINE_PRIORITY_BULK,
+    admit_waiting_pipelines,
+    release_pipeline_slot,
+    renew_pipeline_slots,
+)
+from anubis.k8s.pipeline.batch import (
+    PIPELINE_BATCH_ANNOTATION,
+    clear_pipeline_batch,
+    get_pipeline_batch_container_name,
+    get_pipeline_batch_done,
+    mark_pipeline_batch_done,
+)
 from anubis.k8s.pipeline.get import get_active_pipeline_jobs
+from anubis.k8s.pipeline.logs import capture_pipeline_log, get_pipeline_job_pod, pick_pipeline_job_pod
+from anubis.k8s.pipeline.metrics import sample_pipeline_resources
+from anubis.k8s.pipeline.pool import PIPELINE_POOL_CLAIMED_ANNOTATION, reconcile_pipeline_pools
+from anubis.lms.pipeline_cache import parse_pipeline_image_digest, record_pipeline_image_digest
+from anubis.lms.pipeline_logs import flush_pipeline_log
+from anubis.lms.pipeline_resources import parse_memory_mib, save_pipeline_profile
 from anubis.models import Submission, db
 from anubis.utils.config import get_config_int
+from anubis.utils.lease import PollerLease, get_poller_lease_members
 from anubis.utils.logging import logger
-from anubis.utils.redis import create_redis_lock
 
+# Lease group the pipeline poller replicas share the pipeline jobs in
+PIPELINE_POLLER_LEASE_GROUP = "pipeline-poller"
+
+
+def reap_pipeline_job(job: client.V1Job, submission: Submission, pod: client.V1Pod = None):
+    if pod is None:
+        pod = get_pipeline_job_pod(job)
+
+    # Capture the rest of the pipeline log, and save it to the submission
+    if pod is not None:
+        capture_pipeline_log(job, submission.id, pod=pod)
+    flush_pipeline_log(submission)
+
+    # Record the image digest the submission was graded on, for the result cache
+    record_pipeline_image_digest(submission, _get_pipeline_image_digest(pod))
+
+    # Profile the resources used by pipelines that finished. Failed
+    # pipelines are profiled too, so that running out of memory
+    # raises the memory limit learned for the assignment image.
+    if is_pipeline_job_done(job):
+        oom_killed, memory_limit_mib = _get_pipeline_pod_oom(pod)
+        save_pipeline_profile(
+            submission,
+            _get_pipeline_job_duration(job),
+            oom_killed=oom_killed,
+            memory_limit_mib=memory_limit_mib,
+        )
 
-def reap_pipeline_job(job: client.V1Job, submission: Submission):
-    # Capture the pipeline log
-    submission.pipeline_log = _read_pipeline_job_log(job)
-    db.session.add(submission)
     db.session.commit()
 
     # Attempt to delete the k8s job
     delete_pipeline_job(job)
 
+    # Free up the pipeline slot
+    release_pipeline_slot(submission.id)
+
 
 def delete_pipeline_job(job: client.V1Job):
-    batch_v1 = client.BatchV1Api()
+    batch_v1 = get_batch_v1_api()
 
     # Log that we are cleaning up the job
     logger.info("deleting namespaced job {}".format(job.metadata.name))
@@ -36,94 +82,348 @@ def delete_pipeline_job(job: client.V1Job):
         logger.error("failed to delete api job, continuing" + traceback.format_exc())
 
 
-def _read_pipeline_job_log(job: client.V1Job) -> str:
-    v1 = client.CoreV1Api()
-    logger.info(f'Reading logs for job: {job.metadata.name}')
-    pods = v1.list_namespaced_pod(
-        namespace=job.metadata.namespace,
-        label_selector=f"job-name={job.metadata.name}"
-    )
+def _get_pipeline_job_duration(job: client.V1Job) -> int:
+    """
+    Get how many seconds a pipeline job ran. Warm pool jobs
+    are timed from when they claimed their submission.
 
-    pod = None
-    for _pod in pods.items:
-        if _pod.status.phase == "Succeeded":
-            pod = _pod
-            break
-    else:
-        logger.error(f"could not find successful pod for job: {job.metadata.name}")
-        return ''
+    :param job:
+    :return:
+    """
+    started = job.status.start_time or job.metadata.creation_timestamp
+    claimed_at = (job.metadata.annotations or {}).get(PIPELINE_POOL_CLAIMED_ANNOTATION, None)
+    if claimed_at is not None:
+        started = datetime.fromtimestamp(float(claimed_at), tz=timezone.utc)
+    finished = job.status.completion_time or datetime.now(timezone.utc)
+    return max(int((finished - started).total_seconds()), 0)
 
-    try:
-        return v1.read_namespaced_pod_log(
-            name=pod.metadata.name,
-            namespace=pod.metadata.namespace,
-            container="pipeline",
-        )[:(2 ** 16) - 1]  # TODO put max TEXT length in constants.py
-    except kubernetes.client.exceptions.ApiException:
-        logger.error("failed to get pod logs, continuing" + traceback.format_exc())
-        return 'UNABLE TO GET PIPELINE LOG'
 
+def _get_pipeline_image_digest(pod: client.V1Pod | None, container: str = "pipeline") -> str | None:
+    """
+    Get the digest of the image a pipeline container ran, from the
+    image id in its container status.
 
-def reap_pipeline_jobs():
+    :param pod:
+    :param container: container of the submission in the pod
+    :return:
     """
-    Runs through all jobs in the namespace. If the job is finished, it will
-    send a request to the kube api to delete it. Number of active jobs is
-    returned.
+    if pod is None or pod.status is None:
+        return None
 
-    :return: number of active jobs
+    for status in (pod.status.init_container_statuses or []) + (pod.status.container_statuses or []):
+        if status.name == container:
+            return parse_pipeline_image_digest(status.image_id)
+
+    return None
+
+
+def _get_pipeline_pod_oom(pod: client.V1Pod | None) -> tuple[bool, int | None]:
     """
+    Check if the pipeline container of a pod was killed for going
+    over its memory limit.
 
-    # Get the batch v1 object so we can query for active k8s jobs
-    batch_v1 = client.BatchV1Api()
+    :param pod:
+    :return: if it was oom killed, and the memory limit in MiB
+    """
+    if pod is None:
+        return False, None
 
-    # Get all pipeline jobs in the anubis namespace
-    jobs = get_active_pipeline_jobs()
+    memory_limit_mib = None
+    for container in pod.spec.containers:
+        if container.name == "pipeline" and container.resources is not None and container.resources.limits:
+            memory_limit_mib = parse_memory_mib(container.resources.limits.get("memory", ""))
+
+    for status in pod.status.container_statuses or []:
+        if status.name != "pipeline":
+            continue
+        for state in (status.state, status.last_state):
+            if state is not None and state.terminated is not None and state.terminated.reason == "OOMKilled":
+                return True, memory_limit_mib
+
+    return False, memory_limit_mib
+
+
+def _get_job_pod(job: client.V1Job, pods: list[client.V1Pod] | None, pending: bool = False) -> client.V1Pod | None:
+    """
+    Get the pod of a pipeline job from the pods known from the watch
+    stream, or from the kube api if the pods are not known.
+
+    :param job:
+    :param pods: pods of the job from the watch stream
+    :param pending: include pods that are still pending
+    :return:
+    """
+    if pods is None:
+        return get_pipeline_job_pod(job, pending=pending)
+    return pick_pipeline_job_pod(pods, pending=pending)
+
+
+def _pipeline_job_failed(job: client.V1Job) -> bool:
+    """
+    A pipeline job has failed once k8s gives up on retrying its pods.
+
+    :param job:
+    :return:
+    """
+    for condition in job.status.conditions or []:
+        if condition.type == "Failed" and condition.status == "True":
+            return True
+    return False
+
+
+def _flush_batch_submission_log(job: client.V1Job, pod: client.V1Pod, submission_id: str, container: str):
+    """
+    Capture the rest of the log of one submission in a batch pipeline
+    pod, and save it to the submission.
+
+    :param job:
+    :param pod:
+    :param submission_id:
+    :param container:
+    :return:
+    """
+    submission: Submission = Submission.query.filter(Submission.id == submission_id).first()
+    if submission is None:
+        return
+
+    capture_pipeline_log(job, submission_id, container=container, pod=pod)
+    flush_pipeline_log(submission)
+    record_pipeline_image_digest(submission, _get_pipeline_image_digest(pod, container))
+    db.session.commit()
+
+
+def reap_pipeline_batch_job(job: client.V1Job, pods: list[client.V1Pod] = None, capture: bool = True) -> bool:
+    """
+    Inspect a batch pipeline job. The logs of submissions whose containers
+    have finished are saved as they finish. A submission container that runs
+    past the pipeline timeout ends the whole batch.
+
+    When the batch ends, the job is deleted and its slot freed. Submissions
+    whose containers never started get pipelines of their own.
+
+    :param job:
+    :param pods: pods of the job from the watch stream, listed if not given
+    :param capture: capture the log of the running container
+    :return: True if the batch is still running
+    """
+    from anubis.rpc.enqueue import enqueue_autograde_pipeline
+
+    batch_id = job.metadata.labels["submission-batch"]
+    submission_ids = (job.metadata.annotations or {}).get(PIPELINE_BATCH_ANNOTATION, "").split(",")
+    submission_ids = [submission_id for submission_id in submission_ids if submission_id != ""]
+
+    # Get the autograde pipeline timeout from config. It applies
+    # to each submission in the batch.
+    timeout = timedelta(minutes=get_config_int("AUTOGRADE_PIPELINE_TIMEOUT_MINUTES", default=5))
+
+    # Container statuses of the pod, by container name
+    pod = _get_job_pod(job, pods, pending=True)
+    statuses = {}
+    if pod is not None:
+        for status in (pod.status.init_container_statuses or []) + (pod.status.container_statuses or []):
+            statuses[status.name] = status
+
+    now = datetime.now(timezone.utc)
+    done = get_pipeline_batch_done(batch_id)
+    started = []
+    timed_out = False
+
+    for index, submission_id in enumerate(submission_ids):
+        container = get_pipeline_batch_container_name(index)
+        status = statuses.get(container, None)
+        if status is None or status.state is None:
+            continue
+
+        # Save the log of containers as they finish
+        if status.state.terminated is not None:
+            started.append(submission_id)
+            if submission_id not in done:
+                _flush_batch_submission_log(job, pod, submission_id, container)
+                mark_pipeline_batch_done(batch_id, submission_id)
+                done.add(submission_id)
+
+        # Capture the log of the running container, and check its timeout
+        elif status.state.running is not None:
+            started.append(submission_id)
+            if capture:
+                capture_pipeline_log(job, submission_id, container=container, pod=pod)
+            if status.state.running.started_at is not None and now - status.state.running.started_at > timeout:
+                logger.info(f"pipeline batch {batch_id} timed out on {submission_id}")
+                timed_out = True
+
+    # Calculate job created time
+    job_created = job.metadata.creation_timestamp.replace(tzinfo=None)
+    expired = datetime.utcnow() - job_created > timeout * len(submission_ids) + timedelta(minutes=1)
+
+    succeeded = job.status.succeeded is not None and job.status.succeeded >= 1
+    if not (succeeded or timed_out or expired or _pipeline_job_failed(job)):
+        return True
+
+    # Save the logs of submissions that were cut off
+    for index, submission_id in enumerate(submission_ids):
+        if submission_id in started and submission_id not in done:
+            _flush_batch_submission_log(job, pod, submission_id, get_pipeline_batch_container_name(index))
+
+    # Attempt to delete the k8s job
+    delete_pipeline_job(job)
+
+    # Free up the pipeline slot
+    release_pipeline_slot(batch_id)
+    clear_pipeline_batch(batch_id)
+
+    # Submissions that never started get their own pipelines
+    for submission_id in submission_ids:
+        if submission_id not in started:
+            logger.info(f"re-enqueueing {submission_id} from pipeline batch {batch_id}")
+            enqueue_autograde_pipeline(submission_id, queue="regrade", priority=PIPELINE_PRIORITY_BULK, use_cache=False)
+
+    return False
+
+
+def is_pipeline_job_done(job: client.V1Job) -> bool:
+    """
+    A pipeline job is done once it succeeded, or k8s gave up on it.
+
+    :param job:
+    :return:
+    """
+    return (job.status.succeeded is not None and job.status.succeeded >= 1) or _pipeline_job_failed(job)
+
+
+def is_pipeline_job_timed_out(job: client.V1Job) -> bool:
+    """
+    Check if a single submission pipeline job has run past the autograde
+    pipeline timeout. Warm pool jobs start their pipeline when they claim
+    the submission, so they are timed from the claim.
+
+    :param job:
+    :return:
+    """
 
     # Get the autograde pipeline timeout from config
     autograde_pipeline_timeout_minutes = get_config_int("AUTOGRADE_PIPELINE_TIMEOUT_MINUTES", default=5)
 
-    # Iterate through all pipeline jobs
-    for job in jobs:
-        job: client.V1Job
+    # Calculate job created time
+    job_created = job.metadata.creation_timestamp.replace(tzinfo=None)
+    claimed_at = (job.metadata.annotations or {}).get(PIPELINE_POOL_CLAIMED_ANNOTATION, None)
+    if claimed_at is not None:
+        job_created = datetime.utcfromtimestamp(float(claimed_at))
 
-        # If submission id not in labels just skip. Job ttl will delete itself.
-        if 'submission-id' not in job.metadata.labels:
-            logger.error(f'skipping job based off old label format: {job.metadata.name}')
-            continue
+    return datetime.utcnow() - job_created > timedelta(minutes=autograde_pipeline_timeout_minutes)
 
-        # Read submission id from labels
-        submission_id = job.metadata.labels['submission-id']
 
-        # Create a distributed lock for the submission job
-        lock = create_redis_lock(f'submission-job-{submission_id}')
-        if not lock.acquire(blocking=False):
-            continue
+def inspect_pipeline_job(job: client.V1Job, capture: bool = True, pods: list[client.V1Pod] = None) -> str | None:
+    """
+    Reap a pipeline job if it is done or has run out of time. Otherwise
+    capture what it has logged since the last pass. The submission is
+    only loaded from the database when the job is reaped.
 
-        # Log that we are inspecting the pipeline
-        logger.debug(f'inspecting pipeline: {job.metadata.name}')
+    Jobs are not locked. Only the pipeline poller replica that owns the
+    job through its lease should inspect it.
 
-        # Get database record of the submission
-        submission: Submission = Submission.query.filter(
-            Submission.id == submission_id,
-        ).first()
-        if submission is None:
-            logger.error(f"submission from db not found {submission_id}")
-            continue
+    :param job:
+    :param capture: capture the log and sample the resources of running jobs
+    :param pods: pods of the job from the watch stream, listed if not given
+    :return: the id holding the pipeline slot of the job, if it is still running
+    """
+    labels = job.metadata.labels or {}
+
+    # Idle warm pool jobs are handled by the pool controller
+    if 'pipeline-pool' in labels and 'submission-id' not in labels:
+        return None
+
+    # Batch pipelines hold one slot under their batch id
+    if 'submission-batch' in labels:
+        batch_id = labels['submission-batch']
+        return batch_id if reap_pipeline_batch_job(job, pods=pods, capture=capture) else None
+
+    # If submission id not in labels just skip. Job ttl will delete itself.
+    if 'submission-id' not in labels:
+        logger.error(f'skipping job based off old label format: {job.metadata.name}')
+        return None
+
+    # Read submission id from labels
+    submission_id = labels['submission-id']
 
-        # Calculate job created time
-        job_created = job.metadata.creation_timestamp.replace(tzinfo=None)
+    # Log that we are inspecting the pipeline
+    logger.debug(f'inspecting pipeline: {job.metadata.name}')
 
-        # Delete the job if it is older than a few minutes
-        if datetime.utcnow() - job_created > timedelta(minutes=autograde_pipeline_timeout_minutes):
+    # If the pipeline is still running, capture what it
+    # has logged since the last pass
+    if not is_pipeline_job_done(job) and not is_pipeline_job_timed_out(job):
+        if capture:
+            pod = _get_job_pod(job, pods)
+            if pod is not None:
+                capture_pipeline_log(job, submission_id, pod=pod)
+                sample_pipeline_resources(pod, submission_id)
+        return submission_id
 
-            # Attempt to delete the k8s job
-            reap_pipeline_job(job, submission)
+    # Get database record of the submission
+    submission: Submission = Submission.query.filter(
+        Submission.id == submission_id,
+    ).first()
+    if submission is None:
+        logger.error(f"submission from db not found {submission_id}")
+        return None
+
+    # The job finished, ran out of retries, or is older than the
+    # timeout. Failed jobs are cleaned up while the failed pod log
+    # can still be read.
+    reap_pipeline_job(job, submission, pod=pick_pipeline_job_pod(pods) if pods is not None else None)
+    return None
+
+
+def reap_pipeline_jobs(
+    jobs: list[client.V1Job] = None,
+    lease: PollerLease = None,
+    pods: dict[str, list[client.V1Pod]] = None,
+    capture: bool = True,
+) -> int:
+    """
+    Runs through all jobs in the namespace. If the job is finished, it will
+    send a request to the kube api to delete it. Number of active jobs is
+    returned.
+
+    With a lease, only the jobs assigned to this poller replica are
+    inspected, and the warm pools are only reconciled by the leader.
+    Without one, every job is inspected, unless pipeline poller replicas
+    are running. Those share the jobs between them without locks.
+
+    :param jobs: pipeline jobs to inspect, listed from the kube api if not given
+    :param lease: pipeline poller lease of this replica
+    :param pods: job name -> pods of the job, from the watch stream. The pods
+                 of each job are listed from the kube api if not given.
+    :param capture: capture the logs and sample the resources of running jobs
+    :return: number of active jobs
+    """
+
+    if lease is None and len(get_poller_lease_members(PIPELINE_POLLER_LEASE_GROUP)) > 0:
+        logger.debug("pipeline pollers are running, skipping pipeline reap")
+        return 0
+
+    # Get all pipeline jobs in the anubis namespace
+    if jobs is None:
+        jobs = get_active_pipeline_jobs()
+
+    # Submissions with pipelines that are still running
+    running_submission_ids = []
+
+    # Iterate through the pipeline jobs of this replica
+    for job in jobs:
+        if lease is not None and not lease.owns(job.metadata.name):
+            continue
+        job_pods = pods.get(job.metadata.name, []) if pods is not None else None
+        slot_id = inspect_pipeline_job(job, capture=capture, pods=job_pods)
+        if slot_id is not None:
+            running_submission_ids.append(slot_id)
 
-        # If the job has finished, and was marked as successful, then
-        # we can clean it up
-        elif job.status.succeeded is not None and job.status.succeeded >= 1:
+    # Start, retire and label warm pool jobs
+    if lease is None or lease.is_leader():
+        reconcile_pipeline_pools(jobs)
 
-            # Attempt to delete the k8s job
-            reap_pipeline_job(job, submission)
+    # Keep the pipeline slots of running jobs, then give
+    # any free slots to waiting submissions
+    renew_pipeline_slots(running_submission_ids)
+    admit_waiting_pipelines()
 
-        lock.release()
+    return len(running_submission_ids)
@@ -0,0 +1,269 @@
+import queue
+import threading
+import time
+import traceback
+
+import kubernetes
+from kubernetes import client, watch
+
+from anubis.k8s.api import get_batch_v1_api, get_core_v1_api
+from anubis.k8s.pipeline.admission import admit_waiting_pipelines
+from anubis.k8s.pipeline.get import get_active_pipeline_jobs
+from anubis.k8s.pipeline.reap import (
+    inspect_pipeline_job,
+    is_pipeline_job_done,
+    reap_pipeline_jobs,
+)
+from anubis.utils.data import with_context
+from anubis.utils.lease import PollerLease
+from anubis.utils.logging import logger
+
+PIPELINE_LABEL_SELECTOR = "app.kubernetes.io/name=submission-pipeline,role=submission-pipeline-worker"
+
+# How long a single watch request is held open before it is resumed
+# from the last resource version
+PIPELINE_WATCH_TIMEOUT_SECONDS = 300
+
+# How often running pipelines get their slots renewed and their
+# timeouts checked
+PIPELINE_POLLER_TICK_SECONDS = 5
+
+# How often running pipelines get their logs captured and their
+# resources sampled, between the pod state changes that also do
+PIPELINE_POLLER_CAPTURE_SECONDS = 30
+
+# How often all pipeline jobs are listed again, in case an event was missed
+PIPELINE_POLLER_RESYNC_SECONDS = 60
+
+
+def watch_pipeline_resources(kind: str, events: queue.Queue):
+    """
+    Stream pipeline Job or Pod events onto a queue. The stream resumes
+    from the last resource version it saw. If that version is too old
+    for the api server (410 Gone), the resources are listed again, and
+    the stream starts over from the list.
+
+    Events are put on the queue as (kind, event type, object). A fresh
+    list is put on as (kind, "SYNC", list of jobs or pods).
+
+    :param kind: Job or Pod
+    :param events:
+    :return:
+    """
+    if kind == "Job":
+        list_func = get_batch_v1_api().list_namespaced_job
+    else:
+        list_func = get_core_v1_api().list_namespaced_pod
+
+    resource_version = None
+    while True:
+        try:
+            # Start from a fresh list
+            if resource_version is None:
+                resources = list_func(namespace="anubis", label_selector=PIPELINE_LABEL_SELECTOR)
+                resource_version = resources.metadata.resource_version
+                events.put((kind, "SYNC", resources.items))
+
+            stream = watch.Watch().stream(
+                list_func,
+                namespace="anubis",
+                label_selector=PIPELINE_LABEL_SELECTOR,
+                resource_version=resource_version,
+                timeout_seconds=PIPELINE_WATCH_TIMEOUT_SECONDS,
+                allow_watch_bookmarks=True,
+            )
+            for event in stream:
+                event_type = event["type"]
+
+                # The resource version we resumed from expired
+                if event_type == "ERROR":
+                    if event["raw_object"].get("code", None) == 410:
+                        resource_version = None
+                        break
+                    logger.error(f"pipeline {kind} watch error: {event['raw_object']}")
+                    continue
+
+                resource_version = event["object"].metadata.resource_version
+                if event_type == "BOOKMARK":
+                    continue
+
+                events.put((kind, event_type, event["object"]))
+
+        except kubernetes.client.exceptions.ApiException as e:
+            if e.status == 410:
+                resource_version = None
+                continue
+            logger.error(f"pipeline {kind} watch failed, restarting" + traceback.format_exc())
+            time.sleep(1)
+
+        except Exception:
+            logger.error(f"pipeline {kind} watch failed, restarting" + traceback.format_exc())
+            time.sleep(1)
+
+
+def start_pipeline_watches(events: queue.Queue):
+    """
+    Start the Job and Pod watch streams on daemon threads.
+
+    :param events:
+    :return:
+    """
+    for kind in ("Job", "Pod"):
+        thread = threading.Thread(
+            target=watch_pipeline_resources,
+            args=(kind, events),
+            name=f"pipeline-{kind.lower()}-watch",
+            daemon=True,
+        )
+        thread.start()
+
+
+def _get_pod_state(pod: client.V1Pod | None) -> tuple:
+    """
+    Get the phase of a pipeline pod, and the state of each of its
+    containers. For batch pods, each init container that finishes
+    is a submission that is done.
+
+    :param pod:
+    :return:
+    """
+    if pod is None or pod.status is None:
+        return ()
+
+    statuses = (pod.status.init_container_statuses or []) + (pod.status.container_statuses or [])
+    container_states = []
+    for status in statuses:
+        state = None
+        if status.state is not None:
+            for name in ("waiting", "running", "terminated"):
+                if getattr(status.state, name, None) is not None:
+                    state = name
+        container_states.append((status.name, state, status.restart_count))
+
+    return pod.status.phase, tuple(container_states)
+
+
+def _get_job_name(pod: client.V1Pod) -> str | None:
+    return (pod.metadata.labels or {}).get("job-name", None)
+
+
+@with_context
+def _handle_pipeline_job(job: client.V1Job, pods: list[client.V1Pod], capture: bool = False):
+    """
+    Inspect a pipeline job that an event showed to have changed. It
+    is reaped if it is done, and its slot given to a waiting submission.
+
+    :param job:
+    :param pods: pods of the job from the watch stream
+    :param capture: capture the log and sample the resources of the job if it is running
+    :return:
+    """
+    if inspect_pipeline_job(job, capture=capture, pods=pods) is None:
+        admit_waiting_pipelines()
+
+
+def _list_pods(pods: dict[str, dict[str, client.V1Pod]]) -> dict[str, list[client.V1Pod]]:
+    return {job_name: list(job_pods.values()) for job_name, job_pods in pods.items()}
+
+
+def run_pipeline_poller(events: queue.Queue, lease: PollerLease):
+    """
+    React to pipeline Job and Pod events from the watch streams. Jobs
+    are reaped as soon as an event shows they are done, and their logs
+    are captured when their pods change state. Everything else runs on
+    a tick over the jobs and pods known from the streams, without listing
+    them: timeouts, slot renewal, admission and the warm pool. Logs are
+    captured and resources sampled on a slower tick. All jobs are listed
+    again on a slower resync, as a safety net.
+
+    Every replica watches every job, but only acts on the jobs its
+    lease assigns to it.
+
+    :param events:
+    :param lease: pipeline poller lease of this replica
+    :return:
+    """
+    jobs: dict[str, client.V1Job] = {}
+
+    # Job name -> pod name -> pod, from the Pod watch stream
+    pods: dict[str, dict[str, client.V1Pod]] = {}
+
+    last_tick = 0.0
+    last_capture = 0.0
+    last_resync = time.time()
+
+    while True:
+        try:
+            kind, event_type, obj = events.get(timeout=1.0)
+        except queue.Empty:
+            kind, event_type, obj = None, None, None
+
+        try:
+            lease.renew()
+
+            # A fresh list of all the pipeline jobs
+            if kind == "Job" and event_type == "SYNC":
+                jobs = {job.metadata.name: job for job in obj}
+
+            elif kind == "Job":
+                if event_type == "DELETED":
+                    jobs.pop(obj.metadata.name, None)
+                    pods.pop(obj.metadata.name, None)
+                else:
+                    jobs[obj.metadata.name] = obj
+                    if is_pipeline_job_done(obj) and lease.owns(obj.metadata.name):
+                        _handle_pipeline_job(obj, list(pods.get(obj.metadata.name, {}).values()))
+                        jobs.pop(obj.metadata.name, None)
+
+            # A fresh list of all the pipeline pods
+            elif kind == "Pod" and event_type == "SYNC":
+                pods = {}
+                for pod in obj:
+                    pods.setdefault(_get_job_name(pod), {})[pod.metadata.name] = pod
+
+            # Pods tell us when a container starts or finishes, which the
+            # job status does not show for batch pods. The log is captured
+            # as the state changes, so short pipelines are not missed.
+            elif kind == "Pod":
+                job_name = _get_job_name(obj)
+                job_pods = pods.setdefault(job_name, {})
+                previous = job_pods.get(obj.metadata.name, None)
+                if event_type == "DELETED":
+                    job_pods.pop(obj.metadata.name, None)
+                else:
+                    job_pods[obj.metadata.name] = obj
+
+                job = jobs.get(job_name, None)
+                if (
+                    event_type != "DELETED"
+                    and job is not None
+                    and _get_pod_state(obj) != _get_pod_state(previous)
+                    and lease.owns(job.metadata.name)
+                ):
+                    _handle_pipeline_job(job, list(job_pods.values()), capture=True)
+
+            now = time.time()
+            capture = now - last_capture >= PIPELINE_POLLER_CAPTURE_SECONDS
+
+            # Resync with a full list of pipeline jobs
+            if now - last_resync >= PIPELINE_POLLER_RESYNC_SECONDS:
+                jobs = {job.metadata.name: job for job in get_active_pipeline_jobs()}
+                pods = {job_name: job_pods for job_name, job_pods in pods.items() if job_name in jobs}
+                with_context(reap_pipeline_jobs)(list(jobs.values()), lease, pods=_list_pods(pods), capture=capture)
+                last_resync = now
+                last_tick = now
+
+            # Check timeouts, renew slots and admit waiting pipelines
+            # over the jobs and pods known from the streams
+            elif now - last_tick >= PIPELINE_POLLER_TICK_SECONDS:
+                with_context(reap_pipeline_jobs)(list(jobs.values()), lease, pods=_list_pods(pods), capture=capture)
+                last_tick = now
+
+            else:
+                capture = False
+
+            if capture:
+                last_capture = now
+
+        except Exception:
+            logger.error("pipeline poller failed, continuing" + traceback.format_exc())
@@ -1,13 +1,12 @@
-from kubernetes import config as k8s_config, client as k8s
+from kubernetes import client as k8s
 
+from anubis.k8s.api import get_core_v1_api
 from anubis.k8s.pvc.get import get_pvc_name
 from anubis.models import User
 
 
 def reap_user_pvc(user_id: str):
-    # Load the kubernetes incluster config
-    k8s_config.load_incluster_config()
-    v1 = k8s.CoreV1Api()
+    v1 = get_core_v1_api()
 
     user: User = User.query.filter(User.id == user_id).first()
 
@@ -1,10 +1,11 @@
 import base64
 import json
 
-from kubernetes import client as k8s, config as k8s_config
+from kubernetes import client as k8s
 
 from anubis.constants import THEIA_DEFAULT_OPTIONS, WEBTOP_DEFAULT_OPTIONS
 from anubis.github.parse import parse_github_repo_name
+from anubis.k8s.api import get_core_v1_api
 from anubis.k8s.pvc.get import get_user_pvc
 from anubis.k8s.theia.get import get_theia_pod_name
 from anubis.models import TheiaSession, Assignment
@@ -90,9 +91,7 @@ def create_theia_k8s_pod_pvc(
     # credentials.
     if not skip_debug_check and is_debug():
 
-        # Load the kubernetes incluster config
-        k8s_config.load_incluster_config()
-        v1 = k8s.CoreV1Api()
+        v1 = get_core_v1_api()
 
         # Determine if the git secret should be included
         try:
@@ -1,5 +1,6 @@
 from kubernetes import client as k8s
 
+from anubis.k8s.api import get_core_v1_api
 from anubis.models import TheiaSession
 
 
@@ -11,7 +12,7 @@ def list_theia_pods() -> k8s.V1PodList:
 
     :return:
     """
-    v1 = k8s.CoreV1Api()
+    v1 = get_core_v1_api()
 
     # list pods by label selector
     pods = v1.list_namespaced_pod(
@@ -0,0 +1,410 @@
+import json
+import time
+import traceback
+from collections import defaultdict
+
+import requests
+from kubernetes import client as k8s
+
+from anubis.constants import THEIA_DEFAULT_OPTIONS
+from anubis.github.parse import parse_github_repo_name
+from anubis.k8s.api import get_core_v1_api
+from anubis.lms.theia_pool import (
+    get_theia_pool_config,
+    get_theia_pool_pods,
+    get_theia_pool_size,
+    get_theia_session_pool,
+    mark_theia_pool_pod_ready,
+    register_theia_pool_pod,
+    release_theia_pool_claims,
+    retire_theia_pool_pod,
+    set_theia_pool_idle,
+    take_theia_pool_pod,
+)
+from anubis.models import TheiaSession
+from anubis.utils.data import rand
+from anubis.utils.logging import logger
+from anubis.utils.redis import redis
+
+# Pool pods keep their pool in this annotation, as images are not valid label values
+THEIA_POOL_ANNOTATION = "anubis/theia-pool"
+
+# Pool pods keep this label after they are claimed. Only pods with it
+# let the theia rpc workers reach their autosave server.
+THEIA_POOL_POD_LABEL = "theia-pool-pod"
+
+# Claimed pool pods are patched with the session env in this annotation.
+# The autosave sidecar reads it from the downward api volume if it
+# restarts after the claim.
+THEIA_POOL_SESSION_ANNOTATION = "anubis/theia-session"
+
+# The session env is posted to the autosave server of a claimed pool
+# pod. It answers once the repo of the session is cloned.
+THEIA_POOL_AUTOSAVE_PORT = 5001
+THEIA_POOL_CLONE_TIMEOUT_SECONDS = 90
+
+# Claimed pool pods are left alone by the reconcile for this long, by
+# which point they are labeled with their session, or were given up on
+# after the clone timed out and deleted.
+THEIA_POOL_CLAIM_SECONDS = THEIA_POOL_CLONE_TIMEOUT_SECONDS + 60
+
+
+
+def create_theia_pool_pod_obj(pool: str, pod_name: str) -> k8s.V1Pod:
+    """
+    Create the k8s pod object for an idle warm pool IDE. It is a
+    student session pod for the image tag of the pool, without a
+    session. The autosave sidecar starts in pool mode, where it waits
+    for the session env to be posted to it when the pod is claimed.
+
+    :param pool: "<image>:<tag>"
+    :param pod_name:
+    :return:
+    """
+    volume_name = f"{pod_name}-ide"
+
+    git_cred = k8s.V1EnvVar(
+        name="GIT_CRED",
+        value_from=k8s.V1EnvVarSource(
+            secret_key_ref=k8s.V1SecretKeySelector(name="git", key="credentials", optional=True)
+        ),
+    )
+
+    # Fixes the permissions of the shared volume. There is no repo to clone yet.
+    init_container = k8s.V1Container(
+        name="theia-init",
+        image="registry.digitalocean.com/anubis/theia-init",
+        image_pull_policy="IfNotPresent",
+        env=[k8s.V1EnvVar(name="GIT_REPO", value="")],
+        volume_mounts=[k8s.V1VolumeMount(mount_path="/out", name=volume_name)],
+    )
+
+    # Autosave sidecar in pool mode. The session env is posted to it
+    # once the pod is claimed, and kept in the pod annotations in case
+    # the sidecar restarts.
+    autosave_container = k8s.V1Container(
+        name="autosave",
+        image="registry.digitalocean.com/anubis/theia-autosave",
+        image_pull_policy="IfNotPresent",
+        env=[
+            k8s.V1EnvVar(name="AUTOSAVE", value="ON"),
+            k8s.V1EnvVar(name="ANUBIS_POOL", value="ON"),
+            git_cred,
+        ],
+        security_context=k8s.V1SecurityContext(
+            allow_privilege_escalation=False,
+            run_as_non_root=True,
+            run_as_user=1001,
+        ),
+        volume_mounts=[
+            k8s.V1VolumeMount(mount_path="/home/anubis", name=volume_name),
+            k8s.V1VolumeMount(mount_path="/etc/anubis/pool", name="pool", read_only=True),
+        ],
+    )
+
+    theia_container = k8s.V1Container(
+        name="theia",
+        image_pull_policy="IfNotPresent",
+        ports=[
+            k8s.V1ContainerPort(container_port=5000),
+            # Optional proxy ports
+            *(k8s.V1ContainerPort(container_port=8000 + i, protocol="TCP") for i in range(11)),
+            *(k8s.V1ContainerPort(container_port=8000 + i, protocol="UDP") for i in range(11)),
+        ],
+        image=pool,
+        env=[
+            k8s.V1EnvVar(name="AUTOSAVE", value="ON"),
+            k8s.V1EnvVar(name="REPO_NAME", value=""),
+        ],
+        resources=k8s.V1ResourceRequirements(
+            limits=THEIA_DEFAULT_OPTIONS["resources"]["limits"],
+            requests=THEIA_DEFAULT_OPTIONS["resources"]["requests"],
+        ),
+        volume_mounts=[k8s.V1VolumeMount(mount_path="/home/anubis", name=volume_name)],
+        startup_probe=k8s.V1Probe(
+            http_get=k8s.V1HTTPGetAction(path="/", port=5000),
+            initial_delay_seconds=3,
+            period_seconds=1,
+            failure_threshold=60,
+            success_threshold=1,
+        ),
+        security_context=k8s.V1SecurityContext(
+            allow_privilege_escalation=False,
+            privileged=False,
+            run_as_user=1001,
+        ),
+    )
+
+    # Expose the pod annotations to the autosave sidecar
+    pool_volume = k8s.V1Volume(
+        name="pool",
+        downward_api=k8s.V1DownwardAPIVolumeSource(
+            items=[
+                k8s.V1DownwardAPIVolumeFile(
+                    path="annotations",
+                    field_ref=k8s.V1ObjectFieldSelector(field_path="metadata.annotations"),
+                )
+            ]
+        ),
+    )
+
+    return k8s.V1Pod(
+        metadata=k8s.V1ObjectMeta(
+            name=pod_name,
+            labels={
+                "app.kubernetes.io/name": "anubis",
+                "component":              "theia-pool",
+                "role":                   "theia-pool",
+                # Pool pods are started locked down, as they are
+                # handed to students as they are.
+                "network-policy":         "os-student",
+                THEIA_POOL_POD_LABEL:     "true",
+            },
+            annotations={THEIA_POOL_ANNOTATION: pool},
+        ),
+        spec=k8s.V1PodSpec(
+            hostname="anubis-ide",
+            init_containers=[init_container],
+            containers=[theia_container, autosave_container],
+            volumes=[k8s.V1Volume(name=volume_name), pool_volume],
+            # Minimal service account with no extra permissions
+            service_account_name="theia-ide",
+            # Disable service information from being injected into the environment
+            enable_service_links=False,
+            # Don't mount service account tokens
+            automount_service_account_token=False,
+            dns_policy="None",
+            dns_config=k8s.V1PodDNSConfig(nameservers=["1.1.1.1"]),
+        ),
+    )
+
+
+def create_theia_pool_pod(pool: str):
+    """
+    Start a new idle pod for a pool.
+
+    :param pool:
+    :return:
+    """
+    pod_name = f"theia-pool-{rand(12)}"
+    register_theia_pool_pod(pod_name, pool)
+    pod = create_theia_pool_pod_obj(pool, pod_name)
+
+    logger.info(f"creating theia pool pod {pod_name} for {pool}")
+
+    v1 = get_core_v1_api()
+    try:
+        v1.create_namespaced_pod(namespace="anubis", body=pod)
+    except k8s.exceptions.ApiException:
+        retire_theia_pool_pod(pod_name)
+        logger.error("failed to create theia pool pod, continuing" + traceback.format_exc())
+
+
+def delete_theia_pool_pod(pod_name: str):
+    v1 = get_core_v1_api()
+    try:
+        v1.delete_namespaced_pod(pod_name, "anubis", propagation_policy="Background")
+    except k8s.exceptions.ApiException:
+        logger.error("failed to delete theia pool pod, continuing" + traceback.format_exc())
+
+
+def get_theia_pool_session_env(theia_session: TheiaSession) -> dict:
+    """
+    Get the env a claimed pool pod needs for a session. This is what
+    a session pod would have been started with.
+
+    :param theia_session:
+    :return:
+    """
+    repo_url = theia_session.repo_url or ""
+    return {
+        "SESSION_ID":             theia_session.id,
+        "NETID":                  theia_session.owner.netid,
+        "AUTOSAVE":               "ON" if theia_session.autosave else "OFF",
+        "GIT_REPO":               repo_url,
+        "REPO_NAME":              parse_github_repo_name(repo_url),
+        "ANUBIS_ASSIGNMENT_NAME": theia_session.assignment.name if theia_session.assignment_id is not None else "",
+        "COURSE_CODE":            theia_session.course.course_code if theia_session.course_id is not None else "",
+    }
+
+
+def _post_theia_pool_session_env(cluster_address: str, session_env: dict) -> bool:
+    """
+    Hand the session env to the autosave sidecar of a claimed pool pod.
+    The sidecar clones the repo of the session before it answers.
+
+    :param cluster_address:
+    :param session_env:
+    :return: True if the sidecar cloned the repo
+    """
+    try:
+        r = requests.post(
+            f"http://{cluster_address}:{THEIA_POOL_AUTOSAVE_PORT}/pool/claim",
+            json=session_env,
+            timeout=THEIA_POOL_CLONE_TIMEOUT_SECONDS,
+        )
+    except requests.RequestException:
+        logger.error("failed to post session env to theia pool pod, continuing" + traceback.format_exc())
+        return False
+
+    if r.status_code != 200:
+        logger.error(f"theia pool pod failed to claim session: {r.status_code} {r.text}")
+        return False
+
+    return True
+
+
+def claim_theia_pool_pod(theia_session: TheiaSession) -> bool:
+    """
+    Give a theia session an idle pod from the warm pool of its image
+    tag. The pod is labeled with the session, and the session env is
+    posted to its autosave sidecar, which clones the repo of the
+    session. Once the repo is cloned, the session is marked running
+    with the address of the pod, so the proxy can route to it.
+
+    If the pod can not be handed over, it is deleted, and the session
+    should get a pod of its own.
+
+    Changes to the session are not committed.
+
+    :param theia_session:
+    :return: True if the session was given a pool pod
+    """
+    pool = get_theia_session_pool(theia_session)
+    if pool is None:
+        return False
+
+    claimed = take_theia_pool_pod(pool)
+    if claimed is None:
+        logger.info(f"theia pool {pool} is empty")
+        return False
+
+    pod_name, cluster_address = claimed
+    session_env = get_theia_pool_session_env(theia_session)
+
+    v1 = get_core_v1_api()
+    try:
+        v1.patch_namespaced_pod(
+            pod_name,
+            "anubis",
+            body={
+                "metadata": {
+                    # Merged into the pool labels, so the pool pod label stays
+                    "labels":      {
+                        "component": "theia-session",
+                        "role":      "theia-session",
+                        "netid":     theia_session.owner.netid,
+                        "session":   theia_session.id,
+                    },
+                    "annotations": {
+                        THEIA_POOL_SESSION_ANNOTATION: json.dumps(session_env),
+                    },
+                }
+            },
+        )
+    except k8s.exceptions.ApiException:
+        logger.error("failed to label claimed theia pool pod, continuing" + traceback.format_exc())
+        delete_theia_pool_pod(pod_name)
+        return False
+
+    # Only route to the pod once the repo is there
+    if not _post_theia_pool_session_env(cluster_address, session_env):
+        delete_theia_pool_pod(pod_name)
+        return False
+
+    theia_session.cluster_address = cluster_address
+    theia_session.state = "Running"
+
+    logger.info(
+        "theia pool claim",
+        extra={
+            "type":       "theia_pool_claim",
+            "session_id": theia_session.id,
+            "pod_name":   pod_name,
+            "pool":       pool,
+        },
+    )
+
+    return True
+
+
+def _is_theia_pool_pod_ready(pod: k8s.V1Pod) -> bool:
+    if pod.status.phase != "Running" or pod.status.pod_ip is None:
+        return False
+    statuses = pod.status.container_statuses or []
+    return len(statuses) > 0 and all(status.ready for status in statuses)
+
+
+def reconcile_theia_pools():
+    """
+    Bring the warm pools in line with their sizes. Pool pods that have
+    started are made claimable, orphaned and failed pods are cleaned
+    up, and idle pods are started or retired so each pool has the size
+    for the time of day and upcoming deadlines.
+
+    :return:
+    """
+    if redis is None:
+        return
+
+    v1 = get_core_v1_api()
+    try:
+        pods = v1.list_namespaced_pod(
+            namespace="anubis",
+            label_selector="app.kubernetes.io/name=anubis,role=theia-pool",
+        ).items
+    except k8s.exceptions.ApiException:
+        logger.error("failed to list theia pool pods, continuing" + traceback.format_exc())
+        return
+
+    # Read the registry after listing, so pods claimed since then are
+    # not taken for orphans.
+    registered, claims = get_theia_pool_pods()
+
+    # Idle pool pods, by pool
+    idle: dict[str, list[k8s.V1Pod]] = defaultdict(list)
+    for pod in pods:
+        pod_name = pod.metadata.name
+        if pod_name in claims:
+            continue
+
+        # Clean up pods that were retired, or left over from a failed claim
+        if pod_name not in registered:
+            delete_theia_pool_pod(pod_name)
+            continue
+
+        if pod.status.phase in ("Failed", "Succeeded"):
+            if retire_theia_pool_pod(pod_name):
+                delete_theia_pool_pod(pod_name)
+            continue
+
+        if _is_theia_pool_pod_ready(pod):
+            mark_theia_pool_pod_ready(pod_name, pod.status.pod_ip)
+
+        idle[pod.metadata.annotations[THEIA_POOL_ANNOTATION]].append(pod)
+
+    pool_config = get_theia_pool_config()
+    for pool in set(pool_config["images"]) | set(idle.keys()):
+        size = get_theia_pool_size(pool)
+
+        # Newest first, so pods that are still starting are retired before started ones
+        pool_pods = sorted(idle[pool], key=lambda pod: pod.metadata.creation_timestamp, reverse=True)
+
+        # Start idle pods up to the pool size
+        for _ in range(size - len(pool_pods)):
+            create_theia_pool_pod(pool)
+
+        # Retire idle pods past the pool size
+        retired = 0
+        for pod in pool_pods[: max(len(pool_pods) - size, 0)]:
+            if retire_theia_pool_pod(pod.metadata.name):
+                delete_theia_pool_pod(pod.metadata.name)
+                retired += 1
+
+        set_theia_pool_idle(pool, max(len(pool_pods), size) - retired)
+
+    # Forget claims of pods that have been labeled by now
+    now = time.time()
+    release_theia_pool_claims(
+        [pod_name for pod_name, claimed_at in claims.items() if now - claimed_at > THEIA_POOL_CLAIM_SECONDS]
+    )
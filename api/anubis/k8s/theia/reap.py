@@ -1,15 +1,20 @@
 from datetime import timedelta, datetime
 
-from kubernetes import client as k8s, config as k8s_config
+from kubernetes import client as k8s
 
-from anubis.ide.reap import mark_session_ended
+from anubis.ide.reap import mark_session_ended, mark_sessions_ended
+from anubis.k8s.api import get_core_v1_api
 from anubis.k8s.theia.get import list_theia_pods
 from anubis.k8s.theia.update import update_theia_pod_cluster_addresses
 from anubis.lms.courses import get_active_courses, get_course_admin_ids
-from anubis.models import TheiaSession, db, Course
+from anubis.models import TheiaSession, db
 from anubis.utils.config import get_config_int
 from anubis.utils.logging import logger
 
+# Sessions whose pods are deleted in one call. Keeps the
+# label selectors a reasonable length.
+THEIA_REAP_CHUNK_SIZE = 50
+
 
 def reap_stale_theia_sessions(*_):
     """
@@ -22,9 +27,6 @@ def reap_stale_theia_sessions(*_):
     :return:
     """
 
-    # Load the incluster config
-    k8s_config.load_incluster_config()
-
     # Log the event
     logger.info("Clearing stale theia sessions")
 
@@ -35,8 +37,10 @@ def reap_stale_theia_sessions(*_):
     update_theia_pod_cluster_addresses(theia_pods)
 
     # Check that all theia sessions have not
-    # reached the global timeout.
-    reap_old_theia_sessions(theia_pods)
+    # reached the global timeout. Their pods are
+    # already on their way out.
+    reaped_ids = set(reap_old_theia_sessions(theia_pods))
+    theia_pods.items = [pod for pod in theia_pods.items if pod.metadata.labels["session"] not in reaped_ids]
 
     # Make sure that database entries marked
     # as active have pods and pods have active
@@ -54,7 +58,7 @@ def reap_theia_session_k8s_resources(theia_session_id: str):
     :param theia_session_id:
     :return:
     """
-    v1 = k8s.CoreV1Api()
+    v1 = get_core_v1_api()
 
     # Log the reap
     logger.info("Reaping TheiaSession {}".format(theia_session_id))
@@ -69,43 +73,93 @@ def reap_theia_session_k8s_resources(theia_session_id: str):
     )
 
 
-def reap_old_theia_sessions(theia_pods: k8s.V1PodList):
+def reap_theia_sessions_k8s_resources(theia_session_ids: list[str]):
     """
-    Check that all the active pods have not reached the
-    maximum lifetime of a theia session.
+    Mark the kubernetes resources of many theia sessions for deletion.
+    Pods are deleted with one call for each chunk of sessions, by a set
+    based label selector.
 
-    :param theia_pods:
+    :param theia_session_ids:
     :return:
     """
+    if len(theia_session_ids) == 0:
+        return
 
-    # Get stale timeout hours
-    theia_stale_timeout_hours = get_config_int("THEIA_STALE_TIMEOUT_HOURS", default=6)
-    theia_stale_timeout = timedelta(hours=theia_stale_timeout_hours)
+    v1 = get_core_v1_api()
 
-    # Iterate through all active
-    for n, pod in enumerate(theia_pods.items):
+    theia_session_ids = sorted(set(theia_session_ids))
+    for index in range(0, len(theia_session_ids), THEIA_REAP_CHUNK_SIZE):
+        chunk = theia_session_ids[index : index + THEIA_REAP_CHUNK_SIZE]
 
-        # Get the theia session id from the pod labels
-        session_id = pod.metadata.labels["session"]
+        # Log the reap
+        logger.info("Reaping TheiaSessions {}".format(chunk))
 
-        # Get the database entry for the theia session
-        theia_session: TheiaSession = TheiaSession.query.filter(TheiaSession.id == session_id).first()
+        # Mark the pods for deletion by a label selector
+        v1.delete_collection_namespaced_pod(
+            namespace="anubis",
+            label_selector="app.kubernetes.io/name=anubis,role=theia-session,session in ({})".format(
+                ",".join(chunk),
+            ),
+            propagation_policy="Background",
+        )
 
-        # Make sure we have a session to work on
-        if theia_session is None:
-            continue
 
-        # If the session is younger than 6 hours old, continue
-        if datetime.now() <= theia_session.created + theia_stale_timeout:
-            logger.info(f"NOT reaping session {theia_session.id}")
-            continue
+def reap_theia_sessions_by_id(theia_session_ids: list[str], commit: bool = True):
+    """
+    Reap many theia sessions at once. The pods are marked for deletion
+    in chunks, the database entries are marked as ended in one update,
+    and the changes are committed once. Pods are deleted even if they
+    have no database entry.
+
+    :param theia_session_ids:
+    :param commit:
+    :return:
+    """
+    if len(theia_session_ids) == 0:
+        return
+
+    # Mark the session resources in kubernetes for deletion
+    reap_theia_sessions_k8s_resources(theia_session_ids)
+
+    # Mark the database entries as ended, if they were not already
+    mark_sessions_ended(theia_session_ids)
+
+    if commit:
+        db.session.commit()
+
+
+def reap_old_theia_sessions(theia_pods: k8s.V1PodList) -> list[str]:
+    """
+    Check that all the active pods have not reached the
+    maximum lifetime of a theia session. Changes are
+    not committed.
+
+    :param theia_pods:
+    :return: ids of the sessions reaped
+    """
+
+    # Get stale timeout hours
+    theia_stale_timeout_hours = get_config_int("THEIA_STALE_TIMEOUT_HOURS", default=6)
+    theia_stale_timeout = timedelta(hours=theia_stale_timeout_hours)
 
-        # Reap the session
-        reap_theia_session(theia_session, commit=False)
+    # Get the theia session ids from the pod labels
+    pod_session_ids = {pod.metadata.labels["session"] for pod in theia_pods.items}
+    if len(pod_session_ids) == 0:
+        return []
+
+    # Find the sessions of the pods that are older than the timeout in one query
+    old_session_ids = [
+        session_id
+        for session_id, in db.session.query(TheiaSession.id).filter(
+            TheiaSession.id.in_(list(pod_session_ids)),
+            TheiaSession.created < datetime.now() - theia_stale_timeout,
+        )
+    ]
+
+    # Reap the sessions
+    reap_theia_sessions_by_id(old_session_ids, commit=False)
 
-        # Batch commits in size of 5
-        if n % 5 == 0:
-            db.session.commit()
+    return old_session_ids
 
 
 def reap_theia_session(theia_session: TheiaSession, commit: bool = True):
@@ -144,9 +198,6 @@ def reap_theia_session_by_id(theia_session_id: str):
     :return:
     """
 
-    # Load incluster kubernetes config
-    k8s_config.load_incluster_config()
-
     # Log the reap
     logger.info("Attempting to reap theia session {}".format(theia_session_id))
 
@@ -169,38 +220,28 @@ def reap_theia_sessions_in_course(course_id: str):
     Reap all theia sessions within a specific course. This will
     kick everyone off their IDEs.
 
-    There may be many database entries that this function updates
-    so we will batch commits to help speed things up, while
-    keeping things relatively consistent in the cluster.
+    The pods are deleted in chunks, and the database entries are
+    updated in one statement and committed once.
 
     :param course_id:
     :return:
     """
 
-    # Load the incluster config
-    k8s_config.load_incluster_config()
-
     # Lof the reap
     logger.info(f"Clearing theia sessions course_id={course_id}")
 
     # Find all theia sessions in the database that are
     # marked as active.
-    theia_sessions = TheiaSession.query.filter(
-        TheiaSession.active == True,
-        TheiaSession.course_id == course_id,
-    ).all()
-
-    # Iterate through all active theia sessions in the database, deleting and
-    # updating as we go.
-    for n, theia_session in enumerate(theia_sessions):
-        # Reap the session
-        reap_theia_session(theia_session, commit=False)
+    theia_session_ids = [
+        session_id
+        for session_id, in db.session.query(TheiaSession.id).filter(
+            TheiaSession.active == True,
+            TheiaSession.course_id == course_id,
+        )
+    ]
 
-        # Batch commits in size of 5
-        if n % 5 == 0:
-            db.session.commit()
-
-    db.session.commit()
+    # Reap all the sessions together
+    reap_theia_sessions_by_id(theia_session_ids)
 
 
 def reap_theia_playgrounds_all():
@@ -208,37 +249,27 @@ def reap_theia_playgrounds_all():
     Reap all theia sessions within anubis playgrounds. This will
     kick everyone off their IDEs.
 
-    There may be many database entries that this function updates
-    so we will batch commits to help speed things up, while
-    keeping things relatively consistent in the cluster.
+    The pods are deleted in chunks, and the database entries are
+    updated in one statement and committed once.
 
     :return:
     """
 
-    # Load the incluster config
-    k8s_config.load_incluster_config()
-
     # Lof the reap
     logger.info(f"Clearing theia sessions playgrounds")
 
     # Find all theia sessions in the database that are
     # marked as active.
-    theia_sessions = TheiaSession.query.filter(
-        TheiaSession.active == True,
-        TheiaSession.playground == True,
-    ).all()
-
-    # Iterate through all active theia sessions in the database, deleting and
-    # updating as we go.
-    for n, theia_session in enumerate(theia_sessions):
-        # Reap the session
-        reap_theia_session(theia_session, commit=False)
-
-        # Batch commits in size of 5
-        if n % 5 == 0:
-            db.session.commit()
+    theia_session_ids = [
+        session_id
+        for session_id, in db.session.query(TheiaSession.id).filter(
+            TheiaSession.active == True,
+            TheiaSession.playground == True,
+        )
+    ]
 
-    db.session.commit()
+    # Reap all the sessions together
+    reap_theia_sessions_by_id(theia_session_ids)
 
 
 def reap_stale_theia_k8s_resources(theia_pods: k8s.V1PodList):
@@ -265,84 +296,43 @@ def reap_stale_theia_k8s_resources(theia_pods: k8s.V1PodList):
     standard_theia_timeout = get_config_int("THEIA_STALE_PROXY_MINUTES", default=10)
     admin_theia_timeout = get_config_int("THEIA_ADMIN_STALE_PROXY_MINUTES", default=60)
 
-    # Get list of all courses
-    courses: list[Course] = get_active_courses()
-
-    active_db_sessions: list[TheiaSession] = []
-
-    # Iterate over all courses
-    for course in courses:
-        print("filtering stale ides for course {} - {}".format(course.name, course.course_code))
-
-        # Get a list of (heavily cached) admin id strings
-        course_admin_ids = get_course_admin_ids(course.id)
-        print("course_admin_ids", course.name, course_admin_ids, sep=" :: ")
-
-        # Build query for theia active sessions within the course
-        query = TheiaSession.query.filter(
-            # Get sessions marked as active
-            TheiaSession.active == True,
-            # Only consider sessions that have had some
-            # time to have their k8s resources requested.
-            TheiaSession.k8s_requested == True,
-            # Only consider sessions that are a part of
-            # this course.
-            TheiaSession.course_id == course.id,
-        )
-
-        # Get a list of the standard (student) theia sessions that are active
-        standard_active_db_theia_sessions: list[TheiaSession] = query.filter(
-            # Filter out admin users (only students in the course)
-            ~TheiaSession.owner_id.in_(course_admin_ids),
-            # Filter for sessions that have had a proxy in the last 10 minutes
-            TheiaSession.last_proxy >= datetime.now() - timedelta(minutes=standard_theia_timeout),
-        ).all()
-
-        # Get a list of the admin (professor/ta) theia sessions that are active
-        admin_active_db_theia_sessions: list[TheiaSession] = query.filter(
-            # Filter for admin users (only professors+tas)
-            TheiaSession.owner_id.in_(course_admin_ids),
-            # Filter for sessions that have had a proxy in the last 60 minutes
-            TheiaSession.last_proxy >= datetime.now() - timedelta(minutes=admin_theia_timeout),
-        ).all()
-
-        # Build list of all the active theia ides (in the database)
-        # from the standard and admin sessions.
-        active_db_sessions.extend(standard_active_db_theia_sessions)
-        active_db_sessions.extend(admin_active_db_theia_sessions)
-
-    # Make sure to cover theia sessions that do not have a set
-    # course as well. Hold these course-less ides to the
-    # standard timeout.
-    no_course_db_active_sessions: list[TheiaSession] = TheiaSession.query.filter(
+    # Get the (heavily cached) admin ids of each active course.
+    # Sessions in courses that are not active are not kept.
+    course_admin_ids: dict[str, set[str]] = {
+        course.id: set(get_course_admin_ids(course.id)) for course in get_active_courses()
+    }
+
+    # Get every active session that could still be within its timeout in one query
+    now = datetime.now()
+    candidate_db_sessions = db.session.query(
+        TheiaSession.id, TheiaSession.course_id, TheiaSession.owner_id, TheiaSession.last_proxy
+    ).filter(
         # Get sessions marked as active
         TheiaSession.active == True,
         # Only consider sessions that have had some
         # time to have their k8s resources requested.
         TheiaSession.k8s_requested == True,
-        # Course-less theia session
-        TheiaSession.course_id == None,
-        # Filter for sessions that have had a proxy in the last 10 minutes
-        TheiaSession.last_proxy >= datetime.now() - timedelta(minutes=standard_theia_timeout),
-    ).all()
+        # Filter for sessions that have had a proxy within the longest timeout
+        TheiaSession.last_proxy >= now - timedelta(minutes=max(standard_theia_timeout, admin_theia_timeout)),
+    )
 
-    # Print the course-less ides to the screen
-    print("no-course ides", no_course_db_active_sessions, sep=" :: ")
+    # Build set of active db session ids. Admins (professors+tas) are held to
+    # the admin timeout. Students and course-less sessions are held to the
+    # standard timeout.
+    active_db_ids = set()
+    for session_id, course_id, owner_id, last_proxy in candidate_db_sessions:
+        if course_id is not None and course_id not in course_admin_ids:
+            continue
 
-    # Add the no-course theia sessions to the active db sessions list
-    active_db_sessions.extend(no_course_db_active_sessions)
+        timeout = standard_theia_timeout
+        if course_id is not None and owner_id in course_admin_ids[course_id]:
+            timeout = admin_theia_timeout
 
-    print("active_db_sessions", active_db_sessions)
+        if last_proxy >= now - timedelta(minutes=timeout):
+            active_db_ids.add(session_id)
 
     # Build set of active pod session ids
-    active_pod_ids = set()
-    for pod in theia_pods.items:
-        active_pod_ids.add(pod.metadata.labels["session"])
-
-    # Build set of active db session ids
-    active_db_ids = set()
-    for active_db_session in active_db_sessions:
-        active_db_ids.add(active_db_session.id)
+    active_pod_ids = {pod.metadata.labels["session"] for pod in theia_pods.items}
 
     # Figure out which ones don't match
     # and need to be updated.
@@ -357,15 +347,15 @@ def reap_stale_theia_k8s_resources(theia_pods: k8s.V1PodList):
     if len(stale_db_ids) > 0:
         logger.info("Found stale theia database entries: {}".format(str(list(stale_db_ids))))
 
-    # Reap theia sessions
-
-    for stale_pod_id in stale_pods_ids:
-        reap_theia_session_by_id(stale_pod_id)
+    # Reap theia sessions of the stale pods
+    reap_theia_sessions_k8s_resources(list(stale_pods_ids))
+    mark_sessions_ended(list(stale_pods_ids))
 
     # Update database entries
-    TheiaSession.query.filter(
-        TheiaSession.id.in_(list(stale_db_ids)),
-    ).update({TheiaSession.active: False}, False)
+    if len(stale_db_ids) > 0:
+        TheiaSession.query.filter(
+            TheiaSession.id.in_(list(stale_db_ids)),
+        ).update({TheiaSession.active: False}, False)
 
     # Commit any and all changes to the database
     db.session.commit()
@@ -2,43 +2,49 @@ import traceback
 
 from kubernetes import client as k8s
 
-from anubis.k8s.theia.get import get_theia_pod_name
+from anubis.k8s.api import get_core_v1_api
+from anubis.k8s.theia.get import list_theia_pods
 from anubis.lms.theia import get_active_theia_sessions
 from anubis.models import TheiaSession, db
+from anubis.utils.lease import PollerLease
 from anubis.utils.logging import logger
-from anubis.utils.redis import create_redis_lock
+
+# Lease group the theia poller replicas share the sessions in
+THEIA_POLLER_LEASE_GROUP = "theia-poller"
 
 
 def update_theia_pod_cluster_addresses(theia_pods: k8s.V1PodList):
     """
     Iterate through all theia pods, updating the pod cluster
-    addresses in the database as we go.
+    addresses in the database as we go. The sessions of all
+    the pods are loaded in one query, and only the addresses
+    that changed are written.
 
     :param theia_pods:
     :return:
     """
 
-    # Iterate through all active
-    for n, pod in enumerate(theia_pods.items):
-        # Get the session id from the pod labels
-        session_id = pod.metadata.labels["session"]
-
-        # Get the database entry for the theia session
-        theia_session: TheiaSession = TheiaSession.query.filter(TheiaSession.id == session_id).first()
+    # Map session ids to the cluster address of their pod
+    pod_addresses: dict[str, str] = {pod.metadata.labels["session"]: pod.status.pod_ip for pod in theia_pods.items}
+    if len(pod_addresses) == 0:
+        return
 
-        # Make sure we have a session to work on
-        if theia_session is None:
-            continue
+    # Get the database entries for the theia sessions of all the pods
+    theia_sessions: list[TheiaSession] = TheiaSession.query.filter(
+        TheiaSession.id.in_(list(pod_addresses.keys())),
+    ).all()
 
-        # Update the theia session record in the database with
-        # the pod cluster address.
-        theia_session.cluster_address = pod.status.pod_ip
+    # Update the theia session records in the database with
+    # the pod cluster addresses that changed.
+    for theia_session in theia_sessions:
+        if theia_session.cluster_address != pod_addresses[theia_session.id]:
+            theia_session.cluster_address = pod_addresses[theia_session.id]
 
     # Commit any and all changes
     db.session.commit()
 
 
-def update_all_theia_sessions():
+def update_all_theia_sessions(lease: PollerLease = None):
     """
     Poll Database for sessions created within the last 10 minutes
     if they are active and dont have a cluster_address.
@@ -46,51 +52,55 @@ def update_all_theia_sessions():
     If the session is running match the pod to the cluster_address
 
     If the session has failed, update the session to failed.
-    """
 
-    # Go through all active sessions
-    for session in get_active_theia_sessions():
+    The theia pods are listed once for the whole pass, instead of
+    being read one session at a time, and all the changes are
+    committed together.
 
-        # Synchronize session resource
-        lock = create_redis_lock(f'theia-session-{session.id}')
-        if not lock.acquire(blocking=False):
-            continue
+    With a lease, only the sessions assigned to this poller replica
+    are updated.
 
-        # Try to update the session info
-        update_theia_session(session)
+    :param lease: theia poller lease of this replica
+    """
 
-        # Release lock
-        lock.release()
+    # Skip sessions that another replica owns
+    theia_sessions = [session for session in get_active_theia_sessions() if lease is None or lease.owns(session.id)]
+    if len(theia_sessions) == 0:
+        return
 
+    # Map session ids to their pods
+    try:
+        theia_pods = {pod.metadata.labels["session"]: pod for pod in list_theia_pods().items}
+    except k8s.exceptions.ApiException:
+        logger.error(traceback.format_exc())
+        logger.error("continuing")
+        return
 
-def update_theia_session(session: TheiaSession):
-    # Load the kubernetes incluster config
-    v1 = k8s.CoreV1Api()
+    # Update the session info from its pod
+    for session in theia_sessions:
+        update_theia_session(session, theia_pods.get(session.id, None))
 
-    # Get the name of the pod
-    pod_name = get_theia_pod_name(session)
+    db.session.commit()
 
-    try:
-        # If the pod has not been created yet, then a 404 will be thrown.
-        # Skip logging if that is the case.
-        # Get the pod information from the kubernetes api
-        pod: k8s.V1Pod = v1.read_namespaced_pod(
-            namespace="anubis",
-            name=pod_name,
-        )
 
-    except k8s.exceptions.ApiException as e:
+def update_theia_session(session: TheiaSession, pod: k8s.V1Pod | None):
+    """
+    Update the state of a theia session from its pod. Changes are
+    not committed.
 
-        # If the status code is 404, then it has not been created yet
-        if e.status == 404:
-            if session.state != "Waiting for IDE to be scheduled...":
-                session.state = "Waiting for IDE to be scheduled..."
-                db.session.commit()
-            return
+    :param session:
+    :param pod: the pod of the session, or None if it was not created yet
+    :return:
+    """
 
-        # Error
-        logger.error(traceback.format_exc())
-        logger.error("continuing")
+    # If the pod has not been created yet
+    if pod is None:
+        if session.state != "Waiting for IDE to be scheduled...":
+            session.state = "Waiting for IDE to be scheduled..."
+        return
+
+    # Get the name of the pod
+    pod_name = pod.metadata.name
 
     # Update the session state from the pod status
     if pod.status.phase == "Pending":
@@ -102,7 +112,7 @@ def update_theia_session(session: TheiaSession):
         # in the events for the pod if it has been attached.
         if session.persistent_storage:
             # Get event list for ide pod
-            events: k8s.CoreV1Eventlist = v1.list_namespaced_event(
+            events: k8s.CoreV1Eventlist = get_core_v1_api().list_namespaced_event(
                 "anubis", field_selector=f"involvedObject.name={pod_name}"
             )
 
@@ -119,13 +129,14 @@ def update_theia_session(session: TheiaSession):
         # If we are expecting a volume, but it has not been attached, then
         # we should set the status message to state such
         if session.persistent_storage and not volume_attached:
-            session.state = "Waiting for Persistent Volume to attach..."
+            state = "Waiting for Persistent Volume to attach..."
 
         # State that the ide server has not yet started
         else:
-            session.state = "Waiting for IDE server to start..."
+            state = "Waiting for IDE server to start..."
 
-        db.session.commit()
+        if session.state != state:
+            session.state = state
 
     # If the pod has failed. There are more than a few ways that
     # the pod could have failed. If we reach this, then we should
@@ -139,11 +150,13 @@ def update_theia_session(session: TheiaSession):
         # Log the failure
         logger.error("Theia session failed {}".format(pod_name))
 
-        db.session.commit()
-
     # If the pod is marked as running. The pod is marked as
-    # running when the main containers have started
+    # running when the main containers have started. Sessions
+    # that were already running are left as they are.
     if pod.status.phase == "Running":
+        if session.state == "Running" and session.cluster_address == pod.status.pod_ip:
+            return
+
         # set the cluster address and state
         session.cluster_address = pod.status.pod_ip
         session.state = "Running"
@@ -160,5 +173,3 @@ def update_theia_session(session: TheiaSession):
 
         # Log the success
         logger.info("Theia session started {}".format(pod_name))
-
-        db.session.commit()
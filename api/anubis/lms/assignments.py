@@ -21,8 +21,11 @@ from anubis.models import (
     Assignment,
     AssignmentRepo,
     AssignmentTest,
+    AutogradeSnapshot,
+    BestSubmission,
     Course,
     LateException,
+    PipelineProfile,
     Submission,
     SubmissionTestResult,
     SubmissionBuild,
@@ -289,6 +292,9 @@ def assignment_sync(assignment_data: dict) -> tuple[dict | str, bool]:
     # Commit changes
     db.session.commit()
 
+    # The tests may have changed, so clear the cached test catalog
+    cache.delete_memoized(get_assignment_test_catalog, assignment.id)
+
     return {"assignment": assignment.full_data, "questions": question_message}, True
 
 
@@ -367,6 +373,10 @@ def delete_assignment_submissions(assignment: Assignment):
     :param assignment:
     :return:
     """
+    AutogradeSnapshot.query.filter(AutogradeSnapshot.assignment_id == assignment.id).delete(synchronize_session=False)
+    BestSubmission.query.filter(BestSubmission.assignment_id == assignment.id).delete(synchronize_session=False)
+    PipelineProfile.query.filter(PipelineProfile.assignment_id == assignment.id).delete(synchronize_session=False)
+
     submission_ids = db.session.query(Submission.id).filter(Submission.assignment_id == assignment.id)
     SubmissionTestResult.query.filter(SubmissionTestResult.submission_id.in_(submission_ids.subquery())).delete(
         synchronize_session=False
@@ -520,6 +530,32 @@ def make_shared_assignment(assignment_id: str, group_netids: list[list[str]]) ->
     }
 
 
+@cache.memoize(timeout=5 * 60, unless=is_debug)
+def get_assignment_test_catalog(assignment_id: str) -> dict[str, dict[str, Any]]:
+    """
+    Get the catalog of assignment tests for an assignment, keyed by test
+    name. The pipeline report endpoints use this to look up tests without
+    loading the assignment test objects.
+
+    * This is cached, and is cleared whenever the tests are synced,
+    hidden or deleted *
+
+    :param assignment_id:
+    :return: dictionary of test name -> {id, hidden, points}
+    """
+    return {
+        name: {"id": test_id, "hidden": hidden is True, "points": points}
+        for test_id, name, hidden, points in db.session.query(
+            AssignmentTest.id,
+            AssignmentTest.name,
+            AssignmentTest.hidden,
+            AssignmentTest.points,
+        )
+        .filter(AssignmentTest.assignment_id == assignment_id)
+        .all()
+    }
+
+
 def get_assignment_tests(submission: Submission, only_visible=False):
     """
     Get a list of dictionaries of the matching Test, and TestResult
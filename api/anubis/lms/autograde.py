@@ -1,88 +1,322 @@
+import pickle
+import traceback
+import uuid
 from datetime import datetime
 
 from parse import parse
+from sqlalchemy import case, func
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import joinedload, selectinload, undefer
 
 from anubis.env import env
+from anubis.lms.assignments import get_assignment_due_date
 from anubis.lms.students import get_students_in_class
-from anubis.models import Assignment, AssignmentTest, Submission
-from anubis.utils.cache import cache
-from anubis.utils.data import is_debug, is_job
+from anubis.models import (
+    Assignment,
+    AssignmentTest,
+    BestSubmission,
+    Submission,
+    SubmissionBuild,
+    SubmissionTestResult,
+    db,
+)
+from anubis.utils.cache import (
+    cache,
+    cache_get_compressed,
+    cache_set_compressed,
+    compress_cache_value,
+    decompress_cache_value,
+)
+from anubis.utils.config import get_config_int
+from anubis.utils.data import is_debug, is_job, split_chunks
 from anubis.utils.http import error_response
+from anubis.utils.logging import logger
+from anubis.utils.redis import redis
 
 
-@cache.memoize(timeout=60, unless=is_debug, source_check=True)
-def _get_assignment_test_count(assignment_id) -> int:
-    return AssignmentTest.query.filter(
-        AssignmentTest.assignment_id == assignment_id,
-    ).count()
-
-
-@cache.memoize(timeout=5 * 60, unless=is_debug, source_check=True, forced_update=is_job)
-def autograde(student_id, assignment_id, max_time: datetime = None):
+def get_best_submission_ids(
+    assignment_id: str,
+    student_ids: list[str] | None = None,
+    max_time: datetime = None,
+) -> dict[str, str]:
     """
-    Get the stats for a specific student on a specific assignment.
+    Get the best submission for every student in an assignment using
+    a single query. The number of passed tests is aggregated per
+    submission in the database, then a window function picks the
+    most recent submission with the most tests passed for each
+    student.
 
-    Pulls all submissions, then finds the most recent one that
-    has the most tests that passed.
+    The result is a dictionary of owner_id -> submission_id. Students
+    that do not have a processed and accepted submission will not
+    have an entry.
 
-    * This function is heavily cached as it is IO intensive on the DB *
-
-    :param student_id:
     :param assignment_id:
-    :param max_time:
+    :param student_ids: optional list of user ids to limit the query to
+    :param max_time: optional maximum submission created time
     :return:
     """
 
     # list of filters for submission query
-    submission_filters = []
+    submission_filters = [
+        Submission.assignment_id == assignment_id,
+        Submission.owner_id != None,
+        Submission.processed == True,
+        Submission.accepted == True,
+    ]
+
+    # Limit to a specific set of students
+    if student_ids is not None:
+        submission_filters.append(Submission.owner_id.in_(student_ids))
 
     # maximum time to check
     if max_time is not None:
         submission_filters.append(Submission.created <= max_time)
 
-    # best is the best submission seen so far
-    best = None
-
-    # best_count is the most tests that have
-    # passed for this student so far
-    best_count = -1
-
-    # Get the max number of assignment tests that can be passed
-    # so we can stop early if we find a submission that has all
-    # tests passing
-    max_correct = _get_assignment_test_count(assignment_id)
-
-    # Iterate over all submissions for this student, tracking
-    # the best submission so far (based on number of tests passed).
-    # We start from the oldest submission and move to the newest.
-    for submission in (
-        Submission.query.filter(
-            Submission.assignment_id == assignment_id,
-            Submission.owner_id == student_id,
-            Submission.processed == True,
-            Submission.accepted == True,
-            *submission_filters
+    # Count the passed tests for each submission. Submissions without
+    # any test results are outer joined so that they count as 0.
+    submission_scores = (
+        db.session.query(
+            Submission.id.label("submission_id"),
+            Submission.owner_id.label("owner_id"),
+            Submission.created.label("created"),
+            func.coalesce(
+                func.sum(case((SubmissionTestResult.passed == True, 1), else_=0)),
+                0,
+            ).label("passed_count"),
         )
-            .order_by(Submission.created.desc())
-            .all()
-    ):
+        .outerjoin(SubmissionTestResult, SubmissionTestResult.submission_id == Submission.id)
+        .filter(*submission_filters)
+        .group_by(Submission.id, Submission.owner_id, Submission.created)
+        .subquery()
+    )
+
+    # Rank the submissions for each student. The best submission is the
+    # one with the most tests passed, and the most recent among those.
+    ranked_submissions = db.session.query(
+        submission_scores.c.owner_id,
+        submission_scores.c.submission_id,
+        func.row_number()
+        .over(
+            partition_by=submission_scores.c.owner_id,
+            order_by=(
+                submission_scores.c.passed_count.desc(),
+                submission_scores.c.created.desc(),
+                submission_scores.c.submission_id.desc(),
+            ),
+        )
+        .label("row_rank"),
+    ).subquery()
+
+    # Only take the top ranked submission for each student
+    best_submissions = (
+        db.session.query(ranked_submissions.c.owner_id, ranked_submissions.c.submission_id)
+        .filter(ranked_submissions.c.row_rank == 1)
+        .all()
+    )
+
+    return {owner_id: submission_id for owner_id, submission_id in best_submissions}
+
+
+def update_best_submission(owner_id: str | None, assignment_id: str) -> str | None:
+    """
+    Recalculate the best submission row for a single student on an
+    assignment. This should be called whenever something that could
+    change a student's best submission happens (test results reported,
+    build reported, submission processed, rejected or reset for regrade).
+
+    The recalculation is scoped to the one student, so it is a single
+    indexed query no matter how many submissions are in the assignment.
+
+    * Does not commit changes *
+
+    :param owner_id:
+    :param assignment_id:
+    :return: best submission id
+    """
+
+    # Submissions without an owner never have a best submission
+    if owner_id is None:
+        return None
+
+    # Find the best submission from the submission history
+    submission_id = get_best_submission_ids(assignment_id, student_ids=[owner_id]).get(owner_id, None)
+
+    # If there is no longer a best submission (ie. the only processed
+    # submission was reset for regrade), then drop the row.
+    if submission_id is None:
+        BestSubmission.query.filter(
+            BestSubmission.owner_id == owner_id,
+            BestSubmission.assignment_id == assignment_id,
+        ).delete(synchronize_session=False)
+        return None
+
+    # Reports for the same student can finish at the same time, so the
+    # row is upserted instead of read and then inserted.
+    submission: Submission = Submission.query.filter(Submission.id == submission_id).first()
+    _upsert_best_submissions(
+        [
+            {
+                "owner_id":      owner_id,
+                "assignment_id": assignment_id,
+                **_get_best_submission_fields(submission),
+            }
+        ]
+    )
+
+    return submission_id
+
+
+def _get_best_submission_fields(submission: Submission, due_date: datetime = None) -> dict:
+    """
+    Get the summary fields of a submission for its best submission row.
+
+    :param submission:
+    :param due_date: optional due date, looked up for the owner if not given
+    :return:
+    """
+
+    if due_date is None:
+        due_date = get_assignment_due_date(submission.owner_id, submission.assignment_id)
+
+    return {
+        "submission_id": submission.id,
+        "tests_passed":  sum(map(lambda result: 1 if result.passed else 0, submission.test_results)),
+        "build_passed":  submission.build.passed is True if submission.build is not None else False,
+        "late":          submission.created > due_date,
+        "last_updated":  datetime.now(),
+    }
+
+
+def _upsert_best_submissions(rows: list[dict]):
+    """
+    Insert best submission rows, or update the ones that already
+    exist for the student and assignment. Concurrent writers for the
+    same student do not fail on the primary key.
+
+    * Does not commit changes *
+
+    :param rows: best submission column values
+    :return:
+    """
+    if len(rows) == 0:
+        return
+
+    table = BestSubmission.__table__
+    fields = ["submission_id", "tests_passed", "build_passed", "late", "last_updated"]
+    dialect = db.session.get_bind().dialect.name
+
+    if dialect == "mysql":
+        stmt = mysql_insert(table).values(rows)
+        stmt = stmt.on_duplicate_key_update({field: stmt.inserted[field] for field in fields})
+    elif dialect == "sqlite":
+        stmt = sqlite_insert(table).values(rows)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["owner_id", "assignment_id"],
+            set_={field: stmt.excluded[field] for field in fields},
+        )
+    else:
+        for row in rows:
+            db.session.merge(BestSubmission(**row))
+        return
+
+    db.session.execute(stmt)
+
+
+def rebuild_best_submissions(assignment_id: str, commit: bool = True) -> dict[str, str]:
+    """
+    Rebuild the best submission rows for an entire assignment from the
+    submission history. This is used to backfill the table for existing
+    assignments, and as a fallback when an assignment has no rows yet.
+
+    Rows are upserted, so a rebuild can run alongside report updates,
+    or another rebuild, for the same assignment.
+
+    :param assignment_id:
+    :param commit:
+    :return: dictionary of owner_id -> submission_id
+    """
 
-        # Calculate the number of tests that passed in this submission
-        correct_count = sum(map(lambda result: 1 if result.passed else 0, submission.test_results))
+    # Calculate the best submissions for every student at once
+    best_submission_ids = get_best_submission_ids(assignment_id)
+
+    # Drop the rows of students that no longer have a best submission
+    BestSubmission.query.filter(
+        BestSubmission.assignment_id == assignment_id,
+        BestSubmission.owner_id.notin_(list(best_submission_ids.keys())),
+    ).delete(synchronize_session=False)
+
+    # Load the submissions in chunks so that the IN lists stay reasonably sized
+    for chunk in split_chunks(list(best_submission_ids.values()), 500):
+        _upsert_best_submissions(
+            [
+                {
+                    "owner_id":      submission.owner_id,
+                    "assignment_id": assignment_id,
+                    **_get_best_submission_fields(submission),
+                }
+                for submission in Submission.query.filter(Submission.id.in_(chunk)).all()
+            ]
+        )
+
+    if commit:
+        db.session.commit()
+
+    return best_submission_ids
+
+
+def get_assignment_best_submission_ids(assignment_id: str) -> dict[str, str]:
+    """
+    Read the best submission for every student in an assignment from the
+    best submission table. If the assignment has not been backfilled yet,
+    the rows are built from the submission history first.
+
+    :param assignment_id:
+    :return: dictionary of owner_id -> submission_id
+    """
+
+    best_submissions = (
+        db.session.query(BestSubmission.owner_id, BestSubmission.submission_id)
+        .filter(BestSubmission.assignment_id == assignment_id)
+        .all()
+    )
 
-        # If the number of passed tests in this assignment is as good
-        # or better as the best seen so far, update the running best.
-        if correct_count >= best_count:
-            best_count = correct_count
-            best = submission
+    # Lazily backfill assignments that have no rows
+    if len(best_submissions) == 0:
+        return rebuild_best_submissions(assignment_id)
 
-        # If the number of passed tests is equal to the number
-        # of tests then we can stop and use this assignment.
-        if best_count == max_correct:
-            break
+    return {owner_id: submission_id for owner_id, submission_id in best_submissions}
+
+
+@cache.memoize(timeout=60, unless=is_debug, source_check=True, forced_update=is_job)
+def autograde(student_id, assignment_id, max_time: datetime = None):
+    """
+    Get the stats for a specific student on a specific assignment.
+
+    Finds the most recent submission that has the most tests
+    that passed. Without a max_time, this is read straight out
+    of the best submission table.
+
+    :param student_id:
+    :param assignment_id:
+    :param max_time:
+    :return:
+    """
+
+    # The best submission table only tracks the current best
+    if max_time is None:
+        best: BestSubmission | None = BestSubmission.query.filter(
+            BestSubmission.owner_id == student_id,
+            BestSubmission.assignment_id == assignment_id,
+        ).first()
+        if best is not None:
+            return best.submission_id
+
+    # Calculate the best submission for only this student
+    best_submission_ids = get_best_submission_ids(assignment_id, student_ids=[student_id], max_time=max_time)
 
     # return the submission id of the best if there is one, otherwise None
-    return best.id if best is not None else None
+    return best_submission_ids.get(student_id, None)
 
 
 def autograde_submission_result_wrapper(
@@ -104,6 +338,103 @@ def autograde_submission_result_wrapper(
     :return:
     """
     if submission_id is None:
+        return _autograde_result(assignment, user_id, netid, name, None, None)
+
+    submission = Submission.query.filter(Submission.id == submission_id).first()
+    return _autograde_result(assignment, user_id, netid, name, submission, submission.admin_data)
+
+
+def bulk_autograde_submission_result_wrapper(
+    assignment: Assignment, student_submissions: list[tuple[dict, str | None]]
+) -> list[dict]:
+    """
+    Batch version of autograde_submission_result_wrapper. Takes a list of
+    (student, submission_id) pairs and builds the same autograde result
+    dictionaries, in the same order.
+
+    Instead of loading each submission and its relationships one at a time,
+    the submissions, repos, builds, test results and assignment tests are
+    loaded with IN lists and eager loading. This is a fixed number of
+    queries per chunk of submissions rather than several per student.
+
+    :param assignment:
+    :param student_submissions: list of (student data dict, submission id or None)
+    :return:
+    """
+
+    # Load all the best submissions with everything admin_data needs
+    submission_ids = [submission_id for _, submission_id in student_submissions if submission_id is not None]
+    submissions: dict[str, Submission] = {}
+    for chunk in split_chunks(submission_ids, 500):
+        for submission in (
+            Submission.query.filter(Submission.id.in_(chunk))
+            .options(
+                undefer(Submission.pipeline_log),
+                selectinload(Submission.repo),
+                joinedload(Submission.build).undefer(SubmissionBuild.stdout),
+                selectinload(Submission.test_results).options(
+                    undefer(SubmissionTestResult.output),
+                    undefer(SubmissionTestResult.message),
+                    selectinload(SubmissionTestResult.assignment_test),
+                ),
+            )
+            .all()
+        ):
+            submissions[submission.id] = submission
+
+    results = []
+    for student, submission_id in student_submissions:
+        submission = submissions.get(submission_id, None)
+        admin_data = _submission_admin_data(submission) if submission is not None else None
+        results.append(
+            _autograde_result(assignment, student["id"], student["netid"], student["name"], submission, admin_data)
+        )
+
+    return results
+
+
+def _submission_admin_data(submission: Submission) -> dict:
+    """
+    Build the same dictionary as Submission.admin_data, but from the
+    test results that are already loaded on the submission instead of
+    querying for them again.
+
+    :param submission:
+    :return:
+    """
+
+    tests = [{"test": result.assignment_test.data, "result": result.data} for result in submission.test_results]
+
+    data = submission.data
+    data["repo"] = submission.repo.repo_url
+    data["tests"] = tests
+    data["build"] = submission.build.data if submission.build is not None else None
+    data["pipeline_log"] = submission.pipeline_log
+
+    return data
+
+
+def _autograde_result(
+    assignment: Assignment,
+    user_id: str,
+    netid: str,
+    name: str,
+    submission: Submission | None,
+    admin_data: dict | None,
+) -> dict:
+    """
+    Build the autograde result dictionary for a student from their
+    (already loaded) best submission.
+
+    :param assignment:
+    :param user_id:
+    :param netid:
+    :param name:
+    :param submission:
+    :param admin_data:
+    :return:
+    """
+    if submission is None:
         # no submission
         return {
             "id": netid,
@@ -122,31 +453,165 @@ def autograde_submission_result_wrapper(
             "late": False,
         }
 
-    else:
-        submission = Submission.query.filter(Submission.id == submission_id).first()
-        repo_path = parse("https://github.com/{}", submission.repo.repo_url)[0]
-        best_count = sum(map(lambda x: 1 if x.passed else 0, submission.test_results))
-        late = "past due" if assignment.due_date < submission.created else "on time"
-        late = "past grace" if assignment.grace_date < submission.created else late
-        return {
-            "id": netid,
-            "user_id": user_id,
-            "netid": netid,
-            "name": name,
-            "submission": submission.admin_data,
-            "build_passed": submission.build.passed if submission.build is not None else False,
-            "tests_passed": best_count,
-            "total_tests": len(submission.test_results),
-            "tests_passed_names": [test.assignment_test.name for test in submission.test_results if test.passed],
-            "full_stats": "https://{}/api/private/submission/{}".format(env.DOMAIN, submission.id),
-            "main": "https://github.com/{}".format(repo_path),
-            "commits": "https://github.com/{}/commits/main".format(repo_path),
-            "commit_tree": "https://github.com/{}/tree/{}".format(repo_path, submission.commit),
-            "late": late,
+    repo_path = parse("https://github.com/{}", submission.repo.repo_url)[0]
+    best_count = sum(map(lambda x: 1 if x.passed else 0, submission.test_results))
+    late = "past due" if assignment.due_date < submission.created else "on time"
+    late = "past grace" if assignment.grace_date < submission.created else late
+    return {
+        "id": netid,
+        "user_id": user_id,
+        "netid": netid,
+        "name": name,
+        "submission": admin_data,
+        "build_passed": submission.build.passed if submission.build is not None else False,
+        "tests_passed": best_count,
+        "total_tests": len(submission.test_results),
+        "tests_passed_names": [test.assignment_test.name for test in submission.test_results if test.passed],
+        "full_stats": "https://{}/api/private/submission/{}".format(env.DOMAIN, submission.id),
+        "main": "https://github.com/{}".format(repo_path),
+        "commits": "https://github.com/{}/commits/main".format(repo_path),
+        "commit_tree": "https://github.com/{}/tree/{}".format(repo_path, submission.commit),
+        "late": late,
+    }
+
+
+def get_autograde_summaries(assignment: Assignment, students: list[dict]) -> list[dict]:
+    """
+    Build the compact autograde summary for each student. This is the
+    projection used by the admin list view. It has the best submission id,
+    the passed count and names, the build flag and lateness, but none of the
+    submission logs or test output. The full result for a single student is
+    available through autograde_submission_result_wrapper.
+
+    :param assignment:
+    :param students:
+    :return:
+    """
+
+    # Make sure the best submission table is populated for the assignment
+    if BestSubmission.query.filter(BestSubmission.assignment_id == assignment.id).first() is None:
+        rebuild_best_submissions(assignment.id)
+
+    # Only pull rows for the students that were asked for
+    student_ids = [student["id"] for student in students]
+
+    # Pull the best submission rows along with when each was submitted
+    best_submissions = {
+        owner_id: (submission_id, build_passed, created)
+        for owner_id, submission_id, build_passed, created in db.session.query(
+            BestSubmission.owner_id,
+            BestSubmission.submission_id,
+            BestSubmission.build_passed,
+            Submission.created,
+        )
+        .join(Submission, Submission.id == BestSubmission.submission_id)
+        .filter(BestSubmission.assignment_id == assignment.id, BestSubmission.owner_id.in_(student_ids))
+        .all()
+    }
+
+    # Pull only the names and passed flags of the best submission test results
+    test_results: dict[str, list[tuple[str, bool]]] = {}
+    for submission_id, test_name, passed in (
+        db.session.query(SubmissionTestResult.submission_id, AssignmentTest.name, SubmissionTestResult.passed)
+        .join(AssignmentTest, AssignmentTest.id == SubmissionTestResult.assignment_test_id)
+        .join(BestSubmission, BestSubmission.submission_id == SubmissionTestResult.submission_id)
+        .filter(BestSubmission.assignment_id == assignment.id, BestSubmission.owner_id.in_(student_ids))
+        .all()
+    ):
+        test_results.setdefault(submission_id, []).append((test_name, passed))
+
+    summaries = []
+    for student in students:
+        summary = {
+            "id": student["netid"],
+            "user_id": student["id"],
+            "netid": student["netid"],
+            "name": student["name"],
+            "submission": None,
+            "build_passed": False,
+            "tests_passed": 0,
+            "total_tests": 0,
+            "tests_passed_names": [],
+            "late": False,
         }
 
+        if student["id"] in best_submissions:
+            submission_id, build_passed, created = best_submissions[student["id"]]
+            results = test_results.get(submission_id, [])
+            late = "past due" if assignment.due_date < created else "on time"
+            late = "past grace" if assignment.grace_date < created else late
+            summary.update({
+                "submission": submission_id,
+                "build_passed": build_passed is True,
+                "tests_passed": sum(1 for _, passed in results if passed),
+                "total_tests": len(results),
+                "tests_passed_names": [test_name for test_name, passed in results if passed],
+                "late": late,
+            })
+
+        summaries.append(summary)
+
+    return summaries
+
+
+def _bulk_autograde_cache_key(assignment_id: str) -> str:
+    return f"bulk-autograde-{assignment_id}"
+
+
+def clear_bulk_autograde_cache(assignment_id: str):
+    """
+    Drop the cached autograde summaries for an assignment.
+
+    :param assignment_id:
+    :return:
+    """
+    cache.delete(_bulk_autograde_cache_key(assignment_id))
+
+
+def get_bulk_autograde_cache_size(assignment_id: str) -> dict[str, int]:
+    """
+    Report how large the cached autograde results for an assignment are.
+    The summary size is what is stored in the cache now. The full size is
+    what the previous memoized results holding every submission's admin
+    data would take when pickled.
+
+    :param assignment_id:
+    :return:
+    """
+    assignment = Assignment.query.filter(Assignment.id == assignment_id).first()
+    students = get_students_in_class(assignment.course_id)
+
+    summaries = get_autograde_summaries(assignment, students)
+    full_results = get_autograde_export(assignment, students)
+
+    return {
+        "students": len(students),
+        "summary_bytes": len(compress_cache_value(summaries)),
+        "full_bytes": len(pickle.dumps(full_results)),
+    }
+
+
+def get_autograde_export(assignment: Assignment, students: list[dict] = None) -> list[dict]:
+    """
+    Build the full autograde results for every student in an assignment,
+    with the submission data and github links that the compact summaries
+    leave out. This is what the admin autograde data export downloads.
+    It is only pulled on export, so it is not cached.
+
+    :param assignment:
+    :param students: students of the course, looked up if not given
+    :return:
+    """
+    if students is None:
+        students = get_students_in_class(assignment.course_id)
+    best_submission_ids = get_assignment_best_submission_ids(assignment.id)
+
+    return bulk_autograde_submission_result_wrapper(
+        assignment,
+        [(student, best_submission_ids.get(student["id"], None)) for student in students],
+    )
+
 
-@cache.memoize(timeout=60 * 60, unless=is_debug, forced_update=is_job)
 def bulk_autograde(assignment_id, netids=None, offset=0, limit=20):
     """
     Bulk autograde an assignment. Optionally specify a subset of netids.
@@ -154,8 +619,9 @@ def bulk_autograde(assignment_id, netids=None, offset=0, limit=20):
     The offset and limit are used here to have the results of this function
     move as a window of the results.
 
-    * Calculating the autograde results is very IO intensive on the db. For this,
-    these results are heavily cached. *
+    The results are compact summaries (see get_autograde_summaries). The
+    summaries for the whole class are cached as compressed json, and the
+    window is taken from that.
 
     :param assignment_id:
     :param netids:
@@ -164,9 +630,6 @@ def bulk_autograde(assignment_id, netids=None, offset=0, limit=20):
     :return:
     """
 
-    # Running list of the best submissions for each student
-    bests = []
-
     # Find the assignment object
     assignment = (
         Assignment.query.filter_by(name=assignment_id).first() or Assignment.query.filter_by(id=assignment_id).first()
@@ -174,27 +637,209 @@ def bulk_autograde(assignment_id, netids=None, offset=0, limit=20):
     if assignment is None:
         return error_response("assignment does not exist")
 
-    # Get the list of students to get autograde results for
-    students = get_students_in_class(assignment.course_id, offset=offset, limit=limit)
+    # Try to pull the compressed summaries for the whole class out of the cache
+    cache_key = _bulk_autograde_cache_key(assignment.id)
+    summaries = None if is_debug() or is_job() else cache_get_compressed(cache_key)
+
+    # Build the summaries for the whole class if they were not cached
+    if summaries is None:
+        students = get_students_in_class(assignment.course_id)
+        summaries = get_autograde_summaries(assignment, students)
+        if not is_debug():
+            cache_set_compressed(cache_key, summaries, timeout=5 * 60)
+
+    # Take the window of students
+    if offset is not None and limit is not None:
+        summaries = summaries[offset:offset + limit]
     if netids is not None:
-        students = filter(lambda x: x["netid"] in netids, students)
+        summaries = [summary for summary in summaries if summary["netid"] in netids]
 
-    # Run through each of the students, getting the autograde results for each
-    for student in students:
-        # Get the best submission for this student from this assignment
-        submission_id = autograde(student["id"], assignment.id)
-        bests.append(
-            # Use the stats_wrapper function to add all the necessary
-            # metadata for the submission.
-            autograde_submission_result_wrapper(
-                assignment,
-                student["id"],
-                student["netid"],
-                student["name"],
-                submission_id,
-            )
-        )
+    return summaries
+
+
+def _bulk_autograde_run_key(assignment_id: str) -> str:
+    return f"bulk-autograde-run-{assignment_id}"
+
+
+def _bulk_autograde_progress_key(run_id: str) -> str:
+    return f"bulk-autograde-progress-{run_id}"
+
+
+def _bulk_autograde_shard_key(run_id: str, index: int) -> str:
+    return f"bulk-autograde-shard-{run_id}-{index}"
+
+
+def run_sharded_bulk_autograde(assignment_id: str):
+    """
+    Recalculate the autograde summaries for an entire assignment by fanning
+    the roster out over the rpc workers. The roster is split into shards,
+    and each shard is enqueued as its own job on the regrade queue. The
+    last shard to finish merges the results into the cached summaries
+    that bulk_autograde reads.
+
+    If there is no redis (ie. mindebug), then the summaries are calculated
+    serially instead.
+
+    :param assignment_id:
+    :return:
+    """
+    from anubis.rpc.enqueue import rpc_enqueue
+
+    # Find the assignment object
+    assignment = Assignment.query.filter(Assignment.id == assignment_id).first()
+    if assignment is None:
+        logger.error(f"bulk autograde assignment does not exist {assignment_id}")
+        return
+
+    # Without redis there is nowhere to collect shard results
+    if redis is None:
+        bulk_autograde(assignment.id, limit=None, offset=None)
+        return
+
+    # Make sure the best submission table is populated before the
+    # shards start so that they do not each try to rebuild it.
+    if BestSubmission.query.filter(BestSubmission.assignment_id == assignment.id).first() is None:
+        rebuild_best_submissions(assignment.id)
+
+    # Split the roster. Only what the summaries need is passed to the shards.
+    students = [
+        {"id": student["id"], "netid": student["netid"], "name": student["name"]}
+        for student in get_students_in_class(assignment.course_id)
+    ]
+    shard_size = get_config_int("AUTOGRADE_SHARD_SIZE", default=100)
+    shards = split_chunks(students, shard_size)
+
+    # Record the run so that progress can be reported
+    run_id = uuid.uuid4().hex
+    progress_key = _bulk_autograde_progress_key(run_id)
+    redis.hset(
+        progress_key,
+        mapping={
+            "run_id":   run_id,
+            "total":    len(shards),
+            "done":     0,
+            "failed":   0,
+            "started":  str(datetime.now()),
+            "finished": "",
+            "error":    "",
+        },
+    )
+    redis.expire(progress_key, 60 * 60)
+    redis.set(_bulk_autograde_run_key(assignment.id), run_id, ex=60 * 60)
 
-    return bests
+    logger.info(f"bulk autograde {assignment.name} split into {len(shards)} shards")
 
+    # An empty roster has nothing to fan out
+    if len(shards) == 0:
+        reduce_bulk_autograde_shards(assignment.id, run_id, 0)
+        return
 
+    for index, shard in enumerate(shards):
+        rpc_enqueue(bulk_autograde_shard, queue="regrade", args=[assignment.id, run_id, index, shard])
+
+
+def bulk_autograde_shard(assignment_id: str, run_id: str, index: int, students: list[dict]):
+    """
+    Calculate the autograde summaries for one shard of the roster, and
+    store them in redis for the reducer. A shard that fails is recorded
+    in the progress of the run. If this is the last shard of the run to
+    report, it runs the reducer.
+
+    :param assignment_id:
+    :param run_id:
+    :param index:
+    :param students:
+    :return:
+    """
+    progress_key = _bulk_autograde_progress_key(run_id)
+
+    try:
+        assignment = Assignment.query.filter(Assignment.id == assignment_id).first()
+        summaries = get_autograde_summaries(assignment, students)
+
+        # Store the shard results
+        redis.set(_bulk_autograde_shard_key(run_id, index), compress_cache_value(summaries), ex=60 * 60)
+    except Exception as e:
+        logger.error(f"bulk autograde shard {index} of {run_id} failed" + traceback.format_exc())
+        db.session.rollback()
+        redis.hincrby(progress_key, "failed", 1)
+        redis.hset(progress_key, "error", f"shard {index} failed: {e}")
+
+    # Mark the shard as reported, whether or not it failed. The counter
+    # is incremented atomically, so exactly one shard will see the final count.
+    done = redis.hincrby(progress_key, "done", 1)
+    total = redis.hget(progress_key, "total")
+    if total is None:
+        logger.error(f"bulk autograde progress of {run_id} expired")
+        return
+
+    if done == int(total):
+        reduce_bulk_autograde_shards(assignment_id, run_id, int(total))
+
+
+def reduce_bulk_autograde_shards(assignment_id: str, run_id: str, total: int):
+    """
+    Merge the shard results of a run, in roster order, into the
+    cached bulk autograde summaries. If any shard failed, or its results
+    are gone, the cache is left alone, as the summaries would be missing
+    students. The run is marked finished with the error instead.
+
+    :param assignment_id:
+    :param run_id:
+    :param total:
+    :return:
+    """
+    progress_key = _bulk_autograde_progress_key(run_id)
+    shard_keys = [_bulk_autograde_shard_key(run_id, index) for index in range(total)]
+
+    summaries = []
+    missing = []
+    for index, blob in enumerate(redis.mget(shard_keys) if total > 0 else []):
+        if blob is None:
+            missing.append(index)
+            continue
+        summaries.extend(decompress_cache_value(blob))
+
+    if len(missing) == 0:
+        cache_set_compressed(_bulk_autograde_cache_key(assignment_id), summaries, timeout=5 * 60)
+        logger.info(f"bulk autograde reduced {total} shards for {assignment_id}")
+    else:
+        logger.error(f"bulk autograde {run_id} for {assignment_id} is missing shards {missing}, not caching")
+        if (redis.hget(progress_key, "error") or b"").decode() == "":
+            redis.hset(progress_key, "error", f"missing results of shards {missing}")
+
+    # Clean up the shard results, and mark the run finished
+    if total > 0:
+        redis.delete(*shard_keys)
+    redis.hset(progress_key, "finished", str(datetime.now()))
+
+
+def get_bulk_autograde_progress(assignment_id: str) -> dict | None:
+    """
+    Get the shard progress of the most recent sharded bulk
+    autograde run for an assignment.
+
+    :param assignment_id:
+    :return:
+    """
+    if redis is None:
+        return None
+
+    run_id = redis.get(_bulk_autograde_run_key(assignment_id))
+    if run_id is None:
+        return None
+
+    progress = redis.hgetall(_bulk_autograde_progress_key(run_id.decode()))
+    if len(progress) == 0:
+        return None
+
+    progress = {key.decode(): value.decode() for key, value in progress.items()}
+    return {
+        "run_id":   progress["run_id"],
+        "total":    int(progress["total"]),
+        "done":     int(progress["done"]),
+        "failed":   int(progress.get("failed", 0)),
+        "started":  progress["started"],
+        "finished": progress["finished"] or None,
+        "error":    progress.get("error", "") or None,
+    }
@@ -0,0 +1,270 @@
+from datetime import datetime
+
+from parse import parse
+
+from anubis.lms.assignments import get_assignment_test_catalog
+from anubis.models import Submission, SubmissionTestResult, db
+from anubis.utils.data import COMPRESSED_TEXT_MAX_LENGTH, req_assert
+
+
+def apply_build_report(submission: Submission, stdout: str, passed: bool):
+    """
+    Apply a build result reported by a submission pipeline. If the
+    build did not pass, then the submission pipeline is done.
+
+    * Does not commit changes *
+
+    :param submission:
+    :param stdout:
+    :param passed:
+    :return:
+    """
+
+    if len(stdout) > COMPRESSED_TEXT_MAX_LENGTH:
+        stdout = stdout[:COMPRESSED_TEXT_MAX_LENGTH]
+
+    # Update submission build
+    submission.build.stdout = stdout
+    submission.build.passed = passed
+
+    # If the build did not passed, then the
+    # submission pipeline is done
+    if passed is False:
+        submission.processed = True
+        submission.state = "Build did not succeed"
+
+    db.session.add(submission)
+    db.session.add(submission.build)
+
+
+def apply_test_report(
+    submission: Submission,
+    test_name: str,
+    passed: bool,
+    message: str,
+    output_type: str,
+    output: str,
+) -> bool:
+    """
+    Apply a test result reported by a submission pipeline. The assignment
+    test is found by name in the cached test catalog, then the matching
+    submission test result row is updated directly.
+
+    * Does not commit changes *
+
+    :param submission:
+    :param test_name:
+    :param passed:
+    :param message:
+    :param output_type:
+    :param output:
+    :return: False if the test name was not valid
+    """
+
+    if len(output) > COMPRESSED_TEXT_MAX_LENGTH:
+        output = output[:COMPRESSED_TEXT_MAX_LENGTH]
+
+    # Look up the assignment test by name
+    assignment_test = get_assignment_test_catalog(submission.assignment_id).get(test_name, None)
+    if assignment_test is None:
+        return False
+
+    # Update the result row for this test
+    updated = SubmissionTestResult.query.filter(
+        SubmissionTestResult.submission_id == submission.id,
+        SubmissionTestResult.assignment_test_id == assignment_test["id"],
+    ).update(
+        {
+            "passed": passed,
+            "message": message,
+            "output_type": output_type,
+            "output": output,
+            "last_updated": datetime.now(),
+        },
+        synchronize_session="evaluate",
+    )
+
+    return updated > 0
+
+
+def get_hidden_test_names(submission: Submission) -> set[str]:
+    """
+    Get the names of the hidden assignment tests for a submission.
+
+    :param submission:
+    :return:
+    """
+    catalog = get_assignment_test_catalog(submission.assignment_id)
+    return {name for name, test in catalog.items() if test["hidden"]}
+
+
+def apply_state_report(
+    submission: Submission,
+    state: str,
+    processed: bool | None = None,
+    hidden_test_names: set[str] | None = None,
+):
+    """
+    Apply a state reported by a submission pipeline.
+
+    States for hidden tests are not written to the submission. We do this
+    by checking the state that was given, to read the name of the test. If
+    the assignment test that was found is marked as hidden, then we should
+    not update the state of the submission model. If we were to update the
+    state of the submission when a hidden test is reported, then it would
+    be visible to the students in the frontend.
+
+    * Does not commit changes *
+
+    :param submission:
+    :param state:
+    :param processed: optionally update the processed field
+    :param hidden_test_names: hidden test names, looked up if not given
+    :return:
+    """
+
+    hidden_test = False
+
+    # Do a basic match on the expected test
+    match = parse("Running test: {}", state)
+
+    # If we got a match
+    if match:
+        # Get the parsed assignment test name
+        test_name = match[0]
+
+        if hidden_test_names is None:
+            hidden_test_names = get_hidden_test_names(submission)
+
+        # set hidden_test to True if the test exists, and if it is marked as hidden
+        hidden_test = test_name in hidden_test_names
+
+    # Update state field if the state report is not for a hidden test
+    if not hidden_test:
+        submission.state = state
+
+    # If processed was specified, then update that too
+    if processed is not None:
+        submission.processed = processed
+
+    db.session.add(submission)
+
+
+def apply_panic_report(submission: Submission, report: dict):
+    """
+    Apply a panic reported by a submission pipeline. The submission
+    is marked as processed, and the panic is saved in its errors.
+
+    * Does not commit changes *
+
+    :param submission:
+    :param report: the panic json reported
+    :return:
+    """
+
+    # set the submission state
+    submission.processed = True
+    submission.state = "Whoops! There was an error on our end. The error has been logged."
+    submission.errors = {"panic": report}
+
+    db.session.add(submission)
+
+
+def assert_batch_report(
+    tests: list,
+    build: dict | None = None,
+    states: list | None = None,
+    processed: bool | None = None,
+):
+    """
+    Verify the shape of a batch report from a submission pipeline. An
+    AssertError with status code 406 is raised if anything is malformed.
+
+    :param tests:
+    :param build:
+    :param states:
+    :param processed:
+    :return:
+    """
+
+    req_assert(
+        build is None
+        or (isinstance(build, dict) and isinstance(build.get("stdout"), str) and isinstance(build.get("passed"), bool)),
+        message="Malformed requests. Invalid build.",
+        status_code=406,
+    )
+    req_assert(
+        states is None or (isinstance(states, list) and all(isinstance(state, str) for state in states)),
+        message="Malformed requests. Invalid states.",
+        status_code=406,
+    )
+    req_assert(
+        processed is None or isinstance(processed, bool),
+        message="Malformed requests. Invalid processed.",
+        status_code=406,
+    )
+    for test in tests:
+        req_assert(
+            isinstance(test, dict)
+            and isinstance(test.get("test_name"), str)
+            and isinstance(test.get("passed"), bool)
+            and isinstance(test.get("message"), str)
+            and isinstance(test.get("output_type"), str)
+            and isinstance(test.get("output"), str),
+            message="Malformed requests. Invalid test.",
+            status_code=406,
+        )
+
+
+def apply_batch_report(
+    submission: Submission,
+    tests: list[dict],
+    build: dict | None = None,
+    states: list[str] | None = None,
+    processed: bool | None = None,
+) -> list[str]:
+    """
+    Apply a batch of reports from a submission pipeline. The build is
+    applied first, then the tests, then the states in order, then the
+    processed flag.
+
+    * Does not commit changes *
+
+    :param submission:
+    :param tests: list of test reports
+    :param build: optional build report
+    :param states: optional list of states
+    :param processed: optionally update the processed field
+    :return: list of test names that were not valid
+    """
+
+    # Update submission build
+    if build is not None:
+        apply_build_report(submission, build["stdout"], build["passed"])
+
+    # Update the test results
+    invalid_test_names = []
+    for test in tests:
+        valid_test = apply_test_report(
+            submission,
+            test["test_name"],
+            test["passed"],
+            test["message"],
+            test["output_type"],
+            test["output"],
+        )
+        if not valid_test:
+            invalid_test_names.append(test["test_name"])
+
+    # Update the states. The hidden tests are only looked up once.
+    states = states or []
+    hidden_test_names = get_hidden_test_names(submission) if len(states) > 0 else set()
+    for state in states:
+        apply_state_report(submission, state, hidden_test_names=hidden_test_names)
+
+    # If processed was specified, then update that too
+    if processed is not None:
+        submission.processed = processed
+        db.session.add(submission)
+
+    return invalid_test_names
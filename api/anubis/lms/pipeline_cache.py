@@ -0,0 +1,193 @@
+import hashlib
+import json
+
+from anubis.lms.assignments import get_assignment_test_catalog
+from anubis.lms.autograde import update_best_submission
+from anubis.models import Submission, SubmissionBuild, db
+from anubis.utils.config import get_config_bool
+
+
+def get_test_set_version(assignment_id: str) -> str:
+    """
+    Get a version for the set of tests on an assignment. The version
+    changes when tests are added, removed or renamed.
+
+    :param assignment_id:
+    :return:
+    """
+    catalog = get_assignment_test_catalog(assignment_id)
+    tests = sorted((name, test["id"]) for name, test in catalog.items())
+    return hashlib.sha1(json.dumps(tests).encode()).hexdigest()
+
+
+def get_pipeline_cache_key(submission: Submission) -> str | None:
+    """
+    Get the result cache key for a submission. Two submissions with the
+    same key have the same files, are tested by the same pipeline image
+    and have the same tests.
+
+    The pipeline image is used as it is set on the assignment, which is
+    usually a mutable tag. Cached results are only used if they were
+    graded on the digest the image last resolved to, see
+    find_cached_pipeline_result.
+
+    :param submission:
+    :return: the key, or None if the submission tree is not known
+    """
+    if submission.tree_hash is None:
+        return None
+
+    key = ":".join(
+        [
+            submission.tree_hash,
+            submission.assignment.pipeline_image or "",
+            get_test_set_version(submission.assignment_id),
+        ]
+    )
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def parse_pipeline_image_digest(image_id: str | None) -> str | None:
+    """
+    Get the digest out of the image id of a container status. These
+    look like docker-pullable://registry/image@sha256:...
+
+    :param image_id:
+    :return: "sha256:...", or None if the image id has no digest
+    """
+    if not image_id or "sha256:" not in image_id:
+        return None
+    return "sha256:" + image_id.rsplit("sha256:", 1)[1]
+
+
+def record_pipeline_image_digest(submission: Submission, digest: str | None):
+    """
+    Record the pipeline image digest a submission was graded on. It is
+    also kept on the assignment as the digest the pipeline image now
+    resolves to, so results graded on an older build stop being used.
+
+    * Does not commit changes *
+
+    :param submission:
+    :param digest:
+    :return:
+    """
+    if digest is None:
+        return
+
+    submission.pipeline_image_digest = digest
+    submission.assignment.pipeline_image_digest = digest
+    db.session.add(submission)
+    db.session.add(submission.assignment)
+
+
+def find_cached_pipeline_result(submission: Submission, cache_key: str) -> Submission | None:
+    """
+    Find an earlier submission that was graded with the same cache key,
+    on the digest the pipeline image last resolved to. Only submissions
+    that finished cleanly are used.
+
+    :param submission:
+    :param cache_key:
+    :return:
+    """
+    from anubis.lms.submissions import SUBMISSION_SUPERSEDED_STATE
+
+    # Without a known digest there is no telling if the image was rebuilt
+    digest = submission.assignment.pipeline_image_digest
+    if digest is None:
+        return None
+
+    candidates: list[Submission] = (
+        Submission.query.join(SubmissionBuild, SubmissionBuild.submission_id == Submission.id)
+        .filter(
+            Submission.pipeline_cache_key == cache_key,
+            Submission.pipeline_image_digest == digest,
+            Submission.assignment_id == submission.assignment_id,
+            Submission.id != submission.id,
+            Submission.processed == True,
+            Submission.accepted == True,
+            Submission.state != SUBMISSION_SUPERSEDED_STATE,
+            SubmissionBuild.passed.isnot(None),
+        )
+        .order_by(Submission.last_updated.desc())
+        .limit(5)
+        .all()
+    )
+
+    for candidate in candidates:
+        if candidate.errors is None:
+            return candidate
+
+    return None
+
+
+def apply_cached_pipeline_result(submission: Submission, cached: Submission):
+    """
+    Copy the build and test results of a cached submission onto a
+    submission, and mark it as processed.
+
+    * Does not commit changes *
+
+    :param submission:
+    :param cached:
+    :return:
+    """
+
+    # Copy the build
+    submission.build.stdout = cached.build.stdout
+    submission.build.passed = cached.build.passed
+    db.session.add(submission.build)
+
+    # Copy the test results, matched by assignment test
+    cached_results = {result.assignment_test_id: result for result in cached.test_results}
+    for result in submission.test_results:
+        cached_result = cached_results.get(result.assignment_test_id, None)
+        if cached_result is None:
+            continue
+        result.passed = cached_result.passed
+        result.message = cached_result.message
+        result.output_type = cached_result.output_type
+        result.output = cached_result.output
+        db.session.add(result)
+
+    submission.pipeline_cache_key = cached.pipeline_cache_key
+    submission.pipeline_image_digest = cached.pipeline_image_digest
+    submission.pipeline_log = f"Pipeline skipped. Results were copied from identical submission {cached.commit}."
+    submission.state = cached.state
+    submission.processed = True
+    db.session.add(submission)
+
+    update_best_submission(submission.owner_id, submission.assignment_id)
+
+
+def use_cached_pipeline_result(submission: Submission) -> bool:
+    """
+    Grade a submission from the result cache if an identical submission
+    was already graded on the same pipeline image digest. The cache is
+    off unless the PIPELINE_RESULT_CACHE config entry turns it on.
+
+    :param submission:
+    :return: True if the submission was graded from the cache
+    """
+    from anubis.lms.submissions import init_submission
+
+    if not get_config_bool("PIPELINE_RESULT_CACHE", default=False):
+        return False
+
+    cache_key = get_pipeline_cache_key(submission)
+    if cache_key is None:
+        return False
+
+    cached = find_cached_pipeline_result(submission, cache_key)
+    if cached is None:
+        return False
+
+    # Make sure the result rows exist to copy into
+    if submission.build is None:
+        init_submission(submission, commit=False)
+
+    apply_cached_pipeline_result(submission, cached)
+    db.session.commit()
+
+    return True
@@ -0,0 +1,351 @@
+import json
+import uuid
+
+from redis.exceptions import ResponseError
+from sqlalchemy.orm import lazyload
+
+from anubis.lms.autograde import update_best_submission
+from anubis.lms.pipeline import (
+    apply_batch_report,
+    apply_build_report,
+    apply_panic_report,
+    apply_state_report,
+    apply_test_report,
+)
+from anubis.models import Submission, db
+from anubis.utils.cache import cache
+from anubis.utils.logging import logger
+from anubis.utils.redis import redis
+
+INGEST_STREAM = "pipeline-ingest"
+INGEST_GROUP = "pipeline-ingest"
+INGEST_DEAD_LETTER_STREAM = "pipeline-ingest-dead"
+
+# How long an idempotency key is remembered
+INGEST_KEY_TTL = 60 * 60 * 24
+
+# Name the ingest consumer reads as. It stays the same when the pod is
+# replaced, so entries left pending by the old pod are read again.
+INGEST_CONSUMER = "pipeline-ingest"
+
+# Entries pending this long on any consumer are taken over by the
+# running consumer. This picks up entries left behind by consumers
+# that ran under another name, like an old pod or a drain.
+INGEST_CLAIM_IDLE_MS = 60 * 1000
+
+
+@cache.memoize(timeout=60 * 15)
+def get_submission_token(submission_id: str) -> str | None:
+    """
+    Get the pipeline token for a submission. Submission tokens do not
+    change, so they can be cached for the ingest endpoints to verify
+    reports without going to the database each time.
+
+    :param submission_id:
+    :return: the token, or None if the submission does not exist
+    """
+    submission: Submission = Submission.query.filter(Submission.id == submission_id).first()
+    if submission is None:
+        return None
+    return submission.token
+
+
+def ensure_ingest_group():
+    """
+    Create the ingest stream and its consumer group if they
+    do not exist yet.
+
+    :return:
+    """
+    try:
+        redis.xgroup_create(INGEST_STREAM, INGEST_GROUP, id="0", mkstream=True)
+    except ResponseError as e:
+        # The group already exists
+        if "BUSYGROUP" not in str(e):
+            raise
+
+
+def enqueue_pipeline_report(kind: str, submission_id: str, payload: dict, key: str = None) -> bool:
+    """
+    Append a validated pipeline report to the ingest stream. Reports
+    that are posted again with the same idempotency key are dropped.
+
+    :param kind: panic, build, test, state or batch
+    :param submission_id:
+    :param payload: the report, as the arguments for apply_pipeline_report
+    :param key: idempotency key, generated if not given
+    :return: False if the report was a duplicate
+    """
+
+    if key is None:
+        key = uuid.uuid4().hex
+
+    # Claim the idempotency key
+    seen_key = f"pipeline-ingest-key-{key}"
+    if not redis.set(seen_key, 1, nx=True, ex=INGEST_KEY_TTL):
+        logger.info(f"Dropping duplicate pipeline report {key}")
+        return False
+
+    try:
+        redis.xadd(
+            INGEST_STREAM,
+            {
+                "kind":          kind,
+                "submission_id": submission_id,
+                "key":           key,
+                "payload":       json.dumps(payload),
+            },
+        )
+    except Exception:
+        # Release the key so the pipeline can retry
+        redis.delete(seen_key)
+        raise
+
+    return True
+
+
+def apply_pipeline_report(submission: Submission, kind: str, payload: dict):
+    """
+    Apply a report from the ingest stream to a submission.
+
+    * Does not commit changes *
+
+    :param submission:
+    :param kind:
+    :param payload:
+    :return:
+    """
+
+    match kind:
+        case "panic":
+            apply_panic_report(submission, payload["report"])
+        case "build":
+            apply_build_report(submission, payload["stdout"], payload["passed"])
+        case "test":
+            valid_test = apply_test_report(
+                submission,
+                payload["test_name"],
+                payload["passed"],
+                payload["message"],
+                payload["output_type"],
+                payload["output"],
+            )
+            if not valid_test:
+                logger.error(
+                    "Invalid submission test result reported",
+                    extra={"submission_id": submission.id, "test_name": payload["test_name"]},
+                )
+        case "state":
+            apply_state_report(submission, payload["state"], processed=payload["processed"])
+        case "batch":
+            invalid_test_names = apply_batch_report(
+                submission,
+                payload["tests"],
+                build=payload["build"],
+                states=payload["states"],
+                processed=payload["processed"],
+            )
+            if len(invalid_test_names) > 0:
+                logger.error(
+                    "Invalid submission test results reported",
+                    extra={"submission_id": submission.id, "test_names": invalid_test_names},
+                )
+        case _:
+            raise ValueError(f"Unknown pipeline report kind {kind}")
+
+
+def _apply_entries(entries: list[tuple[str, dict]]):
+    """
+    Apply stream entries in order in a single transaction. The best
+    submission is updated once per processed submission at the end.
+
+    :param entries: list of (entry id, entry)
+    :return:
+    """
+
+    # Load all the submissions for the batch at once
+    submission_ids = list({entry["submission_id"] for _, entry in entries})
+    submissions: dict[str, Submission] = {
+        submission.id: submission
+        for submission in Submission.query.filter(Submission.id.in_(submission_ids))
+        .options(lazyload(Submission.test_results))
+        .all()
+    }
+
+    for entry_id, entry in entries:
+        submission = submissions.get(entry["submission_id"], None)
+
+        # The submission may have been deleted since the report was posted
+        if submission is None:
+            logger.warning(f"Dropping pipeline report {entry_id} for missing submission {entry['submission_id']}")
+            continue
+
+        apply_pipeline_report(submission, entry["kind"], json.loads(entry["payload"]))
+
+    # Submissions only become candidates for the best
+    # submission once they are processed
+    for submission in submissions.values():
+        if submission.processed:
+            update_best_submission(submission.owner_id, submission.assignment_id)
+
+    db.session.commit()
+
+
+def consume_pipeline_reports(consumer: str, count: int = 100, block: int | None = 1000, pending: bool = False) -> int:
+    """
+    Read a batch of reports from the ingest stream and apply them. The
+    whole batch is applied in one transaction. If that fails, the entries
+    are applied one at a time, and any that still fail are moved to the
+    dead letter stream. Entries are acknowledged and deleted from the
+    stream once they are committed.
+
+    Entries that were delivered but not acknowledged (the consumer died
+    mid batch) are read again with pending=True. Applying a report twice
+    leaves the submission the same as applying it once.
+
+    :param consumer: name of this consumer in the group
+    :param count: max entries to read
+    :param block: milliseconds to wait for new entries
+    :param pending: read this consumer's unacknowledged entries instead of new ones
+    :return: number of entries read
+    """
+
+    response = redis.xreadgroup(
+        INGEST_GROUP,
+        consumer,
+        {INGEST_STREAM: "0" if pending else ">"},
+        count=count,
+        block=None if pending else block,
+    )
+    if not response:
+        return 0
+
+    _, raw_entries = response[0]
+    if len(raw_entries) == 0:
+        return 0
+
+    entry_ids = [entry_id.decode() for entry_id, _ in raw_entries]
+    entries = [
+        (entry_id.decode(), {field.decode(): value.decode() for field, value in fields.items()})
+        for entry_id, fields in raw_entries
+        # Pending entries that were deleted come back empty
+        if fields
+    ]
+
+    try:
+        _apply_entries(entries)
+    except Exception:
+        db.session.rollback()
+        logger.exception(f"Failed to apply batch of {len(entries)} pipeline reports, retrying one at a time")
+
+        for entry_id, entry in entries:
+            try:
+                _apply_entries([(entry_id, entry)])
+            except Exception as e:
+                db.session.rollback()
+                logger.exception(f"Failed to apply pipeline report {entry_id}", extra={"entry": entry})
+                redis.xadd(INGEST_DEAD_LETTER_STREAM, {**entry, "id": entry_id, "error": str(e)})
+
+    # Acknowledge and drop everything that was applied
+    pipe = redis.pipeline()
+    pipe.xack(INGEST_STREAM, INGEST_GROUP, *entry_ids)
+    pipe.xdel(INGEST_STREAM, *entry_ids)
+    pipe.execute()
+
+    return len(raw_entries)
+
+
+def claim_stale_pipeline_reports(consumer: str, min_idle_ms: int = INGEST_CLAIM_IDLE_MS) -> int:
+    """
+    Take over entries that were delivered to any consumer, but have
+    not been acknowledged for min_idle_ms. They are then read with
+    consume_pipeline_reports(consumer, pending=True).
+
+    :param consumer:
+    :param min_idle_ms:
+    :return: number of entries claimed
+    """
+
+    claimed = 0
+    start_id = "0-0"
+    while True:
+        response = redis.xautoclaim(
+            INGEST_STREAM,
+            INGEST_GROUP,
+            consumer,
+            min_idle_ms,
+            start_id=start_id,
+            count=100,
+            justid=True,
+        )
+        start_id, entry_ids = response[0], response[1]
+        claimed += len(entry_ids)
+        if start_id in (b"0-0", "0-0"):
+            break
+
+    if claimed > 0:
+        logger.info(f"Claimed {claimed} stale pipeline reports for {consumer}")
+
+    return claimed
+
+
+def drain_pipeline_reports(consumer: str, count: int = 100) -> int:
+    """
+    Apply everything in the ingest stream, then return. This should be
+    run before turning ingest mode off, so that no reports are left
+    behind in the stream.
+
+    :param consumer:
+    :param count:
+    :return: number of entries read
+    """
+    ensure_ingest_group()
+
+    total = 0
+
+    # Finish anything this consumer, or one that is gone, was in the middle of
+    claim_stale_pipeline_reports(consumer)
+    while (read := consume_pipeline_reports(consumer, count=count, pending=True)) > 0:
+        total += read
+
+    # Then everything that has not been delivered yet
+    while (read := consume_pipeline_reports(consumer, count=count, block=None)) > 0:
+        total += read
+
+    return total
+
+
+def get_pipeline_ingest_lag() -> dict:
+    """
+    Get how far the ingest consumer is behind. Entries are deleted once
+    they are applied, so everything left in the stream is lag. Pending
+    entries have been read by a consumer but not committed yet.
+
+    :return:
+    """
+
+    if redis is None:
+        return {"enabled": False}
+
+    ensure_ingest_group()
+
+    length = redis.xlen(INGEST_STREAM)
+    pending = redis.xpending(INGEST_STREAM, INGEST_GROUP)["pending"]
+
+    # Stream ids start with the millisecond timestamp they were added at
+    oldest_age = 0.0
+    oldest = redis.xrange(INGEST_STREAM, count=1)
+    if len(oldest) > 0:
+        seconds, microseconds = redis.time()
+        now_ms = seconds * 1000 + microseconds // 1000
+        oldest_ms = int(oldest[0][0].decode().split("-")[0])
+        oldest_age = max(now_ms - oldest_ms, 0) / 1000
+
+    return {
+        "enabled":     True,
+        "length":      length,
+        "pending":     pending,
+        "undelivered": max(length - pending, 0),
+        "oldest_age":  oldest_age,
+        "dead_letter": redis.xlen(INGEST_DEAD_LETTER_STREAM),
+    }
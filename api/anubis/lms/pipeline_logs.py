@@ -0,0 +1,120 @@
+import gzip
+
+from anubis.models import Submission, db
+from anubis.utils.data import COMPRESSED_TEXT_MAX_LENGTH
+from anubis.utils.redis import redis
+
+# Running pipeline logs are kept in redis until the pipeline is reaped
+PIPELINE_LOG_TTL = 60 * 60 * 6
+
+# Most chunks kept for a running pipeline. Older chunks are dropped
+# so that the tail of the log is kept.
+PIPELINE_LOG_MAX_CHUNKS = 2048
+
+
+def _pipeline_log_chunks_key(submission_id: str) -> str:
+    return f"pipeline-log-chunks-{submission_id}"
+
+
+def _pipeline_log_cursor_key(submission_id: str) -> str:
+    return f"pipeline-log-cursor-{submission_id}"
+
+
+def get_pipeline_log_cursor(submission_id: str) -> dict[str, str]:
+    """
+    Get where the log capture for a submission pipeline left off.
+
+    :param submission_id:
+    :return: dictionary of pod, time and seen, empty if nothing was captured yet
+    """
+    cursor = redis.hgetall(_pipeline_log_cursor_key(submission_id))
+    return {key.decode(): value.decode() for key, value in cursor.items()}
+
+
+def append_pipeline_log(submission_id: str, text: str, cursor: dict[str, str]):
+    """
+    Append a chunk of log to the store for a running pipeline, and
+    move the cursor forward.
+
+    :param submission_id:
+    :param text:
+    :param cursor:
+    :return:
+    """
+    chunks_key = _pipeline_log_chunks_key(submission_id)
+    cursor_key = _pipeline_log_cursor_key(submission_id)
+
+    pipe = redis.pipeline()
+    if len(text) > 0:
+        pipe.rpush(chunks_key, gzip.compress(text.encode(), compresslevel=6))
+        pipe.ltrim(chunks_key, -PIPELINE_LOG_MAX_CHUNKS, -1)
+        pipe.expire(chunks_key, PIPELINE_LOG_TTL)
+    pipe.hset(cursor_key, mapping=cursor)
+    pipe.expire(cursor_key, PIPELINE_LOG_TTL)
+    pipe.execute()
+
+
+def get_stored_pipeline_log(submission_id: str) -> str | None:
+    """
+    Get the log captured so far for a running pipeline.
+
+    :param submission_id:
+    :return: the log, or None if nothing is stored
+    """
+    if redis is None:
+        return None
+
+    chunks = redis.lrange(_pipeline_log_chunks_key(submission_id), 0, -1)
+    if len(chunks) == 0:
+        return None
+
+    return "".join(gzip.decompress(chunk).decode(errors="replace") for chunk in chunks)
+
+
+def clear_pipeline_log(submission_id: str):
+    """
+    Drop the stored log for a submission pipeline.
+
+    :param submission_id:
+    :return:
+    """
+    if redis is None:
+        return
+
+    redis.delete(_pipeline_log_chunks_key(submission_id), _pipeline_log_cursor_key(submission_id))
+
+
+def flush_pipeline_log(submission: Submission):
+    """
+    Move the stored log for a pipeline to the submission. The tail of
+    the log is kept if it is too long. If nothing was stored, the
+    submission log is left alone.
+
+    * Does not commit changes *
+
+    :param submission:
+    :return:
+    """
+    log = get_stored_pipeline_log(submission.id)
+    if log is not None:
+        submission.pipeline_log = log[-COMPRESSED_TEXT_MAX_LENGTH:]
+        db.session.add(submission)
+
+    clear_pipeline_log(submission.id)
+
+
+def get_pipeline_log_tail(submission: Submission, lines: int = 200) -> tuple[str, bool]:
+    """
+    Get the last lines of a pipeline log. The stored log is used while
+    the pipeline is running, otherwise the log saved on the submission.
+
+    :param submission:
+    :param lines:
+    :return: the log tail, and if the pipeline is still running
+    """
+    log = get_stored_pipeline_log(submission.id)
+    running = log is not None
+    if log is None:
+        log = submission.pipeline_log or ""
+
+    return "".join(log.splitlines(keepends=True)[-lines:]), running
@@ -0,0 +1,292 @@
+import math
+import time
+
+from anubis.models import Submission, db
+from anubis.utils.config import get_config_dict
+from anubis.utils.data import rand
+from anubis.utils.redis import redis
+
+# Warm pool policy. Can be overridden with the PIPELINE_WARM_POOL config
+# entry. Only assignments listed by id get a pool, as their pipeline
+# images need to support claiming work with --claim.
+#
+#   assignments             ids of assignments with a warm pool
+#   min_pods                idle pods kept for an assignment with recent pushes
+#   max_pods                most idle pods kept for an assignment
+#   pushes_per_pod          pushes in the window for each idle pod
+#   window_minutes          how far back pushes are counted
+#   claim_timeout_seconds   how long an offer waits to be claimed before
+#                           the submission gets a pipeline job of its own
+DEFAULT_PIPELINE_WARM_POOL = {
+    "assignments":           [],
+    "min_pods":              1,
+    "max_pods":              4,
+    "pushes_per_pod":        10,
+    "window_minutes":        10,
+    "claim_timeout_seconds": 15,
+}
+
+# All the warm pool keys share this prefix:
+#
+#   queue:<assignment>      list of submission ids offered to the pool
+#   offered                 hash of submission id -> time it was offered
+#   pushes:<assignment>     zset of recent pushes, submission id -> time
+#   pods                    hash of idle pool job name -> assignment id:token
+#   claims                  hash of pool job name -> claimed submission id
+#   idle                    hash of assignment id -> idle pool jobs
+PIPELINE_POOL_PREFIX = "pipeline-pool:"
+
+# Take the next offered submission for a pool job, if the job token
+# matches and the job was not retired.
+#
+# ARGV: prefix, job name, token
+_CLAIM_SCRIPT = """
+local p = ARGV[1]
+local pod = redis.call('HGET', p .. 'pods', ARGV[2])
+if not pod then
+    return false
+end
+local sep = string.find(pod, ':', 1, true)
+local assignment_id = string.sub(pod, 1, sep - 1)
+if string.sub(pod, sep + 1) ~= ARGV[3] then
+    return false
+end
+local submission_id = redis.call('LPOP', p .. 'queue:' .. assignment_id)
+if not submission_id then
+    return false
+end
+redis.call('HDEL', p .. 'offered', submission_id)
+redis.call('HDEL', p .. 'pods', ARGV[2])
+redis.call('HSET', p .. 'claims', ARGV[2], submission_id)
+return submission_id
+"""
+
+# Retire an idle pool job so that it can be deleted. Jobs that
+# claimed a submission are not retired.
+#
+# ARGV: prefix, job name
+_RETIRE_SCRIPT = """
+local p = ARGV[1]
+if redis.call('HEXISTS', p .. 'claims', ARGV[2]) == 1 then
+    return 0
+end
+redis.call('HDEL', p .. 'pods', ARGV[2])
+return 1
+"""
+
+_claim_script = redis.register_script(_CLAIM_SCRIPT) if redis is not None else None
+_retire_script = redis.register_script(_RETIRE_SCRIPT) if redis is not None else None
+
+
+def _key(name: str) -> str:
+    return PIPELINE_POOL_PREFIX + name
+
+
+def get_pipeline_pool_config() -> dict:
+    """
+    Get the warm pool policy from the PIPELINE_WARM_POOL config entry,
+    with missing keys filled in from the defaults.
+
+    :return:
+    """
+    pool_config = get_config_dict("PIPELINE_WARM_POOL", default=DEFAULT_PIPELINE_WARM_POOL)
+    if not isinstance(pool_config, dict):
+        pool_config = DEFAULT_PIPELINE_WARM_POOL
+
+    return {**DEFAULT_PIPELINE_WARM_POOL, **pool_config}
+
+
+def is_pipeline_pool_enabled(assignment_id: str) -> bool:
+    if redis is None:
+        return False
+    return assignment_id in get_pipeline_pool_config()["assignments"]
+
+
+def record_pipeline_push(assignment_id: str, submission_id: str):
+    """
+    Count a push for an assignment, for sizing its warm pool.
+
+    :param assignment_id:
+    :param submission_id:
+    :return:
+    """
+    if not is_pipeline_pool_enabled(assignment_id):
+        return
+
+    now = time.time()
+    window = get_pipeline_pool_config()["window_minutes"] * 60
+
+    pipe = redis.pipeline()
+    pipe.zadd(_key(f"pushes:{assignment_id}"), {submission_id: now})
+    pipe.zremrangebyscore(_key(f"pushes:{assignment_id}"), "-inf", now - window)
+    pipe.expire(_key(f"pushes:{assignment_id}"), window)
+    pipe.execute()
+
+
+def get_pipeline_pool_size(assignment_id: str) -> int:
+    """
+    Get how many idle pool jobs an assignment should have. Assignments
+    with no pushes in the window get none. Otherwise it is one job for
+    each pushes_per_pod pushes, between min_pods and max_pods.
+
+    :param assignment_id:
+    :return:
+    """
+    if not is_pipeline_pool_enabled(assignment_id):
+        return 0
+
+    pool_config = get_pipeline_pool_config()
+    now = time.time()
+    pushes = redis.zcount(_key(f"pushes:{assignment_id}"), now - pool_config["window_minutes"] * 60, "+inf")
+    if pushes == 0:
+        return 0
+
+    size = math.ceil(pushes / max(pool_config["pushes_per_pod"], 1))
+    return max(pool_config["min_pods"], min(size, pool_config["max_pods"]))
+
+
+def register_pipeline_pool_job(job_name: str, assignment_id: str) -> str:
+    """
+    Register a new pool job, and get the token it claims work with.
+
+    :param job_name:
+    :param assignment_id:
+    :return: token
+    """
+    token = rand(40)
+    redis.hset(_key("pods"), job_name, f"{assignment_id}:{token}")
+    return token
+
+
+def retire_pipeline_pool_job(job_name: str) -> bool:
+    """
+    Stop an idle pool job from claiming work, so it can be deleted.
+
+    :param job_name:
+    :return: False if the job already claimed a submission
+    """
+    return _retire_script(args=[PIPELINE_POOL_PREFIX, job_name]) == 1
+
+
+def set_pipeline_pool_idle(assignment_id: str, idle: int):
+    redis.hset(_key("idle"), assignment_id, idle)
+
+
+def offer_pipeline_to_pool(submission: Submission) -> bool:
+    """
+    Offer a submission to the warm pool of its assignment. It is only
+    offered if there are more idle pool jobs than submissions already
+    waiting to be claimed.
+
+    :param submission:
+    :return: True if the submission was offered
+    """
+    if not is_pipeline_pool_enabled(submission.assignment_id):
+        return False
+
+    pipe = redis.pipeline()
+    pipe.hget(_key("idle"), submission.assignment_id)
+    pipe.llen(_key(f"queue:{submission.assignment_id}"))
+    idle, waiting = pipe.execute()
+    if int(idle or 0) <= waiting:
+        return False
+
+    pipe = redis.pipeline()
+    pipe.hset(_key("offered"), submission.id, time.time())
+    pipe.rpush(_key(f"queue:{submission.assignment_id}"), submission.id)
+    pipe.execute()
+    return True
+
+
+def claim_pipeline_work(job_name: str, token: str) -> Submission | None:
+    """
+    Claim the next submission offered to the pool of a pool job.
+
+    :param job_name:
+    :param token:
+    :return: the claimed submission, or None if there is no work
+    """
+    if redis is None:
+        return None
+
+    submission_id = _claim_script(args=[PIPELINE_POOL_PREFIX, job_name, token])
+    if not submission_id:
+        return None
+
+    submission = Submission.query.filter(Submission.id == submission_id.decode()).first()
+    if submission is None:
+        return None
+
+    submission.state = "Initializing Pipeline"
+    db.session.commit()
+
+    return submission
+
+
+def get_pipeline_pool_claims() -> dict[str, str]:
+    """
+    Get the claims that pool jobs have not been labeled with yet.
+
+    :return: dictionary of pool job name -> submission id
+    """
+    claims = redis.hgetall(_key("claims"))
+    return {job_name.decode(): submission_id.decode() for job_name, submission_id in claims.items()}
+
+
+def release_pipeline_pool_claims(job_names: list[str]):
+    if len(job_names) > 0:
+        redis.hdel(_key("claims"), *job_names)
+
+
+def take_expired_pipeline_offers() -> list[str]:
+    """
+    Take back offers that were not claimed in time.
+
+    :return: submission ids taken back
+    """
+    timeout = get_pipeline_pool_config()["claim_timeout_seconds"]
+    now = time.time()
+
+    expired = []
+    for submission_id, offered in redis.hgetall(_key("offered")).items():
+        if now - float(offered) < timeout:
+            continue
+
+        submission = Submission.query.filter(Submission.id == submission_id.decode()).first()
+        redis.hdel(_key("offered"), submission_id)
+        if submission is None:
+            continue
+
+        # If it is no longer in the queue, a pool job claimed it
+        if redis.lrem(_key(f"queue:{submission.assignment_id}"), 0, submission_id) > 0:
+            expired.append(submission.id)
+
+    return expired
+
+
+def get_pipeline_pool_stats() -> dict:
+    """
+    Get the warm pool size, idle jobs and waiting offers of each
+    pooled assignment.
+
+    :return:
+    """
+    if redis is None:
+        return {"enabled": False}
+
+    pool_config = get_pipeline_pool_config()
+    idle = redis.hgetall(_key("idle"))
+    idle = {key.decode(): int(value) for key, value in idle.items()}
+
+    return {
+        "enabled":     True,
+        "config":      pool_config,
+        "assignments": {
+            assignment_id: {
+                "size":    get_pipeline_pool_size(assignment_id),
+                "idle":    idle.get(assignment_id, 0),
+                "waiting": redis.llen(_key(f"queue:{assignment_id}")),
+            }
+            for assignment_id in pool_config["assignments"]
+        },
+    }
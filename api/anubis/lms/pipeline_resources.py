@@ -0,0 +1,277 @@
+import re
+
+from anubis.models import Assignment, PipelineProfile, Submission, db
+from anubis.utils.cache import cache
+from anubis.utils.config import get_config_bool
+from anubis.utils.data import is_debug
+from anubis.utils.redis import redis
+
+# Resource requests and limits used for pipelines of assignments that
+# have no override, and not enough profiles to learn from
+DEFAULT_PIPELINE_RESOURCES = {
+    "limits":   {"cpu": "2", "memory": "750Mi"},
+    "requests": {"cpu": "500m", "memory": "500Mi"},
+}
+
+# How many of the latest profiles of an assignment image are used, and
+# how many there need to be before recommendations are made
+PIPELINE_PROFILE_SAMPLES = 200
+PIPELINE_PROFILE_MIN_SAMPLES = 20
+
+# Bounds on recommended resources, in millicores and MiB
+PIPELINE_CPU_REQUEST_BOUNDS = (100, 2000)
+PIPELINE_CPU_LIMIT_BOUNDS = (500, 4000)
+PIPELINE_MEMORY_REQUEST_BOUNDS = (128, 4096)
+PIPELINE_MEMORY_LIMIT_BOUNDS = (256, 4096)
+
+# Peak usage samples of running pipelines are kept in redis until the
+# pipeline is reaped
+PIPELINE_SAMPLE_TTL = 60 * 60 * 6
+
+_CPU_QUANTITY = re.compile(r"^([0-9.]+)(n|u|m)?$")
+_MEMORY_QUANTITY = re.compile(r"^([0-9.]+)(Ki|Mi|Gi|K|M|G)?$")
+_MEMORY_FACTORS = {
+    None: 1 / 2 ** 20,
+    "Ki": 1 / 2 ** 10,
+    "Mi": 1,
+    "Gi": 2 ** 10,
+    "K":  1000 / 2 ** 20,
+    "M":  1000 ** 2 / 2 ** 20,
+    "G":  1000 ** 3 / 2 ** 20,
+}
+
+
+def parse_cpu_millicores(quantity: str) -> int | None:
+    """
+    Parse a k8s cpu quantity like 2, 500m or 123456n into millicores.
+
+    :param quantity:
+    :return: millicores, or None if the quantity is not valid
+    """
+    match = _CPU_QUANTITY.match(str(quantity))
+    if match is None:
+        return None
+    value, unit = float(match.group(1)), match.group(2)
+    factor = {None: 1000, "m": 1, "u": 1 / 1000, "n": 1 / 1000 ** 2}[unit]
+    return int(value * factor)
+
+
+def parse_memory_mib(quantity: str) -> int | None:
+    """
+    Parse a k8s memory quantity like 750Mi, 1Gi or 123456Ki into MiB.
+
+    :param quantity:
+    :return: MiB, or None if the quantity is not valid
+    """
+    match = _MEMORY_QUANTITY.match(str(quantity))
+    if match is None:
+        return None
+    return int(float(match.group(1)) * _MEMORY_FACTORS[match.group(2)])
+
+
+def validate_pipeline_resources(resources: dict | None) -> bool:
+    """
+    Check an assignment pipeline resources override. It should look like
+    the default, with valid quantities. None clears the override.
+
+        {"requests": {"cpu": "500m", "memory": "500Mi"}, "limits": {"cpu": "2", "memory": "750Mi"}}
+
+    :param resources:
+    :return:
+    """
+    if resources is None:
+        return True
+    if not isinstance(resources, dict) or set(resources.keys()) != {"requests", "limits"}:
+        return False
+
+    for values in resources.values():
+        if not isinstance(values, dict) or set(values.keys()) != {"cpu", "memory"}:
+            return False
+        if parse_cpu_millicores(values["cpu"]) is None or parse_memory_mib(values["memory"]) is None:
+            return False
+
+    requests, limits = resources["requests"], resources["limits"]
+    return (
+        parse_cpu_millicores(requests["cpu"]) <= parse_cpu_millicores(limits["cpu"])
+        and parse_memory_mib(requests["memory"]) <= parse_memory_mib(limits["memory"])
+    )
+
+
+def _pipeline_sample_key(submission_id: str) -> str:
+    return f"pipeline-resource-sample-{submission_id}"
+
+
+def record_pipeline_resource_sample(submission_id: str, cpu_millicores: int, memory_mib: int):
+    """
+    Keep the peak cpu and memory usage seen for a running pipeline.
+
+    :param submission_id:
+    :param cpu_millicores:
+    :param memory_mib:
+    :return:
+    """
+    key = _pipeline_sample_key(submission_id)
+    peak = redis.hgetall(key)
+
+    pipe = redis.pipeline()
+    pipe.hset(
+        key,
+        mapping={
+            "cpu":    max(cpu_millicores, int(peak.get(b"cpu", 0))),
+            "memory": max(memory_mib, int(peak.get(b"memory", 0))),
+        },
+    )
+    pipe.expire(key, PIPELINE_SAMPLE_TTL)
+    pipe.execute()
+
+
+def save_pipeline_profile(
+    submission: Submission,
+    duration_seconds: int,
+    oom_killed: bool = False,
+    memory_limit_mib: int | None = None,
+):
+    """
+    Save the peak usage sampled for a finished pipeline as a profile
+    of its assignment image. Nothing is saved if it was never sampled,
+    unless it was killed for running out of memory. Those are saved
+    at no less than the memory limit they ran with, so the limit
+    learned for the image goes back up.
+
+    * Does not commit changes *
+
+    :param submission:
+    :param duration_seconds:
+    :param oom_killed: the pipeline went over its memory limit
+    :param memory_limit_mib: memory limit the pipeline ran with
+    :return:
+    """
+    if redis is None:
+        return
+
+    key = _pipeline_sample_key(submission.id)
+    peak = redis.hgetall(key)
+    redis.delete(key)
+    if len(peak) == 0 and not oom_killed:
+        return
+
+    memory_mib = int(peak.get(b"memory", 0))
+    if oom_killed:
+        memory_mib = max(memory_mib, memory_limit_mib or 0)
+
+    db.session.add(
+        PipelineProfile(
+            assignment_id=submission.assignment_id,
+            submission_id=submission.id,
+            pipeline_image=submission.assignment.pipeline_image,
+            cpu_millicores=int(peak.get(b"cpu", 0)),
+            memory_mib=memory_mib,
+            duration_seconds=duration_seconds,
+            oom_killed=oom_killed,
+        )
+    )
+
+
+def _percentile(values: list[int], p: float) -> int:
+    if len(values) == 0:
+        return 0
+    values = sorted(values)
+    return values[min(int(len(values) * p), len(values) - 1)]
+
+
+def _clamp(value: float, bounds: tuple[int, int]) -> int:
+    return int(max(bounds[0], min(value, bounds[1])))
+
+
+@cache.memoize(timeout=600, unless=is_debug, source_check=True)
+def get_pipeline_resource_profile(assignment_id: str, pipeline_image: str | None) -> dict:
+    """
+    Aggregate the latest profiles of an assignment image into usage
+    percentiles, and recommend resources from them once there are
+    enough profiles.
+
+    Requests are set to the 90th percentile of usage, so most pipelines
+    fit in what they reserve. Limits leave room past the 99th percentile,
+    so heavy pipelines are not throttled or killed.
+
+    Usage is sampled from metrics-server windows, so short and bursty
+    pipelines are under-sampled. Limits are never recommended below the
+    defaults for that reason. Pipelines that were killed for running out
+    of memory raise the memory limit past the limit they ran with.
+
+    :param assignment_id:
+    :param pipeline_image:
+    :return:
+    """
+    profiles: list[PipelineProfile] = (
+        PipelineProfile.query.filter(
+            PipelineProfile.assignment_id == assignment_id,
+            PipelineProfile.pipeline_image == pipeline_image,
+        )
+        .order_by(PipelineProfile.created.desc())
+        .limit(PIPELINE_PROFILE_SAMPLES)
+        .all()
+    )
+
+    cpu = [profile.cpu_millicores for profile in profiles]
+    memory = [profile.memory_mib for profile in profiles]
+    duration = [profile.duration_seconds for profile in profiles]
+    oom_memory = [profile.memory_mib for profile in profiles if profile.oom_killed]
+
+    profile = {
+        "samples":     len(profiles),
+        "oom_killed":  len(oom_memory),
+        "cpu":         {"p50": _percentile(cpu, 0.5), "p90": _percentile(cpu, 0.9), "p99": _percentile(cpu, 0.99)},
+        "memory":      {
+            "p50": _percentile(memory, 0.5),
+            "p90": _percentile(memory, 0.9),
+            "p99": _percentile(memory, 0.99),
+        },
+        "duration":    {"p50": _percentile(duration, 0.5), "p95": _percentile(duration, 0.95)},
+        "recommended": None,
+    }
+
+    if len(profiles) < PIPELINE_PROFILE_MIN_SAMPLES:
+        return profile
+
+    cpu_request = _clamp(profile["cpu"]["p90"], PIPELINE_CPU_REQUEST_BOUNDS)
+    memory_request = _clamp(profile["memory"]["p90"] * 1.2, PIPELINE_MEMORY_REQUEST_BOUNDS)
+    # Limits do not go below the defaults
+    default_cpu_limit = parse_cpu_millicores(DEFAULT_PIPELINE_RESOURCES["limits"]["cpu"])
+    default_memory_limit = parse_memory_mib(DEFAULT_PIPELINE_RESOURCES["limits"]["memory"])
+
+    cpu_limit = _clamp(
+        max(profile["cpu"]["p99"] * 1.5, cpu_request * 2, default_cpu_limit),
+        PIPELINE_CPU_LIMIT_BOUNDS,
+    )
+    memory_limit = _clamp(
+        max(profile["memory"]["p99"] * 1.5, max(oom_memory, default=0) * 1.5, memory_request, default_memory_limit),
+        PIPELINE_MEMORY_LIMIT_BOUNDS,
+    )
+
+    profile["recommended"] = {
+        "limits":   {"cpu": f"{max(cpu_limit, cpu_request)}m", "memory": f"{max(memory_limit, memory_request)}Mi"},
+        "requests": {"cpu": f"{cpu_request}m", "memory": f"{memory_request}Mi"},
+    }
+    return profile
+
+
+def get_pipeline_resources(assignment: Assignment) -> dict:
+    """
+    Get the resource requests and limits for the pipelines of an assignment.
+    The assignment override comes first. Otherwise the resources are the
+    ones recommended from previous pipelines of the assignment image, unless
+    PIPELINE_ADAPTIVE_RESOURCES is turned off. Otherwise the defaults.
+
+    :param assignment:
+    :return:
+    """
+    if assignment.pipeline_resources is not None and validate_pipeline_resources(assignment.pipeline_resources):
+        return assignment.pipeline_resources
+
+    if get_config_bool("PIPELINE_ADAPTIVE_RESOURCES", default=True):
+        recommended = get_pipeline_resource_profile(assignment.id, assignment.pipeline_image)["recommended"]
+        if recommended is not None:
+            return recommended
+
+    return DEFAULT_PIPELINE_RESOURCES
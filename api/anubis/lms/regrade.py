@@ -13,6 +13,7 @@ def bulk_regrade_assignment(
     processed: int = -1,
     reaped: int = -1,
     latest_only: int = -1,
+    use_cache: bool = True,
 ):
     from anubis.lms.submissions import get_latest_user_submissions
 
@@ -61,4 +62,4 @@ def bulk_regrade_assignment(
 
     # Enqueue each chunk as a job for the rpc workers
     for chunk in submission_chunks:
-        enqueue_bulk_regrade_submissions(chunk)
+        enqueue_bulk_regrade_submissions(chunk, use_cache)
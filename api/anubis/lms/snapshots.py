@@ -0,0 +1,231 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy.orm import selectinload
+
+from anubis.lms.autograde import get_best_submission_ids
+from anubis.models import (
+    Assignment,
+    AssignmentTest,
+    AutogradeSnapshot,
+    InCourse,
+    LateException,
+    Submission,
+    SubmissionBuild,
+    SubmissionTestResult,
+    db,
+)
+from anubis.utils.config import get_config_int
+from anubis.utils.data import split_chunks
+from anubis.utils.logging import logger
+
+SNAPSHOT_DEADLINES = ("due", "grace")
+
+
+def get_snapshot_settle_time() -> timedelta:
+    """
+    Get the longest a snapshot waits on submissions pushed before the
+    cutoff that are still queued or running. This is the pipeline
+    timeout, plus time for the submission to sit in the queue.
+
+    :return:
+    """
+    return timedelta(
+        minutes=get_config_int("AUTOGRADE_PIPELINE_TIMEOUT_MINUTES", default=5)
+        + get_config_int("AUTOGRADE_SNAPSHOT_SETTLE_MINUTES", default=30)
+    )
+
+
+def get_unsettled_students(assignment: Assignment, owner_ids: list[str], cutoff: datetime) -> set[str]:
+    """
+    Get the students that have submissions from before the cutoff
+    that have not been processed yet.
+
+    :param assignment:
+    :param owner_ids:
+    :param cutoff:
+    :return: owner ids
+    """
+    unsettled = set()
+    for chunk in split_chunks(owner_ids, 500):
+        unsettled.update(
+            owner_id
+            for owner_id, in db.session.query(Submission.owner_id)
+            .filter(
+                Submission.assignment_id == assignment.id,
+                Submission.owner_id.in_(chunk),
+                Submission.created <= cutoff,
+                Submission.processed == False,
+            )
+            .distinct()
+            .all()
+        )
+    return unsettled
+
+
+def get_snapshot_cutoffs(assignment: Assignment, deadline: str) -> dict[str, datetime]:
+    """
+    Get the cutoff time for each student in the course for a deadline
+    snapshot. Students with a late exception use the late exception
+    due date for both the due and grace snapshots, the same as
+    get_assignment_due_date.
+
+    :param assignment:
+    :param deadline: "due" or "grace"
+    :return: dictionary of owner_id -> cutoff
+    """
+
+    default_cutoff = assignment.due_date if deadline == "due" else assignment.grace_date
+
+    # Every student in the course starts with the assignment deadline
+    cutoffs = {
+        owner_id: default_cutoff
+        for owner_id, in db.session.query(InCourse.owner_id).filter(InCourse.course_id == assignment.course_id).all()
+    }
+
+    # Late exceptions override the assignment deadline
+    for owner_id, due_date in (
+        db.session.query(LateException.owner_id, LateException.due_date)
+        .filter(LateException.assignment_id == assignment.id)
+        .all()
+    ):
+        if owner_id in cutoffs:
+            cutoffs[owner_id] = due_date
+
+    return cutoffs
+
+
+def take_autograde_snapshot(assignment: Assignment, deadline: str, now: datetime = None) -> int:
+    """
+    Capture the best submission of every student at a deadline into the
+    autograde snapshot table. Only students whose cutoff has passed and
+    that do not already have a snapshot for this deadline are captured,
+    so this is safe to run over and over. Once a snapshot row is written
+    it is not changed by later regrades.
+
+    A student is not captured while a submission they pushed before the
+    cutoff is still queued or running, so it counts toward the snapshot.
+    After the settle time they are captured anyway, so a stuck pipeline
+    does not hold the snapshot back forever.
+
+    Students are grouped by their cutoff time, so this is one best
+    submission query for the assignment deadline and one for each
+    distinct late exception date.
+
+    :param assignment:
+    :param deadline: "due" or "grace"
+    :param now:
+    :return: number of snapshot rows created
+    """
+
+    if now is None:
+        now = datetime.now()
+
+    # Students that already have a snapshot for this deadline
+    captured = {
+        owner_id
+        for owner_id, in db.session.query(AutogradeSnapshot.owner_id)
+        .filter(
+            AutogradeSnapshot.assignment_id == assignment.id,
+            AutogradeSnapshot.deadline == deadline,
+        )
+        .all()
+    }
+
+    # Group the students that still need a snapshot by their cutoff
+    students_by_cutoff: dict[datetime, list[str]] = {}
+    for owner_id, cutoff in get_snapshot_cutoffs(assignment, deadline).items():
+        if owner_id in captured or cutoff > now:
+            continue
+        students_by_cutoff.setdefault(cutoff, []).append(owner_id)
+
+    settle_time = get_snapshot_settle_time()
+
+    created = 0
+    for cutoff, owner_ids in students_by_cutoff.items():
+        # Wait for pipelines of pushes from before the cutoff to finish
+        if now - cutoff < settle_time:
+            unsettled = get_unsettled_students(assignment, owner_ids, cutoff)
+            owner_ids = [owner_id for owner_id in owner_ids if owner_id not in unsettled]
+
+        # Find the best submission of each student as of the cutoff
+        best_submission_ids: dict[str, str] = {}
+        for chunk in split_chunks(owner_ids, 500):
+            best_submission_ids.update(get_best_submission_ids(assignment.id, student_ids=chunk, max_time=cutoff))
+
+        # Pull the test results and build results of the best submissions
+        test_results: dict[str, list[tuple[str, bool]]] = {}
+        build_results: dict[str, bool] = {}
+        for chunk in split_chunks(list(best_submission_ids.values()), 500):
+            for submission_id, test_name, passed in (
+                db.session.query(SubmissionTestResult.submission_id, AssignmentTest.name, SubmissionTestResult.passed)
+                .join(AssignmentTest, AssignmentTest.id == SubmissionTestResult.assignment_test_id)
+                .filter(SubmissionTestResult.submission_id.in_(chunk))
+                .all()
+            ):
+                test_results.setdefault(submission_id, []).append((test_name, passed))
+            for submission_id, passed in (
+                db.session.query(SubmissionBuild.submission_id, SubmissionBuild.passed)
+                .filter(SubmissionBuild.submission_id.in_(chunk))
+                .all()
+            ):
+                build_results[submission_id] = passed is True
+
+        # Write a snapshot row for every student, even those without a
+        # submission, so that they are recorded as captured.
+        for owner_id in owner_ids:
+            submission_id = best_submission_ids.get(owner_id, None)
+            results = test_results.get(submission_id, [])
+            db.session.add(
+                AutogradeSnapshot(
+                    owner_id=owner_id,
+                    assignment_id=assignment.id,
+                    deadline=deadline,
+                    cutoff=cutoff,
+                    submission_id=submission_id,
+                    tests_passed=sum(1 for _, passed in results if passed),
+                    total_tests=len(results),
+                    tests_passed_names=[test_name for test_name, passed in results if passed],
+                    build_passed=build_results.get(submission_id, False),
+                )
+            )
+            created += 1
+
+    db.session.commit()
+
+    if created > 0:
+        logger.info(f"Captured {created} {deadline} snapshots for {assignment.name}")
+
+    return created
+
+
+def take_assignment_snapshots(assignment: Assignment, now: datetime = None) -> int:
+    """
+    Capture both the due and grace deadline snapshots that are
+    ready for an assignment.
+
+    :param assignment:
+    :param now:
+    :return: number of snapshot rows created
+    """
+    return sum(take_autograde_snapshot(assignment, deadline, now=now) for deadline in SNAPSHOT_DEADLINES)
+
+
+def get_autograde_snapshot(assignment_id: str, deadline: str) -> list[dict]:
+    """
+    Get the frozen autograde results for an assignment deadline.
+
+    :param assignment_id:
+    :param deadline: "due" or "grace"
+    :return:
+    """
+
+    snapshots: list[AutogradeSnapshot] = (
+        AutogradeSnapshot.query.filter(
+            AutogradeSnapshot.assignment_id == assignment_id,
+            AutogradeSnapshot.deadline == deadline,
+        )
+        .options(selectinload(AutogradeSnapshot.owner))
+        .all()
+    )
+
+    return [snapshot.data for snapshot in snapshots]
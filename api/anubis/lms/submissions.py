@@ -1,9 +1,14 @@
-from datetime import datetime
+from datetime import datetime, timedelta
 
+from anubis.k8s.pipeline.admission import PIPELINE_PRIORITY_BULK, PIPELINE_PRIORITY_REGRADE
+from anubis.k8s.pipeline.batch import get_pipeline_batch_size
 from anubis.lms.assignments import get_assignment_due_date
+from anubis.lms.autograde import update_best_submission
+from anubis.lms.pipeline_logs import clear_pipeline_log
 from anubis.models import (
     Assignment,
     AssignmentTest,
+    BestSubmission,
     Course,
     InCourse,
     Submission,
@@ -13,36 +18,81 @@ from anubis.models import (
     db,
 )
 from anubis.utils.cache import cache
+from anubis.utils.config import get_config_bool, get_config_int
 from anubis.utils.data import is_debug, split_chunks, with_context
 from anubis.utils.http import error_response, success_response
 from anubis.utils.logging import logger
 
 
+SUBMISSION_SUPERSEDED_STATE = "Skipped, a newer commit was pushed before this one was graded"
+
+
 @with_context
-def bulk_regrade_submissions(submissions: list[Submission]) -> list[dict]:
+def bulk_regrade_submissions(submissions: list[Submission | str], use_cache: bool = True) -> list[dict]:
     """
-    Regrade a batch of submissions
+    Regrade a batch of submissions. If batch pipelines are on, the
+    submissions of each assignment are graded in batch pipeline pods
+    of PIPELINE_BATCH_SIZE submissions.
+
     :param submissions:
+    :param use_cache: reuse results of identical submissions
     :return:
     """
+    from anubis.rpc.enqueue import enqueue_pipeline_batch
 
     # Running list of regrade dictionaries
     response = []
 
     # enqueue regrade jobs for each submissions
+    batch_size = get_pipeline_batch_size()
+    if batch_size <= 1:
+        for submission in submissions:
+            response.append(
+                regrade_submission(submission, queue="regrade", priority=PIPELINE_PRIORITY_BULK, use_cache=use_cache)
+            )
+
+        # Pass back a list of all the regrade return dictionaries
+        return response
+
+    # Reset each submission, and group them by assignment, as
+    # a batch pod runs a single pipeline image
+    batches: dict[str, list[str]] = {}
     for submission in submissions:
-        response.append(regrade_submission(submission, queue="regrade"))
+        if isinstance(submission, str):
+            submission = Submission.query.filter(Submission.id == submission).first()
+            if submission is None:
+                response.append(error_response("could not find submission"))
+                continue
+
+        regrade = regrade_submission(submission, enqueue=False)
+        response.append(regrade)
+        if regrade["success"]:
+            batches.setdefault(submission.assignment_id, []).append(submission.id)
+
+    # enqueue a batch pipeline for each chunk
+    for submission_ids in batches.values():
+        for chunk in split_chunks(submission_ids, batch_size):
+            enqueue_pipeline_batch(chunk, use_cache)
 
     # Pass back a list of all the regrade return dictionaries
     return response
 
 
-def regrade_submission(submission: Submission | str, queue: str = "default") -> dict:
+def regrade_submission(
+    submission: Submission | str,
+    queue: str = "default",
+    priority: str = PIPELINE_PRIORITY_REGRADE,
+    use_cache: bool = True,
+    enqueue: bool = True,
+) -> dict:
     """
     Regrade a submission
 
     :param submission: Union[Submissions, str]
     :param queue:
+    :param priority: pipeline priority class
+    :param use_cache: reuse results of identical submissions
+    :param enqueue: enqueue the pipeline, otherwise the caller does
     :return: dict response
     """
     from anubis.rpc.enqueue import enqueue_autograde_pipeline
@@ -68,12 +118,14 @@ def regrade_submission(submission: Submission | str, queue: str = "default") ->
     submission.state = "regrading"
     submission.last_updated = datetime.now()
     submission.pipeline_log = None
+    clear_pipeline_log(submission.id)
 
     # Reset the accompanying database objects
     init_submission(submission)
 
     # Enqueue the submission job
-    enqueue_autograde_pipeline(submission.id, queue=queue)
+    if enqueue:
+        enqueue_autograde_pipeline(submission.id, queue=queue, priority=priority, use_cache=use_cache)
 
     return success_response({"message": "regrade started"})
 
@@ -208,6 +260,54 @@ def reject_late_submission(submission: Submission):
     submission.state = "Late submissions not accepted"
     db.session.add(submission)
 
+    # Rejected submissions are no longer candidates for the best submission
+    update_best_submission(submission.owner_id, submission.assignment_id)
+
+
+def supersede_submission(submission: Submission):
+    """
+    Skip grading a submission that was superseded by a newer one
+    while it was waiting for a pipeline. The submission is marked
+    as processed, so it can still be regraded later if needed.
+
+    * Does not commit changes *
+
+    :param submission:
+    :return:
+    """
+
+    submission.processed = True
+    submission.state = SUBMISSION_SUPERSEDED_STATE
+    db.session.add(submission)
+
+    # Superseded submissions have no results, but are still submissions
+    update_best_submission(submission.owner_id, submission.assignment_id)
+
+
+def get_pipeline_coalesce_key(submission: Submission) -> str | None:
+    """
+    Get the key for submissions that should supersede each other while
+    waiting for a pipeline, or None if this submission should not be
+    coalesced. Coalescing is turned on with the PIPELINE_COALESCE config
+    entry. It is turned off for the last PIPELINE_COALESCE_DEADLINE_WINDOW_MINUTES
+    before the student's due date, so that every push before the deadline
+    is graded.
+
+    :param submission:
+    :return:
+    """
+
+    if not get_config_bool("PIPELINE_COALESCE", default=False):
+        return None
+
+    window = get_config_int("PIPELINE_COALESCE_DEADLINE_WINDOW_MINUTES", default=0)
+    if window > 0:
+        due_date = get_assignment_due_date(submission.owner_id, submission.assignment_id)
+        if due_date - timedelta(minutes=window) <= datetime.now() <= due_date:
+            return None
+
+    return f"{submission.owner_id}:{submission.assignment_id}"
+
 
 def init_submission(submission: Submission, commit: bool = True, verbose: bool = True):
     """
@@ -247,6 +347,11 @@ def init_submission(submission: Submission, commit: bool = True, verbose: bool =
     submission.errors = None
     db.session.add(submission)
 
+    # If this submission was the best submission for the student, then
+    # the reset means a different submission may now be the best.
+    if BestSubmission.query.filter(BestSubmission.submission_id == submission.id).first() is not None:
+        update_best_submission(submission.owner_id, submission.assignment_id)
+
     if commit:
         # Commit new models
         db.session.commit()
@@ -0,0 +1,327 @@
+import math
+import time
+from datetime import datetime, timedelta
+
+from anubis.constants import THEIA_DEFAULT_OPTIONS
+from anubis.models import Assignment, TheiaImage, TheiaSession
+from anubis.utils.cache import cache
+from anubis.utils.config import get_config_dict
+from anubis.utils.data import is_debug
+from anubis.utils.redis import redis
+
+# Warm pool policy. Can be overridden with the THEIA_WARM_POOL config
+# entry. Only the image tags listed get a pool.
+#
+#   images            "<image>:<tag>" -> idle pods kept for that image tag
+#   max_pods          most idle pods kept for an image tag
+#   schedule          list of {"days": [0-6], "hours": [start, end], "scale": n}.
+#                     Days are weekdays with monday as 0, and can be left out
+#                     for every day. The pool is scaled by the largest scale
+#                     of the entries that match, for lab sections and such.
+#   warmup_minutes    how far ahead the schedule is looked at, so the pool
+#                     is full by the time a lab section starts
+#   deadline_hours    assignments due within this many hours scale up the
+#                     pool of their image tag
+#   deadline_scale    scale for image tags with an upcoming deadline
+DEFAULT_THEIA_WARM_POOL = {
+    "images":         {},
+    "max_pods":       100,
+    "schedule":       [],
+    "warmup_minutes": 15,
+    "deadline_hours": 24,
+    "deadline_scale": 2,
+}
+
+# All the warm pool keys share this prefix:
+#
+#   pods              hash of pool pod name -> pool ("<image>:<tag>")
+#   ready             hash of pool pod name -> cluster address, for pods that have started
+#   idle:<pool>       list of started pool pod names, in the order they are claimed
+#   claims            hash of pool pod name -> time it was claimed
+#   stats             hash of pool -> idle pods after the last reconcile
+THEIA_POOL_PREFIX = "theia-pool:"
+
+# Take the next started pod of a pool. Pods that were retired
+# while they were in the idle list are skipped.
+#
+# ARGV: prefix, pool, time
+_CLAIM_SCRIPT = """
+local p = ARGV[1]
+while true do
+    local name = redis.call('LPOP', p .. 'idle:' .. ARGV[2])
+    if not name then
+        return false
+    end
+    local address = redis.call('HGET', p .. 'ready', name)
+    redis.call('HDEL', p .. 'ready', name)
+    if address and redis.call('HDEL', p .. 'pods', name) == 1 then
+        redis.call('HSET', p .. 'claims', name, ARGV[3])
+        return {name, address}
+    end
+end
+"""
+
+# Add a started pool pod to the idle list of its pool, once.
+#
+# ARGV: prefix, pod name, cluster address
+_READY_SCRIPT = """
+local p = ARGV[1]
+local pool = redis.call('HGET', p .. 'pods', ARGV[2])
+if not pool or redis.call('HEXISTS', p .. 'ready', ARGV[2]) == 1 then
+    return 0
+end
+redis.call('HSET', p .. 'ready', ARGV[2], ARGV[3])
+redis.call('RPUSH', p .. 'idle:' .. pool, ARGV[2])
+return 1
+"""
+
+# Retire an idle pool pod so that it can be deleted. Pods
+# that were claimed are not retired.
+#
+# ARGV: prefix, pod name
+_RETIRE_SCRIPT = """
+local p = ARGV[1]
+local pool = redis.call('HGET', p .. 'pods', ARGV[2])
+if not pool then
+    return 0
+end
+redis.call('HDEL', p .. 'pods', ARGV[2])
+redis.call('HDEL', p .. 'ready', ARGV[2])
+redis.call('LREM', p .. 'idle:' .. pool, 0, ARGV[2])
+return 1
+"""
+
+_claim_script = redis.register_script(_CLAIM_SCRIPT) if redis is not None else None
+_ready_script = redis.register_script(_READY_SCRIPT) if redis is not None else None
+_retire_script = redis.register_script(_RETIRE_SCRIPT) if redis is not None else None
+
+
+def _key(name: str) -> str:
+    return THEIA_POOL_PREFIX + name
+
+
+def get_theia_pool_config() -> dict:
+    """
+    Get the warm pool policy from the THEIA_WARM_POOL config entry,
+    with missing keys filled in from the defaults.
+
+    :return:
+    """
+    pool_config = get_config_dict("THEIA_WARM_POOL", default=DEFAULT_THEIA_WARM_POOL)
+    if not isinstance(pool_config, dict):
+        pool_config = DEFAULT_THEIA_WARM_POOL
+
+    return {**DEFAULT_THEIA_WARM_POOL, **pool_config}
+
+
+def split_theia_pool(pool: str) -> tuple[str, str]:
+    """
+    Split a pool into its image and tag. The tag is after the last
+    colon, as registry hosts can have a port.
+
+    :param pool: "<image>:<tag>"
+    :return: image, tag
+    """
+    image, _, tag = pool.rpartition(":")
+    return image, tag
+
+
+def get_theia_session_pool(theia_session: TheiaSession) -> str | None:
+    """
+    Get the pool a theia session can be given a warm pod from. Only
+    plain student sessions are pooled. Sessions with admin options,
+    persistent storage, their own resources, or any network policy
+    but the student one get a pod of their own.
+
+    :param theia_session:
+    :return: "<image>:<tag>", or None if the session can not be pooled
+    """
+    if redis is None:
+        return None
+
+    image: TheiaImage = theia_session.image
+    if image is None or image.webtop:
+        return None
+
+    if (
+        theia_session.admin
+        or theia_session.credentials
+        or theia_session.docker
+        or theia_session.autograde
+        or theia_session.persistent_storage
+        or not theia_session.network_locked
+        or (theia_session.network_policy or "os-student") != "os-student"
+    ):
+        return None
+
+    # Pool pods are started with the default resources
+    if theia_session.resources and theia_session.resources != THEIA_DEFAULT_OPTIONS["resources"]:
+        return None
+
+    tag = image.default_tag or "latest"
+    if theia_session.image_tag is not None:
+        tag = theia_session.image_tag.tag
+
+    pool = f"{image.image}:{tag}"
+    if pool not in get_theia_pool_config()["images"]:
+        return None
+
+    return pool
+
+
+def _get_schedule_scale(pool_config: dict, now: datetime) -> float:
+    at = now + timedelta(minutes=pool_config["warmup_minutes"])
+
+    scale = 1
+    for entry in pool_config["schedule"]:
+        start, end = entry.get("hours", [0, 24])
+        if "days" in entry and at.weekday() not in entry["days"]:
+            continue
+        if start <= at.hour < end:
+            scale = max(scale, entry.get("scale", 1))
+
+    return scale
+
+
+@cache.memoize(timeout=60, unless=is_debug)
+def _has_upcoming_deadline(pool: str, deadline_hours: int) -> bool:
+    image_name, tag = split_theia_pool(pool)
+    now = datetime.now()
+
+    # Assignment IDEs are started on the default tag of the assignment image
+    assignments: list[Assignment] = (
+        Assignment.query.join(TheiaImage, Assignment.theia_image_id == TheiaImage.id)
+        .filter(
+            TheiaImage.image == image_name,
+            Assignment.ide_enabled == True,
+            Assignment.due_date >= now,
+            Assignment.due_date <= now + timedelta(hours=deadline_hours),
+        )
+        .all()
+    )
+
+    return any((assignment.theia_image.default_tag or "latest") == tag for assignment in assignments)
+
+
+def get_theia_pool_size(pool: str, now: datetime = None) -> int:
+    """
+    Get how many idle pods a pool should have. The size from the
+    config is scaled by the schedule for the time of day, and again
+    if an assignment on the image tag is due soon.
+
+    :param pool: "<image>:<tag>"
+    :param now:
+    :return:
+    """
+    if redis is None:
+        return 0
+
+    pool_config = get_theia_pool_config()
+    size = pool_config["images"].get(pool, 0)
+    if size == 0:
+        return 0
+
+    now = now or datetime.now()
+    size *= _get_schedule_scale(pool_config, now)
+    if _has_upcoming_deadline(pool, pool_config["deadline_hours"]):
+        size *= pool_config["deadline_scale"]
+
+    return min(math.ceil(size), pool_config["max_pods"])
+
+
+def register_theia_pool_pod(pod_name: str, pool: str):
+    redis.hset(_key("pods"), pod_name, pool)
+
+
+def mark_theia_pool_pod_ready(pod_name: str, cluster_address: str) -> bool:
+    """
+    Make a pool pod that has started claimable.
+
+    :param pod_name:
+    :param cluster_address:
+    :return: True if the pod was added to the idle list of its pool
+    """
+    return _ready_script(args=[THEIA_POOL_PREFIX, pod_name, cluster_address]) == 1
+
+
+def retire_theia_pool_pod(pod_name: str) -> bool:
+    """
+    Stop an idle pool pod from being claimed, so it can be deleted.
+
+    :param pod_name:
+    :return: False if the pod was already claimed
+    """
+    return _retire_script(args=[THEIA_POOL_PREFIX, pod_name]) == 1
+
+
+def take_theia_pool_pod(pool: str) -> tuple[str, str] | None:
+    """
+    Take the next idle pod of a pool. The claim is kept for a while,
+    so the pod is not taken for an orphan before it is labeled with
+    its session.
+
+    :param pool:
+    :return: pod name and cluster address, or None if the pool is empty
+    """
+    if redis is None:
+        return None
+
+    claimed = _claim_script(args=[THEIA_POOL_PREFIX, pool, time.time()])
+    if not claimed:
+        return None
+
+    pod_name, cluster_address = claimed
+    return pod_name.decode(), cluster_address.decode()
+
+
+def get_theia_pool_pods() -> tuple[set[str], dict[str, float]]:
+    """
+    Get the pool pods that can be claimed or retired, and the ones
+    that were claimed, in one read.
+
+    :return: idle pod names, and claimed pod name -> time it was claimed
+    """
+    pipe = redis.pipeline()
+    pipe.hkeys(_key("pods"))
+    pipe.hgetall(_key("claims"))
+    pods, claims = pipe.execute()
+    return (
+        {pod_name.decode() for pod_name in pods},
+        {pod_name.decode(): float(claimed_at) for pod_name, claimed_at in claims.items()},
+    )
+
+
+def release_theia_pool_claims(pod_names: list[str]):
+    if len(pod_names) > 0:
+        redis.hdel(_key("claims"), *pod_names)
+
+
+def set_theia_pool_idle(pool: str, idle: int):
+    redis.hset(_key("stats"), pool, idle)
+
+
+def get_theia_pool_stats() -> dict:
+    """
+    Get the size, started and starting idle pods of each pool.
+
+    :return:
+    """
+    if redis is None:
+        return {"enabled": False}
+
+    pool_config = get_theia_pool_config()
+    idle = redis.hgetall(_key("stats"))
+    idle = {key.decode(): int(value) for key, value in idle.items()}
+
+    return {
+        "enabled": True,
+        "config":  pool_config,
+        "pools":   {
+            pool: {
+                "size":  get_theia_pool_size(pool),
+                "idle":  idle.get(pool, 0),
+                "ready": redis.llen(_key(f"idle:{pool}")),
+            }
+            for pool in pool_config["images"]
+        },
+    }
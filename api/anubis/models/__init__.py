@@ -11,7 +11,7 @@ from sqlalchemy.sql.schema import Column, ForeignKey
 
 from anubis.constants import THEIA_DEFAULT_OPTIONS, DB_COLLATION, DB_CHARSET
 from anubis.models.id import default_id_length, default_id
-from anubis.models.sqltypes import String, Text, DateTime, Boolean, JSON, Integer
+from anubis.models.sqltypes import String, Text, CompressedText, DateTime, Boolean, JSON, Integer
 from anubis.utils.data import human_readable_timedelta
 
 db = SQLAlchemy()
@@ -227,6 +227,13 @@ class Assignment(db.Model):
     pipeline_image = Column(Text(length=2 ** 14), nullable=True, index=True)
     autograde_enabled: bool = Column(Boolean, default=True)
 
+    # Digest the pipeline image last resolved to, from the newest pipeline pod
+    pipeline_image_digest: str = Column(String(length=128), nullable=True, default=None)
+
+    # Resource requests and limits for pipeline containers. When set, these
+    # are used instead of the ones learned from previous pipelines.
+    pipeline_resources = Column(JSON, nullable=True, default=None)
+
     # IDE
     ide_enabled: bool = Column(Boolean, default=True)
     theia_image_id: str = Column(String(length=default_id_length), ForeignKey("theia_image.id"), default=None)
@@ -281,6 +288,7 @@ class Assignment(db.Model):
     def full_data(self):
         data = self.data
         data["tests"] = [t.data for t in self.tests]
+        data["pipeline_resources"] = self.pipeline_resources
         return data
 
 
@@ -504,7 +512,12 @@ class Submission(db.Model):
     errors = Column(JSON, default=None, nullable=True)
     token: str = Column(String(length=64), default=lambda: base64.b16encode(os.urandom(32)).decode())
     accepted: bool = Column(Boolean, default=True)
-    pipeline_log: str = deferred(Column(Text(length=2 ** 16)))
+    pipeline_log: str = deferred(Column(CompressedText()))
+
+    # Pipeline result cache
+    tree_hash: str = Column(String(length=64), nullable=True, default=None)
+    pipeline_cache_key: str = Column(String(length=64), nullable=True, default=None, index=True)
+    pipeline_image_digest: str = Column(String(length=128), nullable=True, default=None)
 
     # Relationships
     build = relationship(
@@ -573,7 +586,7 @@ class SubmissionTestResult(db.Model):
 
     # Fields
     output_type: str = Column(String(length=128), default="text")
-    output = deferred(Column(Text(length=2 ** 16)))
+    output = deferred(Column(CompressedText()))
     message = deferred(Column(Text(length=2 ** 10)))
     passed: bool = Column(Boolean)
 
@@ -612,7 +625,7 @@ class SubmissionBuild(db.Model):
     submission_id: str = Column(String(length=default_id_length), ForeignKey(Submission.id), index=True)
 
     # Fields
-    stdout = deferred(Column(Text(length=2 ** 14)))
+    stdout = deferred(Column(CompressedText()))
     passed: bool = Column(Boolean, default=None)
 
     # Timestamps
@@ -627,6 +640,86 @@ class SubmissionBuild(db.Model):
         }
 
 
+class BestSubmission(db.Model):
+    __tablename__ = "best_submission"
+    __table_args__ = {"mysql_charset": DB_CHARSET, "mysql_collate": DB_COLLATION}
+
+    # Foreign Keys
+    owner_id: str = Column(String(length=default_id_length), ForeignKey(User.id), primary_key=True)
+    assignment_id: str = Column(String(length=default_id_length), ForeignKey(Assignment.id), primary_key=True)
+    submission_id: str = Column(String(length=default_id_length), ForeignKey(Submission.id), index=True, nullable=False)
+
+    # Fields
+    tests_passed: int = Column(Integer, default=0)
+    build_passed: bool = Column(Boolean, default=False)
+    late: bool = Column(Boolean, default=False)
+
+    # Timestamps
+    created: datetime = Column(DateTime, default=datetime.now)
+    last_updated: datetime = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+
+    # Relationships
+    submission = relationship(Submission)
+
+    @property
+    def data(self):
+        return {
+            "owner_id":      self.owner_id,
+            "assignment_id": self.assignment_id,
+            "submission_id": self.submission_id,
+            "tests_passed":  self.tests_passed,
+            "build_passed":  self.build_passed,
+            "late":          self.late,
+            "last_updated":  str(self.last_updated),
+        }
+
+
+class AutogradeSnapshot(db.Model):
+    __tablename__ = "autograde_snapshot"
+    __table_args__ = {"mysql_charset": DB_CHARSET, "mysql_collate": DB_COLLATION}
+
+    # Foreign Keys
+    owner_id: str = Column(String(length=default_id_length), ForeignKey(User.id), primary_key=True)
+    assignment_id: str = Column(String(length=default_id_length), ForeignKey(Assignment.id), primary_key=True)
+    submission_id: str = Column(String(length=default_id_length), ForeignKey(Submission.id), nullable=True)
+
+    # Which deadline this is a snapshot of ("due" or "grace")
+    deadline: str = Column(String(length=16), primary_key=True)
+
+    # The cutoff time that was used for this student. This is the late
+    # exception due date if the student had one.
+    cutoff: datetime = Column(DateTime, nullable=False)
+
+    # Fields
+    tests_passed: int = Column(Integer, default=0)
+    total_tests: int = Column(Integer, default=0)
+    tests_passed_names = Column(JSON, default=list)
+    build_passed: bool = Column(Boolean, default=False)
+
+    # Timestamps
+    created: datetime = Column(DateTime, default=datetime.now)
+
+    # Relationships
+    owner = relationship(User)
+
+    @property
+    def data(self):
+        return {
+            "id":                 self.owner.netid,
+            "user_id":            self.owner_id,
+            "netid":              self.owner.netid,
+            "name":               self.owner.name,
+            "deadline":           self.deadline,
+            "cutoff":             str(self.cutoff),
+            "submission":         self.submission_id,
+            "build_passed":       self.build_passed,
+            "tests_passed":       self.tests_passed,
+            "total_tests":        self.total_tests,
+            "tests_passed_names": self.tests_passed_names,
+            "created":            str(self.created),
+        }
+
+
 class TheiaImage(db.Model):
     __tablename__ = "theia_image"
     __table_args__ = {"mysql_charset": DB_CHARSET, "mysql_collate": DB_COLLATION}
@@ -1155,3 +1248,43 @@ class EmailEvent(db.Model):
             "created":        str(self.created),
             "last_updated":   str(self.last_updated),
         }
+
+
+class PipelineProfile(db.Model):
+    __tablename__ = "pipeline_profile"
+    __table_args__ = {"mysql_charset": DB_CHARSET, "mysql_collate": DB_COLLATION}
+
+    # id
+    id = default_id()
+
+    # Foreign Keys
+    assignment_id: str = Column(String(length=default_id_length), ForeignKey(Assignment.id), index=True)
+    submission_id: str = Column(String(length=default_id_length), ForeignKey(Submission.id), nullable=True)
+
+    # The pipeline image the pipeline ran
+    pipeline_image = Column(Text(length=2 ** 14), nullable=True)
+
+    # Peak usage sampled while the pipeline ran, and how long it took
+    cpu_millicores: int = Column(Integer, nullable=False)
+    memory_mib: int = Column(Integer, nullable=False)
+    duration_seconds: int = Column(Integer, nullable=False)
+
+    # The pipeline was killed for going over its memory limit
+    oom_killed: bool = Column(Boolean, default=False)
+
+    # Timestamps
+    created: datetime = Column(DateTime, default=datetime.now, index=True)
+
+    @property
+    def data(self):
+        return {
+            "id":               self.id,
+            "assignment_id":    self.assignment_id,
+            "submission_id":    self.submission_id,
+            "pipeline_image":   self.pipeline_image,
+            "cpu_millicores":   self.cpu_millicores,
+            "memory_mib":       self.memory_mib,
+            "duration_seconds": self.duration_seconds,
+            "oom_killed":       self.oom_killed,
+            "created":          str(self.created),
+        }
@@ -1,5 +1,8 @@
+import gzip
+
 import sqlalchemy.sql.sqltypes
 from sqlalchemy.dialects import mysql
+from sqlalchemy.types import LargeBinary, TypeDecorator
 
 from anubis.constants import DB_COLLATION, DB_CHARSET
 from anubis.env import env
@@ -21,6 +24,56 @@ def Text(*args, **kwargs) -> mysql.TEXT:
     return mysql.TEXT(*args, collation=DB_COLLATION, **kwargs)
 
 
+# Every gzip stream starts with these two bytes. Rows that were written
+# as plain text before a column was compressed never start with them,
+# as 0x8b can not start a utf-8 character.
+GZIP_MAGIC = b"\x1f\x8b"
+
+
+class CompressedText(TypeDecorator):
+    """
+    Text that is stored gzipped in a blob column. Values are str in
+    python. Rows written as plain text before the column was switched
+    to compressed text are read back as is.
+    """
+
+    impl = LargeBinary
+    cache_ok = True
+
+    def load_dialect_impl(self, dialect):
+        if dialect.name == "mysql":
+            # Up to 16MB compressed
+            return dialect.type_descriptor(mysql.MEDIUMBLOB())
+        return dialect.type_descriptor(LargeBinary())
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        if isinstance(value, str):
+            value = value.encode()
+        return gzip.compress(value, compresslevel=6)
+
+    def result_processor(self, dialect, coltype):
+        # Skip the blob result processor, as plain text rows
+        # come back as str from sqlite.
+        return decompress_text
+
+
+def decompress_text(value: bytes | str | None) -> str | None:
+    """
+    Read a value stored in a CompressedText column. Plain text
+    rows are passed through.
+
+    :param value:
+    :return:
+    """
+    if value is None or isinstance(value, str):
+        return value
+    if value.startswith(GZIP_MAGIC):
+        value = gzip.decompress(value)
+    return value.decode(errors="replace")
+
+
 DateTime = sqlalchemy.sql.sqltypes.DateTime
 Boolean = sqlalchemy.sql.sqltypes.Boolean
 JSON = sqlalchemy.sql.sqltypes.JSON
@@ -12,13 +12,15 @@ from rq import Queue
 from anubis.env import env
 from anubis.github.repos import create_assignment_github_repo
 from anubis.ide.initialize import initialize_theia_session
+from anubis.k8s.pipeline.admission import PIPELINE_PRIORITY_BULK
+from anubis.k8s.pipeline.batch import create_batch_pipeline, create_pipeline_batch
 from anubis.k8s.pipeline.create import create_submission_pipeline
 from anubis.k8s.pipeline.reap import reap_pipeline_jobs
 from anubis.k8s.pvc.reap import reap_user_pvc
 from anubis.k8s.theia.reap import reap_stale_theia_sessions
 from anubis.k8s.theia.reap import reap_theia_session_by_id
 from anubis.lms.assignments import make_shared_assignment
-from anubis.lms.autograde import bulk_autograde
+from anubis.lms.autograde import run_sharded_bulk_autograde
 from anubis.lms.questions import assign_missing_questions
 from anubis.lms.regrade import bulk_regrade_assignment
 from anubis.lms.submissions import bulk_regrade_submissions
@@ -61,9 +63,24 @@ def rpc_enqueue(func, queue=None, args=None):
         conn.close()
 
 
-def enqueue_autograde_pipeline(*args, queue: str = "regrade"):
+def enqueue_autograde_pipeline(
+    submission_id: str,
+    queue: str = "regrade",
+    priority: str = PIPELINE_PRIORITY_BULK,
+    use_cache: bool = True,
+):
     """Enqueues a test job"""
-    rpc_enqueue(create_submission_pipeline, queue=queue, args=args)
+    rpc_enqueue(create_submission_pipeline, queue=queue, args=(submission_id, queue, priority, use_cache))
+
+
+def enqueue_pipeline_batch(submission_ids: list[str], use_cache: bool = True):
+    """Enqueues a batch test job"""
+    rpc_enqueue(create_pipeline_batch, queue="regrade", args=(submission_ids, use_cache))
+
+
+def enqueue_batch_pipeline(batch_id: str, queue: str = "regrade"):
+    """Enqueues a batch test job that was admitted"""
+    rpc_enqueue(create_batch_pipeline, queue=queue, args=(batch_id, queue))
 
 
 def enqueue_ide_initialize(*args):
@@ -112,8 +129,8 @@ def enqueue_reap_pvc_user(*args):
 
 
 def enqueue_bulk_autograde(*args):
-    """Enqueue bulk autograde of assignment"""
-    rpc_enqueue(bulk_autograde, queue="regrade", args=args)
+    """Enqueue sharded bulk autograde of assignment"""
+    rpc_enqueue(run_sharded_bulk_autograde, queue="regrade", args=args)
 
 
 def enqueue_bulk_regrade_assignment(*args):
@@ -1,3 +1,7 @@
+import gzip
+import json
+from typing import Any
+
 from flask_caching import Cache
 
 cache = Cache()
@@ -13,3 +17,52 @@ def cache_health():
     :return:
     """
     return None
+
+
+def compress_cache_value(value: Any) -> bytes:
+    """
+    Encode a json serializable value as gzipped json. This is much
+    smaller than the pickled python objects that memoize stores.
+
+    :param value:
+    :return:
+    """
+    return gzip.compress(json.dumps(value, separators=(",", ":")).encode())
+
+
+def decompress_cache_value(blob: bytes) -> Any:
+    """
+    Decode a value encoded with compress_cache_value.
+
+    :param blob:
+    :return:
+    """
+    return json.loads(gzip.decompress(blob))
+
+
+def cache_set_compressed(key: str, value: Any, timeout: int = None) -> int:
+    """
+    Store a json serializable value in the cache as gzipped json.
+
+    :param key:
+    :param value:
+    :param timeout:
+    :return: size of the stored value in bytes
+    """
+    blob = compress_cache_value(value)
+    cache.set(key, blob, timeout=timeout)
+    return len(blob)
+
+
+def cache_get_compressed(key: str) -> Any | None:
+    """
+    Get a value stored with cache_set_compressed. Returns None
+    if the key is not in the cache.
+
+    :param key:
+    :return:
+    """
+    blob = cache.get(key)
+    if blob is None:
+        return None
+    return decompress_cache_value(blob)
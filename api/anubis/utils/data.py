@@ -11,6 +11,9 @@ from anubis.utils.exceptions import AssertError
 
 MYSQL_TEXT_MAX_LENGTH = 2 ** 16 - 1
 
+# Longest text kept in a compressed text column, before compression
+COMPRESSED_TEXT_MAX_LENGTH = 2 ** 22
+
 
 def is_debug() -> bool:
     """
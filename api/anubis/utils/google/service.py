@@ -1,9 +1,8 @@
 import google.oauth2.credentials
 import googleapiclient.discovery
-import kubernetes.client
-import kubernetes.config
 from googleapiclient.discovery import build
 
+from anubis.k8s.api import get_core_v1_api
 from anubis.k8s.google import get_google_secret, get_google_credentials
 from anubis.utils.exceptions import GoogleCredentialsException
 
@@ -37,11 +36,8 @@ def build_google_service(
     :return:
     """
 
-    # setup Kubernetes incluster client
-    kubernetes.config.load_incluster_config()
-
     # Get CoreV1Api object
-    v1 = kubernetes.client.CoreV1Api()
+    v1 = get_core_v1_api()
 
     # Get kubernetes credentials secret object
     secret = get_google_secret(v1, secret_name)
@@ -0,0 +1,171 @@
+import bisect
+import hashlib
+import os
+import socket
+import time
+
+from anubis.utils.logging import logger
+from anubis.utils.redis import redis
+
+# Membership of each poller group is a zset of member id -> lease expiry
+POLLER_LEASE_PREFIX = "poller-lease:"
+
+# A replica drops out of its group if it does not renew for this long.
+# Renewals are made a few times within the ttl.
+POLLER_LEASE_TTL_SECONDS = 15
+POLLER_LEASE_RENEW_SECONDS = 5
+
+# A replica that has not renewed for this long owns nothing, as it may
+# not have seen the members change. It stops well before its lease runs out.
+POLLER_LEASE_STALE_SECONDS = POLLER_LEASE_RENEW_SECONDS * 2
+
+# Items that change owner are only picked up by the new owner after this
+# long. Any replica still working on them has renewed and seen the change
+# by then, or has gone stale, or has lost its lease.
+POLLER_LEASE_GRACE_SECONDS = POLLER_LEASE_TTL_SECONDS + POLLER_LEASE_RENEW_SECONDS
+
+# Points each member gets on the hash ring. More points spread items
+# more evenly between members.
+POLLER_LEASE_VNODES = 64
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], "big")
+
+
+def _build_ring(members: list[str]) -> list[tuple[int, str]]:
+    return sorted((_hash(f"{member}#{index}"), member) for member in members for index in range(POLLER_LEASE_VNODES))
+
+
+def _ring_owner(ring: list[tuple[int, str]], key: str) -> str | None:
+    if len(ring) == 0:
+        return None
+    index = bisect.bisect(ring, (_hash(key), ""))
+    return ring[index % len(ring)][1]
+
+
+def get_poller_lease_members(group: str) -> list[str]:
+    """
+    Get the replicas of a poller group that hold a live lease.
+
+    :param group:
+    :return:
+    """
+    if redis is None:
+        return []
+    members = redis.zrangebyscore(POLLER_LEASE_PREFIX + group, time.time(), "+inf")
+    return sorted(member.decode() for member in members)
+
+
+class PollerLease:
+    """
+    Split the work of a poller between its replicas. Each replica renews
+    a lease in its group, and items (jobs, sessions) are assigned to the
+    live replicas by consistent hashing on their key. When a replica
+    stops renewing, its lease runs out and its items are spread over the
+    rest. Only a small share of items move when a replica joins or leaves.
+
+    Items that change owner are only picked up by the new owner after
+    a handoff grace period, by which point the old owner has renewed and
+    seen the change. A replica that has not renewed recently owns
+    nothing, so two replicas never work on an item at the same time.
+
+    Without redis there is a single replica that owns every item.
+    """
+
+    def __init__(self, group: str, member_id: str = None):
+        self.group = group
+        self.member_id = member_id or os.environ.get("HOSTNAME", socket.gethostname())
+        self.key = POLLER_LEASE_PREFIX + group
+
+        self.members: list[str] = []
+        self.ring: list[tuple[int, str]] = []
+        self.previous_ring: list[tuple[int, str]] = []
+        self.changed_at = 0.0
+        self.renewed_at = 0.0
+
+    def renew(self, force: bool = False) -> list[str]:
+        """
+        Renew the lease of this replica, and rebuild the hash ring if the
+        live members changed. Renewals more often than the renew interval
+        are skipped unless forced.
+
+        :param force:
+        :return: live members of the group
+        """
+        if redis is None:
+            return [self.member_id]
+
+        now = time.time()
+        if not force and now - self.renewed_at < POLLER_LEASE_RENEW_SECONDS:
+            return self.members
+
+        try:
+            pipe = redis.pipeline()
+            pipe.zadd(self.key, {self.member_id: now + POLLER_LEASE_TTL_SECONDS})
+            pipe.zremrangebyscore(self.key, "-inf", now)
+            pipe.zrange(self.key, 0, -1)
+            pipe.expire(self.key, POLLER_LEASE_TTL_SECONDS * 4)
+            _, _, members, _ = pipe.execute()
+        except Exception as e:
+            logger.error(f"unable to renew {self.group} lease {self.member_id}: {e}")
+            return self.members
+
+        members = sorted(member.decode() for member in members)
+        self.renewed_at = now
+
+        if members != self.members:
+            logger.info(f"{self.group} lease members changed {self.members} -> {members}")
+            self.previous_ring = self.ring
+            self.ring = _build_ring(members)
+            self.members = members
+            self.changed_at = now
+
+        return self.members
+
+    def leave(self):
+        """
+        Give up the lease, so the other replicas take over right away.
+
+        :return:
+        """
+        if redis is None:
+            return
+        redis.zrem(self.key, self.member_id)
+        self.members, self.ring, self.previous_ring = [], [], []
+        self.renewed_at = 0.0
+
+    def owns(self, key: str) -> bool:
+        """
+        Check if an item is assigned to this replica.
+
+        :param key: stable key of the item, like a job name or session id
+        :return:
+        """
+        if redis is None:
+            return True
+
+        now = time.time()
+
+        # We may have missed a change of members, or our lease may have
+        # run out and our items been given to someone else
+        if now - self.renewed_at >= POLLER_LEASE_STALE_SECONDS:
+            return False
+
+        if _ring_owner(self.ring, key) != self.member_id:
+            return False
+
+        # Items we just took over wait out the handoff grace period
+        if now - self.changed_at < POLLER_LEASE_GRACE_SECONDS:
+            return _ring_owner(self.previous_ring, key) == self.member_id
+
+        return True
+
+    def is_leader(self) -> bool:
+        """
+        Check if this replica should run the work that is not split
+        between replicas. It is the owner of the group name.
+
+        :return:
+        """
+        return self.owns(self.group)
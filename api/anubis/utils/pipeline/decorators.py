@@ -1,7 +1,9 @@
 from functools import wraps
 
 from flask import request
+from sqlalchemy.orm import lazyload
 
+from anubis.lms.pipeline_ingest import get_submission_token
 from anubis.models import Submission
 from anubis.utils.http import error_response
 from anubis.utils.logging import logger
@@ -24,8 +26,11 @@ def check_submission_token(func):
 
     @wraps(func)
     def wrapper(submission_id: str):
-        # Try to get the submission
-        submission = Submission.query.filter(Submission.id == submission_id).first()
+        # Try to get the submission. The test results are not needed
+        # to verify the token, so skip eager loading them.
+        submission = (
+            Submission.query.filter(Submission.id == submission_id).options(lazyload(Submission.test_results)).first()
+        )
 
         # Try to get a token from the request query
         token = request.args.get("token", default=None)
@@ -86,3 +91,41 @@ def check_submission_token(func):
         return func(submission)
 
     return wrapper
+
+
+def check_submission_token_cached(func):
+    """
+    Same as check_submission_token, but the token is checked against the
+    cached submission token instead of loading the submission. This is for
+    the ingest endpoints that do not touch the database. The view function
+    is given the submission id instead of the submission.
+
+    :param func:
+    :return:
+    """
+
+    @wraps(func)
+    def wrapper(submission_id: str):
+        # Try to get a token from the request query
+        token = request.args.get("token", default=None)
+
+        # Verify the token matches the submission
+        if token is None or token != get_submission_token(submission_id):
+            # Log that there was an issue verifying the token
+            logger.error(
+                "Invalid token reported from pipeline",
+                extra={
+                    "submission_id": submission_id,
+                    "path":          request.path,
+                    "headers":       request.headers,
+                    "ip":            request.remote_addr,
+                },
+            )
+
+            # Give back a 406 rejected error
+            return error_response("Invalid"), 406
+
+        # Call the view function with the submission id
+        return func(submission_id)
+
+    return wrapper
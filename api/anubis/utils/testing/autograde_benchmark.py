@@ -0,0 +1,350 @@
+"""
+Benchmarks for the autograde and assignment visual calculations.
+
+Seeds a parameterized dataset (students x submissions x tests), then records
+wall time, query count and peak python memory for the functions that the
+admin autograde pages are built on. Results are written as json. A previous
+results file can be given to compare against, in which case the run fails if
+any metric regressed past the threshold.
+
+    env MINDEBUG=1 DEBUG=1 python3 -m anubis.utils.testing.autograde_benchmark \\
+        --dataset small medium --output benchmark.json
+
+    env MINDEBUG=1 DEBUG=1 python3 -m anubis.utils.testing.autograde_benchmark \\
+        --dataset small --compare benchmark.json --threshold 0.25
+
+The database is cleared before each dataset is seeded, so the benchmark
+refuses to run on anything but the MINDEBUG sqlite database unless it is
+given --force.
+"""
+
+import argparse
+import json
+import random
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+from typing import Any, Callable
+
+from sqlalchemy import event
+
+from anubis.env import env
+from anubis.lms.autograde import autograde, bulk_autograde, rebuild_best_submissions
+from anubis.lms.submissions import get_submissions
+from anubis.models import Assignment, TheiaImage, User, db
+from anubis.utils.cache import cache
+from anubis.utils.data import with_context
+from anubis.utils.testing.db import clear_database
+from anubis.utils.testing.seed import create_assignment, create_course, create_students, init_submissions
+from anubis.utils.visuals.assignments import get_admin_assignment_visual_data, get_assignment_sundial
+
+# name -> (students, submissions per student, tests)
+DATASETS: dict[str, tuple[int, int, int]] = {
+    "tiny": (20, 5, 3),
+    "small": (100, 10, 4),
+    "medium": (1000, 10, 4),
+    "large": (5000, 10, 4),
+}
+
+METRICS = ("wall_time", "queries", "peak_memory")
+
+
+class QueryCounter:
+    """
+    Count the number of sql statements executed on an engine
+    while the counter is active.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.count = 0
+
+    def _before_cursor_execute(self, *_):
+        self.count += 1
+
+    def __enter__(self):
+        self.count = 0
+        event.listen(self.engine, "before_cursor_execute", self._before_cursor_execute)
+        return self
+
+    def __exit__(self, *_):
+        event.remove(self.engine, "before_cursor_execute", self._before_cursor_execute)
+
+
+def can_clear_database(force: bool = False) -> bool:
+    """
+    The benchmark clears the database. Only let it do that to the
+    MINDEBUG sqlite database, unless forced.
+
+    :param force:
+    :return:
+    """
+    return force or env.MINDEBUG or db.engine.dialect.name == "sqlite"
+
+
+def seed_dataset(students: int, submissions: int, tests: int, force: bool = False) -> Assignment:
+    """
+    Clear the database, then seed a single course with one assignment
+    of the given size. Seeding uses a fixed random seed so datasets
+    of the same size are comparable between runs.
+
+    :param students:
+    :param submissions: submissions per student
+    :param tests: assignment tests
+    :param force: clear the database even if it is not the MINDEBUG sqlite database
+    :return:
+    """
+    if not can_clear_database(force):
+        raise RuntimeError(f"refusing to clear the {db.engine.dialect.name} database without force")
+
+    random.seed(0)
+    clear_database()
+
+    xv6_image = TheiaImage(
+        image="registry.digitalocean.com/anubis/theia-cpp",
+        title="C/C++ IDE",
+        description="C/C++ IDE",
+        icon="devicon-cplusplus-plain",
+        public=True,
+    )
+    db.session.add(xv6_image)
+
+    course_students = create_students(students)
+    course = create_course(
+        course_students,
+        name="Intro to OS",
+        course_code="CS-UY 3224",
+        section="A",
+        professor_display_name="Gustavo",
+        autograde_tests_repo="https://github.com/os3224/anubis-assignment-tests",
+        github_org="os3224",
+    )
+    assignment, _, assignment_submissions, _ = create_assignment(
+        course,
+        course_students,
+        xv6_image,
+        submission_count=submissions,
+        test_count=tests,
+    )
+    init_submissions(assignment_submissions)
+    db.session.commit()
+
+    # Seeded submissions skip the pipeline reports, so build the
+    # best submission table directly.
+    rebuild_best_submissions(assignment.id)
+
+    return assignment
+
+
+def clear_benchmark_caches():
+    """
+    Drop the memoized results of the benchmarked functions, so that
+    every run does the full calculation.
+
+    :return:
+    """
+    for func in (autograde, get_admin_assignment_visual_data, get_assignment_sundial, get_submissions):
+        cache.delete_memoized(func)
+
+
+def measure(func: Callable, *args, repeat: int = 3, **kwargs) -> dict[str, Any]:
+    """
+    Run a function several times with a clean session and cache each
+    time, and record the best wall time, and the most queries and peak
+    memory.
+
+    :param func:
+    :param args:
+    :param repeat:
+    :param kwargs:
+    :return:
+    """
+    wall_times, queries, peak_memory = [], [], []
+
+    for _ in range(repeat):
+        db.session.expunge_all()
+        clear_benchmark_caches()
+
+        tracemalloc.start()
+        with QueryCounter(db.engine) as counter:
+            start = time.perf_counter()
+            func(*args, **kwargs)
+            wall_times.append(time.perf_counter() - start)
+        peak_memory.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+
+        queries.append(counter.count)
+
+    return {
+        "wall_time": min(wall_times),
+        "queries": max(queries),
+        "peak_memory": max(peak_memory),
+    }
+
+
+def run_dataset(
+    name: str,
+    students: int,
+    submissions: int,
+    tests: int,
+    repeat: int = 3,
+    force: bool = False,
+) -> dict[str, Any]:
+    """
+    Seed a dataset and benchmark each of the autograde functions on it.
+
+    :param name:
+    :param students:
+    :param submissions:
+    :param tests:
+    :param repeat:
+    :param force: clear the database even if it is not the MINDEBUG sqlite database
+    :return:
+    """
+    print(f"Seeding {name} [ {students} students x {submissions} submissions x {tests} tests ]", flush=True)
+    seed_start = time.perf_counter()
+    assignment = seed_dataset(students, submissions, tests, force=force)
+    assignment_id, course_id = assignment.id, assignment.course_id
+    print("Seed done in {:.2f}s".format(time.perf_counter() - seed_start), flush=True)
+
+    # A student to get the submissions of
+    student_id = User.query.order_by(User.netid).first().id
+
+    benchmarks = {
+        "bulk_autograde": lambda: bulk_autograde(assignment_id, limit=None, offset=None),
+        "get_assignment_sundial": lambda: get_assignment_sundial(assignment_id),
+        "get_admin_assignment_visual_data": lambda: get_admin_assignment_visual_data(assignment_id),
+        "get_submissions": lambda: get_submissions(student_id, course_id, assignment_id),
+    }
+
+    results = {}
+    for benchmark_name, benchmark in benchmarks.items():
+        try:
+            results[benchmark_name] = measure(benchmark, repeat=repeat)
+        except Exception as e:
+            # The visual data queries are written for MySQL, and
+            # do not run on sqlite.
+            db.session.rollback()
+            results[benchmark_name] = {"error": str(e).splitlines()[0]}
+
+        print(f"  {benchmark_name:<34} {json.dumps(results[benchmark_name])}", flush=True)
+
+    return {
+        "students": students,
+        "submissions": submissions,
+        "tests": tests,
+        "results": results,
+    }
+
+
+def compare(baseline: dict[str, Any], current: dict[str, Any], threshold: float) -> list[str]:
+    """
+    Compare two benchmark results. Any metric that is more than threshold
+    (as a fraction) worse than the baseline is reported as a regression.
+    So is any benchmark of the baseline that is missing from the current
+    results, or that errored when it did not in the baseline. Datasets
+    that were not run this time are skipped.
+
+    :param baseline:
+    :param current:
+    :param threshold:
+    :return: list of regression messages
+    """
+    regressions = []
+
+    for dataset, current_dataset in current["datasets"].items():
+        baseline_dataset = baseline["datasets"].get(dataset, None)
+        if baseline_dataset is None:
+            continue
+
+        for benchmark, baseline_result in baseline_dataset["results"].items():
+            current_result = current_dataset["results"].get(benchmark, None)
+            if current_result is None:
+                regressions.append(f"{dataset} {benchmark} is missing")
+                continue
+
+            # Benchmarks that error on this backend in the baseline too
+            # (the visual data queries on sqlite) have nothing to compare
+            if "error" in current_result:
+                if "error" not in baseline_result:
+                    regressions.append(f"{dataset} {benchmark} errored: {current_result['error']}")
+                continue
+
+            for metric in METRICS:
+                if metric not in baseline_result:
+                    continue
+                if metric not in current_result:
+                    regressions.append(f"{dataset} {benchmark} {metric} is missing")
+                    continue
+
+                before, after = baseline_result[metric], current_result[metric]
+                if before > 0 and after > before * (1 + threshold):
+                    regressions.append(
+                        f"{dataset} {benchmark} {metric} regressed {before} -> {after} "
+                        f"(+{(after - before) / before:.0%})"
+                    )
+
+    return regressions
+
+
+@with_context
+def main(argv: list[str] = None):
+    parser = argparse.ArgumentParser(description="Benchmark autograde calculations")
+    parser.add_argument("--dataset", nargs="+", default=["small"], choices=DATASETS.keys())
+    parser.add_argument("--students", type=int, help="override the number of students")
+    parser.add_argument("--submissions", type=int, help="override the submissions per student")
+    parser.add_argument("--tests", type=int, help="override the number of assignment tests")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", help="file to write the json results to")
+    parser.add_argument("--compare", help="baseline json results to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed regression as a fraction")
+    parser.add_argument("--force", action="store_true", help="clear and seed a database that is not MINDEBUG sqlite")
+    args = parser.parse_args(argv)
+
+    if not can_clear_database(args.force):
+        print(f"Refusing to clear the {db.engine.dialect.name} database. Run with MINDEBUG=1, or pass --force.")
+        sys.exit(1)
+
+    # The sqlite database used by mindebug needs its tables created
+    if db.engine.dialect.name == "sqlite":
+        db.create_all()
+
+    report = {
+        "backend": db.engine.dialect.name,
+        "timestamp": str(datetime.now()),
+        "datasets": {},
+    }
+
+    for name in args.dataset:
+        students, submissions, tests = DATASETS[name]
+        report["datasets"][name] = run_dataset(
+            name,
+            args.students or students,
+            args.submissions or submissions,
+            args.tests or tests,
+            repeat=args.repeat,
+            force=args.force,
+        )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+        regressions = compare(baseline, report, args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+
+        if len(regressions) > 0:
+            sys.exit(1)
+
+        print(f"No regressions past {args.threshold:.0%} against {args.compare}")
+
+
+if __name__ == "__main__":
+    main()
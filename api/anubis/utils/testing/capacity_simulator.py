@@ -0,0 +1,519 @@
+"""
+Deadline load simulator for tuning pipeline and IDE capacity limits.
+
+Replays historical push times (Submission.created) and IDE session starts
+and ends (TheiaSession.created / ended) against a model of the pipeline
+scheduler in create_submission_pipeline and the IDE limit in
+initialize_theia_session. Each candidate combination of limits and node
+counts is simulated, and queue wait percentiles, utilization and rejected
+IDE starts are reported for each.
+
+The model:
+
+    * A push takes a pipeline slot if fewer than --max-jobs pipelines hold
+      one. Otherwise it waits, and waiting owners are admitted round robin,
+      like the pipeline admission scheduler. With --coalesce, a waiting push
+      is superseded by a newer push of the same owner and assignment.
+    * An IDE start is rejected if --max-ides sessions are active, the way
+      the IDE page refuses new sessions at THEIA_MAX_SESSIONS.
+    * Admitted pipelines and IDEs are placed first fit on nodes by their
+      resource requests, and wait pending until a node has room.
+    * Pipelines run for the duration of their profile, or the median
+      profile duration of their assignment, or --pipeline-duration.
+
+Everything runs offline against the configured database. With MINDEBUG
+that is the seeded sqlite database, otherwise a restored dump:
+
+    env MINDEBUG=1 python3 -m anubis.utils.testing.capacity_simulator \\
+        --max-jobs 10 20 --max-ides 50 100 --nodes 3 5
+
+    env DATABASE_URI=mysql+pymysql://... python3 -m anubis.utils.testing.capacity_simulator \\
+        --start 2022-10-01 --end 2022-10-08 --max-jobs 10 20 40 --nodes 4 8 --output capacity.json
+"""
+
+import argparse
+import heapq
+import itertools
+import json
+import statistics
+from collections import defaultdict, deque
+from datetime import datetime
+from typing import Any
+
+from anubis.constants import THEIA_DEFAULT_OPTIONS
+from anubis.lms.pipeline_resources import get_pipeline_resources, parse_cpu_millicores, parse_memory_mib
+from anubis.models import Assignment, PipelineProfile, Submission, TheiaSession, db
+from anubis.utils.data import with_context
+
+# Event kinds, in the order they are handled when they happen at the
+# same time. Resources are freed before new work arrives.
+PIPELINE_DONE = 0
+IDE_END = 1
+PUSH = 2
+IDE_START = 3
+
+
+def _percentile(values: list[float], p: float) -> float:
+    if len(values) == 0:
+        return 0.0
+    values = sorted(values)
+    return round(values[min(int(len(values) * p), len(values) - 1)], 3)
+
+
+def _get_requests(resources: dict) -> tuple[int, int]:
+    """
+    Get the cpu millicores and memory MiB requested by a k8s resources dict.
+
+    :param resources:
+    :return:
+    """
+    requests = resources.get("requests", {})
+    return parse_cpu_millicores(requests.get("cpu", "0")) or 0, parse_memory_mib(requests.get("memory", "0")) or 0
+
+
+class CapacitySimulator:
+    """
+    Discrete event simulation of a single capacity scenario. Arrivals
+    are dicts from load_pipeline_arrivals and load_ide_arrivals.
+    """
+
+    def __init__(
+        self,
+        max_jobs: int,
+        max_ides: int,
+        nodes: int,
+        node_cpu: int,
+        node_memory: int,
+        coalesce: bool = False,
+    ):
+        self.max_jobs = max_jobs
+        self.max_ides = max_ides
+        self.node_count = nodes
+        self.node_cpu = node_cpu
+        self.node_memory = node_memory
+        self.coalesce = coalesce
+
+    def _reset(self):
+        self.now = 0.0
+        self.events = []
+        self.sequence = itertools.count()
+
+        # Free cpu and memory of each node
+        self.nodes = [[self.node_cpu, self.node_memory] for _ in range(self.node_count)]
+
+        # Pipeline admission. Owners take turns, and each owner has a queue.
+        self.slots = 0
+        self.owners: deque[str] = deque()
+        self.owner_queues: dict[str, deque[dict]] = defaultdict(deque)
+        self.latest: dict[str, dict] = {}
+
+        # Admitted pipelines and IDEs that do not fit on a node yet
+        self.pending: list[dict] = []
+
+        self.ides = 0
+        self.pipeline_waits = []
+        self.ide_waits = []
+        self.superseded = 0
+        self.rejected = 0
+        self.unplaceable = 0
+
+        # Time weighted sums for utilization
+        self.last_time = None
+        self.slot_time = 0.0
+        self.cpu_time = 0.0
+        self.memory_time = 0.0
+        self.peak_cpu = 0
+
+    def _push_event(self, time: float, kind: int, item: dict):
+        heapq.heappush(self.events, (time, kind, next(self.sequence), item))
+
+    def _advance(self, time: float):
+        """
+        Accumulate utilization up to a point in time.
+
+        :param time:
+        :return:
+        """
+        if self.last_time is not None:
+            elapsed = time - self.last_time
+            used_cpu = sum(self.node_cpu - node[0] for node in self.nodes)
+            used_memory = sum(self.node_memory - node[1] for node in self.nodes)
+            self.slot_time += elapsed * self.slots
+            self.cpu_time += elapsed * used_cpu
+            self.memory_time += elapsed * used_memory
+            self.peak_cpu = max(self.peak_cpu, used_cpu)
+        self.last_time = time
+        self.now = time
+
+    def _place(self, item: dict) -> bool:
+        """
+        Place a pod on the first node with room for its requests.
+
+        :param item:
+        :return: True if the pod was placed
+        """
+        for index, node in enumerate(self.nodes):
+            if node[0] >= item["cpu"] and node[1] >= item["memory"]:
+                node[0] -= item["cpu"]
+                node[1] -= item["memory"]
+                item["node"] = index
+                return True
+        return False
+
+    def _free(self, item: dict):
+        node = self.nodes[item["node"]]
+        node[0] += item["cpu"]
+        node[1] += item["memory"]
+
+    def _start(self, item: dict):
+        """
+        Start an admitted pipeline or IDE on a node, or leave it pending
+        until a node has room.
+
+        :param item:
+        :return:
+        """
+        if item["cpu"] > self.node_cpu or item["memory"] > self.node_memory:
+            # Would never fit on any node. Counted, and dropped.
+            self.unplaceable += 1
+            if item["kind"] == PUSH:
+                self.slots -= 1
+            else:
+                self.ides -= 1
+            return
+
+        if not self._place(item):
+            self.pending.append(item)
+            return
+
+        waited = self.now - item["time"]
+        if item["kind"] == PUSH:
+            self.pipeline_waits.append(waited)
+            self._push_event(self.now + item["duration"], PIPELINE_DONE, item)
+        else:
+            self.ide_waits.append(waited)
+            self._push_event(self.now + item["duration"], IDE_END, item)
+
+    def _admit_pipelines(self):
+        """
+        Give free pipeline slots to waiting pushes, one owner at a time.
+
+        :return:
+        """
+        while self.slots < self.max_jobs and len(self.owners) > 0:
+            owner = self.owners.popleft()
+            owner_queue = self.owner_queues[owner]
+            item = owner_queue.popleft()
+            if len(owner_queue) > 0:
+                self.owners.append(owner)
+            if self.latest.get(item["coalesce"], None) is item:
+                del self.latest[item["coalesce"]]
+
+            self.slots += 1
+            self._start(item)
+
+    def _start_pending(self):
+        """
+        Place pending pods that now fit, oldest first.
+
+        :return:
+        """
+        pending, self.pending = self.pending, []
+        for item in pending:
+            self._start(item)
+
+    def _handle_push(self, item: dict):
+        owner_queue = self.owner_queues[item["owner"]]
+
+        # Supersede the last push of the owner for the assignment if it is still waiting
+        if self.coalesce:
+            previous = self.latest.get(item["coalesce"], None)
+            if previous is not None and previous in owner_queue:
+                owner_queue.remove(previous)
+                self.superseded += 1
+            self.latest[item["coalesce"]] = item
+
+        if len(owner_queue) == 0 and item["owner"] not in self.owners:
+            # Owners that were not waiting join the round robin at the front
+            self.owners.appendleft(item["owner"])
+        owner_queue.append(item)
+        self._admit_pipelines()
+
+    def _handle_ide_start(self, item: dict):
+        if self.ides >= self.max_ides:
+            self.rejected += 1
+            return
+
+        self.ides += 1
+        self._start(item)
+
+    def run(self, pipelines: list[dict], ides: list[dict]) -> dict[str, Any]:
+        """
+        Replay the arrivals, and report on the scenario.
+
+        :param pipelines: pipeline arrivals
+        :param ides: ide session arrivals
+        :return:
+        """
+        self._reset()
+
+        for item in pipelines:
+            self._push_event(item["time"], PUSH, {**item, "kind": PUSH})
+        for item in ides:
+            self._push_event(item["time"], IDE_START, {**item, "kind": IDE_START})
+
+        start = self.events[0][0] if len(self.events) > 0 else 0.0
+        self.last_time = start
+
+        while len(self.events) > 0:
+            time, kind, _, item = heapq.heappop(self.events)
+            self._advance(time)
+
+            if kind == PUSH:
+                self._handle_push(item)
+            elif kind == IDE_START:
+                self._handle_ide_start(item)
+            elif kind == PIPELINE_DONE:
+                self._free(item)
+                self.slots -= 1
+                self._start_pending()
+                self._admit_pipelines()
+            elif kind == IDE_END:
+                self._free(item)
+                self.ides -= 1
+                self._start_pending()
+
+        elapsed = max(self.now - start, 1e-9)
+        total_cpu = self.node_cpu * self.node_count
+        total_memory = self.node_memory * self.node_count
+
+        return {
+            "max_jobs":  self.max_jobs,
+            "max_ides":  self.max_ides,
+            "nodes":     self.node_count,
+            "pipelines": {
+                "count":            len(pipelines),
+                "run":              len(self.pipeline_waits),
+                "superseded":       self.superseded,
+                "wait_p50":         _percentile(self.pipeline_waits, 0.5),
+                "wait_p95":         _percentile(self.pipeline_waits, 0.95),
+                "wait_p99":         _percentile(self.pipeline_waits, 0.99),
+                "wait_max":         round(max(self.pipeline_waits, default=0.0), 3),
+                "slot_utilization": round(self.slot_time / (elapsed * max(self.max_jobs, 1)), 4),
+            },
+            "ides":      {
+                "count":    len(ides),
+                "rejected": self.rejected,
+                "wait_p50": _percentile(self.ide_waits, 0.5),
+                "wait_p95": _percentile(self.ide_waits, 0.95),
+                "wait_max": round(max(self.ide_waits, default=0.0), 3),
+            },
+            "cluster":   {
+                "cpu_utilization":    round(self.cpu_time / (elapsed * max(total_cpu, 1)), 4),
+                "memory_utilization": round(self.memory_time / (elapsed * max(total_memory, 1)), 4),
+                "peak_cpu":           round(self.peak_cpu / max(total_cpu, 1), 4),
+                "unplaceable":        self.unplaceable,
+            },
+        }
+
+
+def load_pipeline_arrivals(
+    start: datetime | None,
+    end: datetime | None,
+    default_duration: float,
+    course_id: str = None,
+) -> list[dict]:
+    """
+    Load the pushes in a time range as pipeline arrivals. Durations come
+    from the pipeline profile of the submission, then the median profile
+    duration of its assignment, then the default. Resource requests are
+    the ones pipelines of the assignment would get today.
+
+    :param start:
+    :param end:
+    :param default_duration: pipeline seconds when there is no profile
+    :param course_id: only pushes to this course
+    :return:
+    """
+    query = db.session.query(
+        Submission.id, Submission.owner_id, Submission.assignment_id, Submission.created
+    ).join(Assignment, Assignment.id == Submission.assignment_id)
+    if start is not None:
+        query = query.filter(Submission.created >= start)
+    if end is not None:
+        query = query.filter(Submission.created < end)
+    if course_id is not None:
+        query = query.filter(Assignment.course_id == course_id)
+    submissions = query.order_by(Submission.created).all()
+
+    assignment_ids = {submission.assignment_id for submission in submissions}
+    assignments: dict[str, Assignment] = {
+        assignment.id: assignment
+        for assignment in Assignment.query.filter(Assignment.id.in_(assignment_ids)).all()
+    }
+
+    durations: dict[str, int] = {}
+    assignment_durations: dict[str, list[int]] = defaultdict(list)
+    profiles = db.session.query(
+        PipelineProfile.submission_id, PipelineProfile.assignment_id, PipelineProfile.duration_seconds
+    ).filter(PipelineProfile.assignment_id.in_(assignment_ids))
+    for submission_id, assignment_id, duration in profiles.all():
+        durations[submission_id] = duration
+        assignment_durations[assignment_id].append(duration)
+
+    requests = {
+        assignment_id: _get_requests(get_pipeline_resources(assignment))
+        for assignment_id, assignment in assignments.items()
+    }
+
+    arrivals = []
+    for submission in submissions:
+        duration = durations.get(submission.id, None)
+        if duration is None and len(assignment_durations[submission.assignment_id]) > 0:
+            duration = statistics.median(assignment_durations[submission.assignment_id])
+        cpu, memory = requests[submission.assignment_id]
+
+        arrivals.append(
+            {
+                "id":       submission.id,
+                "owner":    submission.owner_id or "",
+                "coalesce": f"{submission.owner_id}:{submission.assignment_id}",
+                "time":     submission.created.timestamp(),
+                "duration": float(duration or default_duration),
+                "cpu":      cpu,
+                "memory":   memory,
+            }
+        )
+
+    return arrivals
+
+
+def load_ide_arrivals(
+    start: datetime | None,
+    end: datetime | None,
+    default_duration: float,
+    course_id: str = None,
+) -> list[dict]:
+    """
+    Load the IDE sessions started in a time range as IDE arrivals. Sessions
+    that never ended get the default duration.
+
+    :param start:
+    :param end:
+    :param default_duration: session seconds when the session never ended
+    :param course_id: only sessions in this course
+    :return:
+    """
+    query = db.session.query(TheiaSession.id, TheiaSession.created, TheiaSession.ended, TheiaSession.resources)
+    if start is not None:
+        query = query.filter(TheiaSession.created >= start)
+    if end is not None:
+        query = query.filter(TheiaSession.created < end)
+    if course_id is not None:
+        query = query.filter(TheiaSession.course_id == course_id)
+
+    arrivals = []
+    for session_id, created, ended, resources in query.order_by(TheiaSession.created).all():
+        duration = default_duration
+        if ended is not None and ended > created:
+            duration = (ended - created).total_seconds()
+
+        cpu, memory = _get_requests({**THEIA_DEFAULT_OPTIONS["resources"], **(resources or {})})
+        arrivals.append(
+            {
+                "id":       session_id,
+                "time":     created.timestamp(),
+                "duration": duration,
+                "cpu":      cpu,
+                "memory":   memory,
+            }
+        )
+
+    return arrivals
+
+
+def compress_arrivals(arrivals: list[dict], speedup: float) -> list[dict]:
+    """
+    Squeeze the arrival times toward the first arrival, to see how
+    the limits hold up under heavier load. Durations are kept.
+
+    :param arrivals:
+    :param speedup:
+    :return:
+    """
+    if speedup == 1.0 or len(arrivals) == 0:
+        return arrivals
+    first = min(item["time"] for item in arrivals)
+    return [{**item, "time": first + (item["time"] - first) / speedup} for item in arrivals]
+
+
+def print_report(results: list[dict]):
+    header = (
+        f"{'jobs':>5} {'ides':>5} {'nodes':>5} | {'pipe p50':>9} {'p95':>9} {'p99':>9} {'slots':>6} | "
+        f"{'ide p95':>8} {'rejected':>8} | {'cpu':>6} {'mem':>6} {'peak':>6}"
+    )
+    print(header)
+    print("-" * len(header))
+    for result in results:
+        pipelines, ides, cluster = result["pipelines"], result["ides"], result["cluster"]
+        print(
+            f"{result['max_jobs']:>5} {result['max_ides']:>5} {result['nodes']:>5} | "
+            f"{pipelines['wait_p50']:>8.1f}s {pipelines['wait_p95']:>8.1f}s {pipelines['wait_p99']:>8.1f}s "
+            f"{pipelines['slot_utilization']:>6.0%} | "
+            f"{ides['wait_p95']:>7.1f}s {ides['rejected']:>8} | "
+            f"{cluster['cpu_utilization']:>6.0%} {cluster['memory_utilization']:>6.0%} {cluster['peak_cpu']:>6.0%}"
+        )
+
+
+@with_context
+def main(argv: list[str] = None):
+    parser = argparse.ArgumentParser(description="Simulate pipeline and IDE capacity limits against past load")
+    parser.add_argument("--start", type=datetime.fromisoformat, help="replay from this time")
+    parser.add_argument("--end", type=datetime.fromisoformat, help="replay up to this time")
+    parser.add_argument("--course-id", help="only replay load from this course")
+    parser.add_argument("--max-jobs", type=int, nargs="+", default=[10], help="PIPELINE_MAX_JOBS candidates")
+    parser.add_argument("--max-ides", type=int, nargs="+", default=[50], help="THEIA_MAX_SESSIONS candidates")
+    parser.add_argument("--nodes", type=int, nargs="+", default=[3], help="node count candidates")
+    parser.add_argument("--node-cpu", type=int, default=4000, help="allocatable millicores per node")
+    parser.add_argument("--node-memory", type=int, default=16384, help="allocatable MiB per node")
+    parser.add_argument("--pipeline-duration", type=float, default=60.0, help="seconds, without a profile")
+    parser.add_argument("--ide-duration", type=float, default=3600.0, help="seconds, for sessions never ended")
+    parser.add_argument("--coalesce", action="store_true", help="supersede waiting pushes like PIPELINE_COALESCE")
+    parser.add_argument("--speedup", type=float, default=1.0, help="replay arrivals this many times faster")
+    parser.add_argument("--output", help="file to write the json results to")
+    args = parser.parse_args(argv)
+
+    pipelines = load_pipeline_arrivals(args.start, args.end, args.pipeline_duration, args.course_id)
+    ides = load_ide_arrivals(args.start, args.end, args.ide_duration, args.course_id)
+    pipelines = compress_arrivals(pipelines, args.speedup)
+    ides = compress_arrivals(ides, args.speedup)
+    print(f"Replaying {len(pipelines)} pushes and {len(ides)} IDE sessions")
+
+    results = []
+    for max_jobs, max_ides, nodes in itertools.product(args.max_jobs, args.max_ides, args.nodes):
+        simulator = CapacitySimulator(
+            max_jobs,
+            max_ides,
+            nodes,
+            node_cpu=args.node_cpu,
+            node_memory=args.node_memory,
+            coalesce=args.coalesce,
+        )
+        results.append(simulator.run(pipelines, ides))
+
+    print_report(results)
+
+    if args.output:
+        report = {
+            "backend":   db.engine.dialect.name,
+            "timestamp": str(datetime.now()),
+            "arguments": {key: str(value) for key, value in vars(args).items()},
+            "results":   results,
+        }
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -11,10 +11,13 @@ from anubis.models import (
     AssignmentQuestion,
     AssignmentRepo,
     AssignmentTest,
+    AutogradeSnapshot,
+    BestSubmission,
     Course,
     InCourse,
     LateException,
     LectureNotes,
+    PipelineProfile,
     ProfessorForCourse,
     StaticFile,
     Submission,
@@ -42,6 +45,9 @@ def clear_database():
     AssignedQuestionResponse.query.delete()
     AssignedStudentQuestion.query.delete()
     AssignmentQuestion.query.delete()
+    AutogradeSnapshot.query.delete()
+    BestSubmission.query.delete()
+    PipelineProfile.query.delete()
     SubmissionTestResult.query.delete()
     SubmissionBuild.query.delete()
     Submission.query.delete()
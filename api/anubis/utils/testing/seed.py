@@ -86,6 +86,7 @@ def create_assignment(
     do_submissions=True,
     do_repos=False,
     submission_count=30,
+    test_count=None,
     **kwargs,
 ):
     logger.info(f'creating {course.name} assignment {i}')
@@ -128,8 +129,11 @@ def create_assignment(
         )
         db.session.add(assignment_question)
 
+    if test_count is None:
+        test_count = random.randint(3, 5)
+
     tests = []
-    for i in range(random.randint(3, 5)):
+    for i in range(test_count):
         tests.append(AssignmentTest(id=default_id_factory(), name=f"test {i}", assignment_id=assignment.id))
 
     submissions = []
@@ -2,10 +2,21 @@ from typing import Any
 
 import numpy as np
 import pandas as pd
+from sqlalchemy import func
 
 from anubis.lms.assignments import get_assignment_tests
-from anubis.lms.autograde import bulk_autograde
-from anubis.models import Assignment, AssignmentTest, Submission, TheiaSession, User, db
+from anubis.lms.autograde import get_assignment_best_submission_ids
+from anubis.models import (
+    Assignment,
+    AssignmentTest,
+    BestSubmission,
+    InCourse,
+    Submission,
+    SubmissionTestResult,
+    TheiaSession,
+    User,
+    db,
+)
 from anubis.utils.cache import cache
 from anubis.utils.data import is_debug, is_job
 from anubis.utils.visuals.queries import (
@@ -201,7 +212,7 @@ def get_assignment_history(assignment_id, netid):
     }
 
 
-@cache.memoize(timeout=-1, source_check=True, forced_update=is_job)
+@cache.memoize(timeout=60, source_check=True, forced_update=is_job)
 def get_assignment_sundial(assignment_id):
     """
     Get the sundial data for a specific assignment. The basic breakdown of
@@ -252,53 +263,50 @@ def get_assignment_sundial(assignment_id):
         ]
     }
 
-    # Get the autograde results for the entire assignment. This
-    # function call is cached.
-    autograde_results = bulk_autograde(assignment_id, offset=0, limit=300)
-
-    # Count the number of build and no submissions to
-    # insert into the name label.
-    build_passed = 0
-    build_failed = 0
-    no_submission = 0
-
-    # Go through all the autograde results
-    for result in autograde_results:
-
-        # If there was no submission, then increment no submission
-        if result["submission"] is None:
-            no_submission += 1
-            sundial["children"][2]["value"] += 1
-            continue
-
-        # If the build passed, go through the tests
-        if result["build_passed"]:
-            build_passed += 1
-
-            # set of tests passed names
-            tests_passed = set(result["tests_passed_names"])
-
-            for index in range(len(sundial["children"][0]["children"])):
-                # Get the test name
-                test_name = sundial["children"][0]["children"][index]["name"]
-
-                # If this student passed this test, then increment the tests passed value
-                if test_name in tests_passed:
-                    sundial["children"][0]["children"][index]["children"][0]["value"] += 1
-
-                # If this student failed this test, then increment the tests failed value
-                else:
-                    sundial["children"][0]["children"][index]["children"][1]["value"] += 1
-
-            continue
+    # Make sure the best submission table is populated for the assignment
+    get_assignment_best_submission_ids(assignment.id)
+
+    # Only count students that are in the course
+    student_ids = db.session.query(InCourse.owner_id).filter(InCourse.course_id == assignment.course_id)
+
+    # Count the number of students whose best submission passed the build,
+    # and the number whose best submission failed the build.
+    build_passed = BestSubmission.query.filter(
+        BestSubmission.assignment_id == assignment.id,
+        BestSubmission.owner_id.in_(student_ids),
+        BestSubmission.build_passed == True,
+    ).count()
+    build_failed = BestSubmission.query.filter(
+        BestSubmission.assignment_id == assignment.id,
+        BestSubmission.owner_id.in_(student_ids),
+        BestSubmission.build_passed == False,
+    ).count()
+    no_submission = max(student_ids.count() - build_passed - build_failed, 0)
+
+    # Count the passed tests for the best submissions that passed the build
+    tests_passed = dict(
+        db.session.query(AssignmentTest.name, func.count(SubmissionTestResult.id))
+        .join(SubmissionTestResult, SubmissionTestResult.assignment_test_id == AssignmentTest.id)
+        .join(BestSubmission, BestSubmission.submission_id == SubmissionTestResult.submission_id)
+        .filter(
+            BestSubmission.assignment_id == assignment.id,
+            BestSubmission.owner_id.in_(student_ids),
+            BestSubmission.build_passed == True,
+            SubmissionTestResult.passed == True,
+        )
+        .group_by(AssignmentTest.name)
+        .all()
+    )
 
-        # If the build failed, then skip the tests
-        if not result["build_passed"]:
-            # If the student failed the build, then we increment the failed build value
-            build_failed += 1
-            sundial["children"][1]["value"] += 1
+    # Fill in the passed and failed values for each test. Students with a
+    # passing build that did not pass a test are counted as failed.
+    for test in sundial["children"][0]["children"]:
+        passed_value = tests_passed.get(test["name"], 0)
+        test["children"][0]["value"] = passed_value
+        test["children"][1]["value"] = build_passed - passed_value
 
-            continue
+    sundial["children"][1]["value"] = build_failed
+    sundial["children"][2]["value"] = no_submission
 
     # Update the title for the high level names
     sundial["children"][0]["name"] = f"{build_passed} builds passed"
@@ -7,13 +7,20 @@ from flask import Blueprint
 from sqlalchemy.exc import DataError, IntegrityError
 
 from anubis.github.repos import delete_assignment_repo
-from anubis.lms.assignments import assignment_sync, delete_assignment, delete_assignment_repos
+from anubis.lms.assignments import (
+    assignment_sync,
+    delete_assignment,
+    delete_assignment_repos,
+    get_assignment_test_catalog,
+)
 from anubis.lms.courses import assert_course_context, course_context, is_course_superuser
+from anubis.lms.pipeline_resources import validate_pipeline_resources
 from anubis.lms.questions import get_assigned_questions
 from anubis.models import Assignment, AssignmentRepo, AssignmentTest, SubmissionTestResult, User, db
 from anubis.rpc.enqueue import enqueue_make_shared_assignment
 from anubis.utils.auth.http import require_admin
 from anubis.utils.auth.user import current_user
+from anubis.utils.cache import cache
 from anubis.utils.data import rand, req_assert, row2dict
 from anubis.utils.http import error_response, success_response
 from anubis.utils.http.decorators import json_endpoint, json_response, load_from_id
@@ -293,6 +300,9 @@ def admin_assignment_tests_toggle_hide_assignment_test_id(assignment_test_id: st
     # Commit the change
     db.session.commit()
 
+    # Clear the cached test catalog
+    cache.delete_memoized(get_assignment_test_catalog, assignment_test.assignment_id)
+
     return success_response({"status": "test updated", "assignment_test": assignment_test.data})
 
 
@@ -319,8 +329,9 @@ def admin_assignment_tests_delete_assignment_test_id(assignment_test_id: str):
     # the course context match
     assert_course_context(assignment_test)
 
-    # Save the test name so we can use it in the response
+    # Save the test name and assignment so we can use them after the delete
     test_name = assignment_test.name
+    assignment_id = assignment_test.assignment_id
 
     # Delete all the submission test results that are pointing to
     # this test
@@ -336,6 +347,9 @@ def admin_assignment_tests_delete_assignment_test_id(assignment_test_id: str):
     # Commit the changes
     db.session.commit()
 
+    # Clear the cached test catalog
+    cache.delete_memoized(get_assignment_test_catalog, assignment_id)
+
     # Pass back the status
     return success_response(
         {
@@ -420,6 +434,10 @@ def admin_assignments_save(assignment: dict):
         if key == "theia_image_id":
             continue
 
+        # Pipeline resources should look like k8s resource requirements
+        if key == "pipeline_resources":
+            req_assert(validate_pipeline_resources(value), message="invalid pipeline resources")
+
         setattr(db_assignment, key, value)
 
     # Attempt to commit
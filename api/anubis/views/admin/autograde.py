@@ -1,8 +1,19 @@
 from flask import Blueprint, request
 from sqlalchemy.sql import or_
 
-from anubis.lms.autograde import autograde, autograde_submission_result_wrapper, bulk_autograde
+from anubis.lms.autograde import (
+    autograde,
+    autograde_submission_result_wrapper,
+    bulk_autograde,
+    clear_bulk_autograde_cache,
+    get_autograde_export,
+    get_bulk_autograde_cache_size,
+    get_bulk_autograde_progress,
+)
 from anubis.lms.courses import assert_course_context
+from anubis.lms.pipeline_logs import get_pipeline_log_tail
+from anubis.lms.pipeline_resources import get_pipeline_resource_profile, get_pipeline_resources
+from anubis.lms.snapshots import SNAPSHOT_DEADLINES, get_autograde_snapshot
 from anubis.lms.questions import get_assigned_questions
 from anubis.models import Assignment, InCourse, Submission, User
 from anubis.utils.auth.http import require_admin
@@ -40,7 +51,7 @@ def admin_autograde_cache_reset(assignment_id: str):
     # Verify that the current course context, and the assignment course match
     assert_course_context(assignment)
 
-    cache.delete_memoized(bulk_autograde)
+    clear_bulk_autograde_cache(assignment.id)
     cache.delete_memoized(autograde)
     cache.delete_memoized(get_assignment_history)
     cache.delete_memoized(get_admin_assignment_visual_data)
@@ -49,6 +60,30 @@ def admin_autograde_cache_reset(assignment_id: str):
     return success_response({"message": "success"})
 
 
+@autograde_.route("/cache-size/<string:assignment_id>")
+@require_admin()
+@json_response
+def admin_autograde_cache_size(assignment_id: str):
+    """
+    Report the size of the cached autograde results for an assignment,
+    compared to what caching the full submission data for every student
+    would take.
+
+    :param assignment_id:
+    :return:
+    """
+    # Pull the assignment object
+    assignment = Assignment.query.filter(Assignment.id == assignment_id).first()
+
+    # Verify that we got an assignment
+    req_assert(assignment is not None, message="assignment does not exist")
+
+    # Verify that the current course context, and the assignment course match
+    assert_course_context(assignment)
+
+    return success_response({"size": get_bulk_autograde_cache_size(assignment.id)})
+
+
 @autograde_.get("/run/<string:assignment_id>")
 @require_admin()
 @json_response
@@ -76,6 +111,30 @@ def admin_autograde_run_assignment_id(assignment_id: str):
     })
 
 
+@autograde_.get("/progress/<string:assignment_id>")
+@require_admin()
+@json_response
+def admin_autograde_progress_assignment_id(assignment_id: str):
+    """
+    Get the shard progress of the most recent bulk autograde
+    run for an assignment.
+
+    :param assignment_id:
+    :return:
+    """
+
+    # Pull the assignment object
+    assignment = Assignment.query.filter(Assignment.id == assignment_id).first()
+
+    # Verify that we got an assignment
+    req_assert(assignment is not None, message="assignment does not exist")
+
+    # Verify that the current course context, and the assignment course match
+    assert_course_context(assignment)
+
+    return success_response({"progress": get_bulk_autograde_progress(assignment.id)})
+
+
 @autograde_.route("/assignment/<string:assignment_id>")
 @require_admin()
 @json_response
@@ -119,6 +178,119 @@ def admin_autograde_assignment_assignment_id(assignment_id):
     return success_response({"stats": bests, "total": total})
 
 
+@autograde_.route("/export/<string:assignment_id>")
+@require_admin()
+@json_response
+def admin_autograde_export_assignment_id(assignment_id: str):
+    """
+    Get the full autograde results for an assignment, for the autograde
+    data export. Unlike the assignment stats, these have the submission
+    data and github links of each best submission.
+
+    :param assignment_id:
+    :return:
+    """
+
+    # Pull the assignment object
+    assignment = Assignment.query.filter(Assignment.id == assignment_id).first()
+
+    # Verify that we got an assignment
+    req_assert(assignment is not None, message="assignment does not exist")
+
+    # Verify that the current course context, and the assignment course match
+    assert_course_context(assignment)
+
+    return success_response({"stats": get_autograde_export(assignment)})
+
+
+@autograde_.route("/snapshot/<string:assignment_id>/<string:deadline>")
+@require_admin()
+@json_response
+def admin_autograde_snapshot_assignment_id(assignment_id: str, deadline: str):
+    """
+    Get the autograde results for an assignment as they were frozen
+    at the due or grace deadline.
+
+    :param assignment_id:
+    :param deadline: "due" or "grace"
+    :return:
+    """
+
+    # Verify the deadline
+    req_assert(deadline in SNAPSHOT_DEADLINES, message="deadline must be due or grace")
+
+    # Pull the assignment object
+    assignment = Assignment.query.filter(Assignment.id == assignment_id).first()
+
+    # Verify that we got an assignment
+    req_assert(assignment is not None, message="assignment does not exist")
+
+    # Verify that the current course context, and the assignment course match
+    assert_course_context(assignment)
+
+    # Pass back the frozen results
+    stats = get_autograde_snapshot(assignment.id, deadline)
+    return success_response({"stats": stats, "total": len(stats), "deadline": deadline})
+
+
+@autograde_.route("/pipeline-log/<string:submission_id>")
+@require_admin()
+@json_response
+def admin_autograde_pipeline_log_submission_id(submission_id: str):
+    """
+    Get the tail of the pipeline log for a submission. While the
+    pipeline is running this is the log captured so far.
+
+    :param submission_id:
+    :return:
+    """
+
+    lines = request.args.get("lines", default=200, type=int)
+
+    # Pull the submission
+    submission = Submission.query.filter(Submission.id == submission_id).first()
+
+    # Verify that we got a submission
+    req_assert(submission is not None, message="submission does not exist")
+
+    # Verify that the current course context, and the submission course match
+    assert_course_context(submission)
+
+    log, running = get_pipeline_log_tail(submission, lines=max(1, min(lines, 5000)))
+
+    return success_response({"log": log, "running": running, "processed": submission.processed})
+
+
+@autograde_.route("/pipeline-resources/<string:assignment_id>")
+@require_admin()
+@json_response
+def admin_autograde_pipeline_resources(assignment_id: str):
+    """
+    Get the resource usage profile of recent pipelines for an assignment,
+    and the resources its pipelines are created with.
+
+    :param assignment_id:
+    :return:
+    """
+
+    # Get the assignment
+    assignment = Assignment.query.filter(Assignment.id == assignment_id).first()
+
+    # Verify that we got an assignment
+    req_assert(assignment is not None, message="assignment does not exist")
+
+    # Verify that the current course context, and the assignment course match
+    assert_course_context(assignment)
+
+    return success_response(
+        {
+            "profile":   get_pipeline_resource_profile(assignment.id, assignment.pipeline_image),
+            "override":  assignment.pipeline_resources,
+            "resources": get_pipeline_resources(assignment),
+        }
+    )
+
+
 @autograde_.route("/for/<assignment_id>/<user_id>")
 @require_admin()
 @json_response
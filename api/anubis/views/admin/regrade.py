@@ -3,7 +3,8 @@ import math
 from flask import Blueprint
 from sqlalchemy import or_
 
-from anubis.lms.autograde import autograde, bulk_autograde
+from anubis.k8s.pipeline.admission import PIPELINE_PRIORITY_REGRADE
+from anubis.lms.autograde import autograde, clear_bulk_autograde_cache
 from anubis.lms.courses import assert_course_context
 from anubis.lms.submissions import bulk_regrade_submissions
 from anubis.lms.submissions import init_submission
@@ -84,11 +85,14 @@ def admin_regrade_submission_commit(commit: str):
     # Assert that the submission is within the current course context
     assert_course_context(submission)
 
+    # Skip the pipeline result cache with ?cache=0
+    use_cache = get_number_arg("cache", default_value=1) == 1
+
     # Reset submission in database
     init_submission(submission)
 
     # Enqueue the submission pipeline
-    enqueue_autograde_pipeline(submission.id)
+    enqueue_autograde_pipeline(submission.id, priority=PIPELINE_PRIORITY_REGRADE, use_cache=use_cache)
 
     # Return status
     return success_response({"submission": submission.data, "user": submission.owner.data})
@@ -127,6 +131,9 @@ def private_regrade_student_assignment_netid(assignment_id: str, netid: str):
         Submission.owner_id == student.id,
     ).all()
 
+    # Skip the pipeline result cache with ?cache=0
+    use_cache = get_number_arg("cache", default_value=1) == 1
+
     # Get a count of submissions for the response
     submission_count = len(submissions)
 
@@ -136,10 +143,10 @@ def private_regrade_student_assignment_netid(assignment_id: str, netid: str):
 
     # Enqueue each chunk as a job for the rpc workers
     for chunk in submission_chunks:
-        rpc_enqueue(bulk_regrade_submissions, "regrade", args=[chunk])
+        rpc_enqueue(bulk_regrade_submissions, "regrade", args=[chunk, use_cache])
 
     # Clear cache of autograde results
-    cache.delete_memoized(bulk_autograde, assignment.id)
+    clear_bulk_autograde_cache(assignment.id)
     cache.delete_memoized(autograde, student.id, assignment.id)
 
     return success_response(
@@ -180,6 +187,7 @@ def private_regrade_assignment(assignment_id):
     processed = get_number_arg("processed", default_value=-1)
     reaped = get_number_arg("reaped", default_value=-1)
     latest_only = get_number_arg("latest_only", default_value=-1)
+    use_cache = get_number_arg("cache", default_value=1) == 1
 
     # Find the assignment
     assignment = Assignment.query.filter(or_(Assignment.id == assignment_id, Assignment.name == assignment_id)).first()
@@ -191,7 +199,9 @@ def private_regrade_assignment(assignment_id):
     assert_course_context(assignment)
 
     # Enqueue assignment regrade for rpc worker
-    enqueue_bulk_regrade_assignment(assignment.id, hours, not_processed, processed, reaped, latest_only)
+    enqueue_bulk_regrade_assignment(
+        assignment.id, hours, not_processed, processed, reaped, latest_only, use_cache
+    )
 
     # Pass back the enqueued status
     return success_response(
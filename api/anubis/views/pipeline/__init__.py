@@ -1,8 +1,20 @@
 def register_pipeline_views(app):
-    from anubis.views.pipeline.pipeline import pipeline
+    from anubis.env import env
+    from anubis.utils.redis import redis
+
+    # In ingest mode the report endpoints queue reports in
+    # redis instead of writing them to the database.
+    if env.PIPELINE_INGEST and redis is not None:
+        from anubis.views.pipeline.ingest import ingest as pipeline
+    else:
+        from anubis.views.pipeline.pipeline import pipeline
+
+    # Warm pool pipelines claim their work here
+    from anubis.views.pipeline.pool import pool
 
     views = [
         pipeline,
+        pool,
     ]
 
     for view in views:
@@ -0,0 +1,160 @@
+from flask import Blueprint, request
+
+from anubis.lms.pipeline import assert_batch_report
+from anubis.lms.pipeline_ingest import enqueue_pipeline_report
+from anubis.utils.http import success_response
+from anubis.utils.http.decorators import json_endpoint, json_response
+from anubis.utils.logging import logger
+from anubis.utils.pipeline.decorators import check_submission_token_cached
+
+# The ingest blueprint serves the same report endpoints as the pipeline
+# blueprint. Reports are validated and appended to the ingest stream,
+# then applied to the database by the pipeline ingest job.
+ingest = Blueprint("pipeline-ingest", __name__, url_prefix="/pipeline")
+
+
+def _enqueue(kind: str, submission_id: str, payload: dict):
+    """
+    Append a report to the ingest stream. Pipelines can send an
+    Idempotency-Key header so that retried reports are only
+    applied once.
+
+    :param kind:
+    :param submission_id:
+    :param payload:
+    :return:
+    """
+    enqueue_pipeline_report(
+        kind,
+        submission_id,
+        payload,
+        key=request.headers.get("Idempotency-Key", default=None),
+    )
+
+
+@ingest.route("/report/panic/<string:submission_id>", methods=["POST"])
+@check_submission_token_cached
+@json_response
+def ingest_report_panic(submission_id: str):
+    """
+    Queue a panic report. See pipeline_report_panic.
+
+    :param submission_id:
+    :return:
+    """
+
+    logger.error("submission panic reported", extra={"type": "panic_report", "submission_id": submission_id})
+
+    _enqueue("panic", submission_id, {"report": request.json})
+
+    return success_response("Panic successfully reported")
+
+
+@ingest.route("/report/build/<string:submission_id>", methods=["POST"])
+@check_submission_token_cached
+@json_endpoint([("stdout", str), ("passed", bool)])
+def ingest_report_build(submission_id: str, stdout: str, passed: bool, **_):
+    """
+    Queue a build report. See pipeline_report_build.
+
+    :param submission_id:
+    :param stdout:
+    :param passed:
+    :return:
+    """
+
+    _enqueue("build", submission_id, {"stdout": stdout, "passed": passed})
+
+    return success_response("Build successfully reported.")
+
+
+@ingest.route("/report/test/<string:submission_id>", methods=["POST"])
+@check_submission_token_cached
+@json_endpoint([("test_name", str), ("passed", bool), ("message", str), ('output_type', str), ("output", str)])
+def ingest_report_test(submission_id: str, test_name: str, passed: bool, message: str, output_type: str,
+                       output: str, **_):
+    """
+    Queue a test report. See pipeline_report_test. The test name
+    is checked when the report is applied.
+
+    :param submission_id:
+    :param test_name:
+    :param passed:
+    :param message:
+    :param output_type:
+    :param output:
+    :return:
+    """
+
+    _enqueue(
+        "test",
+        submission_id,
+        {
+            "test_name":   test_name,
+            "passed":      passed,
+            "message":     message,
+            "output_type": output_type,
+            "output":      output,
+        },
+    )
+
+    return success_response("Test data successfully added.")
+
+
+@ingest.route("/report/state/<string:submission_id>", methods=["POST"])
+@check_submission_token_cached
+@json_endpoint(required_fields=[("state", str)])
+def ingest_report_state(submission_id: str, state: str, **_):
+    """
+    Queue a state report. See pipeline_report_state.
+
+    :param submission_id:
+    :param state:
+    :return:
+    """
+
+    # Get the processed option if it was specified
+    processed = request.args.get("processed", default="0") != "0"
+
+    # If processed was specified and is of type bool, then use that instead
+    if "processed" in request.json and isinstance(request.json["processed"], bool):
+        processed = request.json["processed"]
+
+    _enqueue("state", submission_id, {"state": state, "processed": processed})
+
+    return success_response("State successfully updated.")
+
+
+@ingest.route("/report/batch/<string:submission_id>", methods=["POST"])
+@check_submission_token_cached
+@json_endpoint(required_fields=[("tests", list)])
+def ingest_report_batch(submission_id: str, tests: list, **kwargs):
+    """
+    Queue a batch report. See pipeline_report_batch. Invalid test
+    names are logged when the batch is applied instead of being
+    returned.
+
+    :param submission_id:
+    :param tests:
+    :return:
+    """
+
+    build = kwargs.get("build", None)
+    states = kwargs.get("states", [])
+    processed = kwargs.get("processed", None)
+
+    # Verify the optional fields
+    assert_batch_report(tests, build=build, states=states, processed=processed)
+
+    _enqueue(
+        "batch",
+        submission_id,
+        {
+            "tests":     tests,
+            "build":     build,
+            "states":    states,
+            "processed": processed,
+        },
+    )
+
+    return success_response({"status": "Batch successfully reported.", "invalid_test_names": []})
@@ -1,10 +1,18 @@
 import json
 
 from flask import Blueprint, request
-from parse import parse
 
-from anubis.models import AssignmentTest, Submission, SubmissionTestResult, db
-from anubis.utils.data import MYSQL_TEXT_MAX_LENGTH
+from anubis.lms.autograde import update_best_submission
+from anubis.lms.pipeline import (
+    apply_batch_report,
+    apply_build_report,
+    apply_panic_report,
+    apply_state_report,
+    apply_test_report,
+    assert_batch_report,
+)
+from anubis.models import Submission, db
+from anubis.utils.data import MYSQL_TEXT_MAX_LENGTH, req_assert
 from anubis.utils.http import success_response
 from anubis.utils.http.decorators import json_endpoint, json_response
 from anubis.utils.logging import logger
@@ -52,6 +60,9 @@ def pipeline_report_panic(submission: Submission):
     submission.state = "Whoops! There was an error on our end. The error has been logged."
     submission.errors = {"panic": request.json}
 
+    # Update the best submission for the student
+    update_best_submission(submission.owner_id, submission.assignment_id)
+
     # commit the changes to the session
     db.session.add(submission)
     db.session.commit()
@@ -77,10 +88,8 @@ def pipeline_report_build(submission: Submission, stdout: str, passed: bool, **_
     :return:
     """
 
-    if len(stdout) > MYSQL_TEXT_MAX_LENGTH:
-        stdout = stdout[:MYSQL_TEXT_MAX_LENGTH]
-
-    # Log the build being reported
+    # Log the build being reported. Only the start of the stdout is
+    # logged, as the whole of it is stored on the build.
     logger.info(
         "submission build reported",
         extra={
@@ -89,23 +98,20 @@ def pipeline_report_build(submission: Submission, stdout: str, passed: bool, **_
             "assignment_id": submission.assignment_id,
             "owner_id": submission.owner_id,
             "passed": passed,
-            "stdout": stdout,
+            "stdout": stdout[:MYSQL_TEXT_MAX_LENGTH],
+            "stdout_length": len(stdout),
         },
     )
 
     # Update submission build
-    submission.build.stdout = stdout
-    submission.build.passed = passed
+    apply_build_report(submission, stdout, passed)
 
-    # If the build did not passed, then the
-    # submission pipeline is done
-    if passed is False:
-        submission.processed = True
-        submission.state = "Build did not succeed"
+    # Update the best submission for the student. Submissions
+    # only become candidates once they are processed.
+    if submission.processed:
+        update_best_submission(submission.owner_id, submission.assignment_id)
 
-    # Add and commit
-    db.session.add(submission)
-    db.session.add(submission.build)
+    # Commit
     db.session.commit()
 
     # Report success
@@ -140,10 +146,8 @@ def pipeline_report_test(submission: Submission, test_name: str, passed: bool, m
     :return:
     """
 
-    if len(output) > MYSQL_TEXT_MAX_LENGTH:
-        output = output[:MYSQL_TEXT_MAX_LENGTH]
-
-    # Log the build
+    # Log the test result. Only the start of the output is
+    # logged, as the whole of it is stored on the test result.
     logger.info(
         "submission test reported",
         extra={
@@ -155,32 +159,25 @@ def pipeline_report_test(submission: Submission, test_name: str, passed: bool, m
             "test_message": message,
             "passed": passed,
             "output_type": output_type,
-            "output": output,
+            "output": output[:MYSQL_TEXT_MAX_LENGTH],
+            "output_length": len(output),
         },
     )
 
-    submission_test_result: SubmissionTestResult | None = None
-
-    # Look for corresponding submission_test_result based on given name
-    for result in submission.test_results:
-        # Compare name
-        if result.assignment_test.name == test_name:
-            submission_test_result = result
-            break
+    # Update the matching test result
+    valid_test = apply_test_report(submission, test_name, passed, message, output_type, output)
 
     # Verify we got a match
-    if submission_test_result is None:
+    if not valid_test:
         logger.error("Invalid submission test result reported", extra={"request": request.json})
         return success_response({"status": "invalid test name"})
 
-    # Update the fields
-    submission_test_result.passed = passed
-    submission_test_result.message = message
-    submission_test_result.output_type = output_type
-    submission_test_result.output = output
+    # Update the best submission for the student. Submissions
+    # only become candidates once they are processed.
+    if submission.processed:
+        update_best_submission(submission.owner_id, submission.assignment_id)
 
-    # Add and commit
-    db.session.add(submission_test_result)
+    # Commit
     db.session.commit()
 
     return success_response("Test data successfully added.")
@@ -221,50 +218,95 @@ def pipeline_report_state(submission: Submission, state: str, **kwargs):
     )
 
     # Get the processed option if it was specified
-    processed = request.args.get("processed", default="0")
-
-    # set the processed field if it was specified
-    submission.processed = processed != "0"
-
-    # Figure out if the test is hidden
-    # We do this by checking the state that was given,
-    # to read the name of the test. If the assignment
-    # test that was found is marked as hidden, then
-    # we should not update the state of the submission
-    # model.
-    #
-    # If we were to update the state of the submission
-    # when a hidden test is reported, then it would be
-    # visible to the students in the frontend.
-    hidden_test = False
-
-    # Do a basic match on the expected test
-    match = parse("Running test: {}", state)
-
-    # If we got a match
-    if match:
-        # Get the parsed assignment test name
-        test_name = match[0]
-
-        # Try to get the assignment test
-        assignment_test = AssignmentTest.query.filter(
-            AssignmentTest.assignment_id == submission.assignment_id,
-            AssignmentTest.name == test_name,
-        ).first()
-
-        # set hidden_test to True if the test exists, and if it is marked as hidden
-        hidden_test = assignment_test is not None and assignment_test.hidden
-
-    # Update state field if the state report is not for a hidden test
-    if not hidden_test:
-        submission.state = state
-
-    # If processed was specified and is of type bool, then update that too
+    processed = request.args.get("processed", default="0") != "0"
+
+    # If processed was specified and is of type bool, then use that instead
     if "processed" in request.json and isinstance(request.json["processed"], bool):
-        submission.processed = request.json["processed"]
+        processed = request.json["processed"]
 
-    # Add and commit
-    db.session.add(submission)
+    # Update the state. States for hidden tests are not written
+    # to the submission.
+    apply_state_report(submission, state, processed=processed)
+
+    # Once the submission is processed it can be considered for
+    # the best submission for the student
+    if submission.processed:
+        update_best_submission(submission.owner_id, submission.assignment_id)
+
+    # Commit
     db.session.commit()
 
     return success_response("State successfully updated.")
+
+
+@pipeline.route("/report/batch/<string:submission_id>", methods=["POST"])
+@check_submission_token
+@json_endpoint(required_fields=[("tests", list)])
+def pipeline_report_batch(submission: Submission, tests: list, **kwargs):
+    """
+    Submission pipelines can report everything about a submission in
+    one request instead of hitting the build, test and state endpoints
+    separately. Everything is applied in a single transaction. The build
+    is applied first, then the tests, then the states in order, then
+    the processed flag.
+
+    POSTed json should be of the shape:
+
+    {
+      "build": {"stdout": "build logs...", "passed": True},  # optional
+      "tests": [
+        {
+          "test_name": "name of the test",
+          "passed": True,
+          "message": "This test worked",
+          "output_type": "diff",
+          "output": "--- \n\n+++ \n\n@@ -1,3 +1,3 @@\n\n a\n-c\n+b\n d"
+        }
+      ],
+      "states": ["Running test: name of the test", "Tests completed"],  # optional
+      "processed": True  # optional
+    }
+
+    :param submission:
+    :param tests:
+    :return:
+    """
+
+    build = kwargs.get("build", None)
+    states = kwargs.get("states", [])
+    processed = kwargs.get("processed", None)
+
+    # Verify the optional fields
+    assert_batch_report(tests, build=build, states=states, processed=processed)
+
+    # Log a summary of the batch. The build and test output
+    # are not logged in full here.
+    logger.info(
+        "submission batch reported",
+        extra={
+            "type": "batch_report",
+            "submission_id": submission.id,
+            "assignment_id": submission.assignment_id,
+            "owner_id": submission.owner_id,
+            "build_passed": build["passed"] if build is not None else None,
+            "tests": [{"test_name": test["test_name"], "passed": test["passed"]} for test in tests],
+            "states": states,
+            "processed": processed,
+        },
+    )
+
+    # Apply the build, tests and states
+    invalid_test_names = apply_batch_report(submission, tests, build=build, states=states, processed=processed)
+
+    if len(invalid_test_names) > 0:
+        logger.error("Invalid submission test results reported", extra={"test_names": invalid_test_names})
+
+    # Once the submission is processed it can be considered for
+    # the best submission for the student
+    if submission.processed:
+        update_best_submission(submission.owner_id, submission.assignment_id)
+
+    # Commit everything at once
+    db.session.commit()
+
+    return success_response({"status": "Batch successfully reported.", "invalid_test_names": invalid_test_names})
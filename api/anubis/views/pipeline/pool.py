@@ -0,0 +1,59 @@
+from flask import Blueprint, request
+
+from anubis.lms.pipeline_pool import claim_pipeline_work
+from anubis.utils.http import error_response, success_response
+from anubis.utils.http.decorators import json_response
+from anubis.utils.logging import logger
+
+pool = Blueprint("pipeline-pool", __name__, url_prefix="/pipeline/pool")
+
+
+@pool.route("/claim/<string:job_name>", methods=["POST"])
+@json_response
+def pipeline_pool_claim(job_name: str):
+    """
+    Warm pool pipelines hit this endpoint while they are idle, to
+    claim the next submission offered to their pool. The token is
+    the one the pool job was started with.
+
+    The response data is null if there is no work yet, otherwise:
+
+    {
+      "submission_id": "...",
+      "token": "submission token to report with",
+      "netid": "...",
+      "commit": "...",
+      "repo": "https://github.com/..."
+    }
+
+    :param job_name:
+    :return:
+    """
+
+    # Try to get a token from the request query
+    token = request.args.get("token", default=None)
+    if token is None:
+        return error_response("Invalid"), 406
+
+    submission = claim_pipeline_work(job_name, token)
+    if submission is None:
+        return success_response(None)
+
+    logger.info(
+        "pipeline pool claim",
+        extra={
+            "type":          "pool_claim",
+            "submission_id": submission.id,
+            "job_name":      job_name,
+        },
+    )
+
+    return success_response(
+        {
+            "submission_id": submission.id,
+            "token":         submission.token,
+            "netid":         submission.owner.netid,
+            "commit":        submission.commit,
+            "repo":          submission.repo.repo_url,
+        }
+    )
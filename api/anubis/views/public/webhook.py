@@ -3,6 +3,7 @@ from typing import Union
 
 from flask import Blueprint, request
 
+from anubis.k8s.pipeline.admission import PIPELINE_PRIORITY_PUSH, PIPELINE_PUSH_QUEUE
 from anubis.lms.assignments import get_assignment_due_date
 from anubis.lms.submissions import get_submissions, init_submission, reject_late_submission
 from anubis.lms.webhook import check_repo, guess_github_repo_owner, parse_webhook
@@ -148,6 +149,7 @@ def public_webhook():
             repo=repo,
             owner=user,
             commit=commit,
+            tree_hash=(request.json.get("head_commit") or {}).get("tree_id", None),
             state="Waiting for resources...",
         )
         db.session.add(submission)
@@ -181,7 +183,7 @@ def public_webhook():
 
     # If the submission was accepted, then enqueue the job
     if submission.accepted and user is not None:
-        enqueue_autograde_pipeline(submission.id)
+        enqueue_autograde_pipeline(submission.id, queue=PIPELINE_PUSH_QUEUE, priority=PIPELINE_PRIORITY_PUSH)
 
     # Delete cached submissions
     cache.delete_memoized(get_submissions, user.netid)
@@ -4,6 +4,7 @@ def register_super_views(app):
     from anubis.views.super.playgrounds import playgrounds_
     from anubis.views.super.students import students_
     from anubis.views.super.email import email_
+    from anubis.views.super.pipeline import pipeline_
 
     views = [
         ide_,
@@ -11,6 +12,7 @@ def register_super_views(app):
         playgrounds_,
         students_,
         email_,
+        pipeline_,
     ]
 
     for view in views:
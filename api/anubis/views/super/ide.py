@@ -1,5 +1,6 @@
 from flask import Blueprint
 
+from anubis.lms.theia_pool import get_theia_pool_stats
 from anubis.models import db, TheiaImage, TheiaImageTag
 from anubis.utils.auth.http import require_superuser
 from anubis.utils.http import success_response
@@ -17,6 +18,18 @@ def super_ide_images_list():
     return success_response({"images": [image.data for image in images]})
 
 
+@ide_.get("/pool")
+@require_superuser()
+@json_response
+def super_ide_pool():
+    """
+    Get the size and idle pods of each warm IDE pool.
+
+    :return:
+    """
+    return success_response({"pool": get_theia_pool_stats()})
+
+
 @ide_.post("/images/save")
 @require_superuser()
 @json_endpoint([("images", list)])
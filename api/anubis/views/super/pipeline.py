@@ -0,0 +1,48 @@
+from flask import Blueprint
+
+from anubis.k8s.pipeline.admission import get_pipeline_admission_stats
+from anubis.lms.pipeline_ingest import get_pipeline_ingest_lag
+from anubis.lms.pipeline_pool import get_pipeline_pool_stats
+from anubis.utils.auth.http import require_superuser
+from anubis.utils.http import success_response
+from anubis.utils.http.decorators import json_response
+
+pipeline_ = Blueprint("super-pipeline", __name__, url_prefix="/super/pipeline")
+
+
+@pipeline_.get("/ingest/lag")
+@require_superuser()
+@json_response
+def super_pipeline_ingest_lag():
+    """
+    Get how far behind the pipeline report ingest consumer is.
+
+    :return:
+    """
+    return success_response({"lag": get_pipeline_ingest_lag()})
+
+
+@pipeline_.get("/admission")
+@require_superuser()
+@json_response
+def super_pipeline_admission():
+    """
+    Get how many pipelines are running and waiting for a slot, and
+    how long recent pipelines waited.
+
+    :return:
+    """
+    return success_response({"admission": get_pipeline_admission_stats()})
+
+
+@pipeline_.get("/pool")
+@require_superuser()
+@json_response
+def super_pipeline_pool():
+    """
+    Get the warm pool size, idle pool jobs and unclaimed offers
+    of each pooled assignment.
+
+    :return:
+    """
+    return success_response({"pool": get_pipeline_pool_stats()})
@@ -1,11 +1,31 @@
-from utils import Session, get_student_id, permission_test
+from utils import get_student_id, permission_test, with_context
+
+
+@with_context
+def get_assignment_submission():
+    from anubis.models import Assignment, Course, Submission
+
+    # Not every assignment has submissions, so start from a submission
+    # in the course the test sessions are in.
+    submission = (
+        Submission.query.join(Assignment)
+        .join(Course)
+        .filter(Course.name == "Intro to OS", Submission.processed == True)
+        .first()
+    )
+    return submission.assignment_id, submission.id
 
 
 def test_autograde_admin():
-    superuser = Session("superuser")
-    assignment_id = superuser.get("/admin/assignments/list")["assignments"][0]["id"]
+    assignment_id, submission_id = get_assignment_submission()
     student_id = get_student_id()
 
     permission_test(f"/admin/autograde/assignment/{assignment_id}")
+    permission_test(f"/admin/autograde/cache-size/{assignment_id}")
+    permission_test(f"/admin/autograde/export/{assignment_id}")
+    permission_test(f"/admin/autograde/progress/{assignment_id}")
     permission_test(f"/admin/autograde/for/{assignment_id}/{student_id}")
+    permission_test(f"/admin/autograde/snapshot/{assignment_id}/due")
+    permission_test(f"/admin/autograde/pipeline-log/{submission_id}")
+    permission_test(f"/admin/autograde/pipeline-resources/{assignment_id}")
     permission_test(f"/admin/autograde/submission/{assignment_id}/student")
@@ -0,0 +1,12 @@
+from utils import permission_test
+
+
+def test_ide_super():
+    permission_test(
+        "/super/ide/pool",
+        fail_for=[
+            "student",
+            "professor",
+            "ta",
+        ],
+    )
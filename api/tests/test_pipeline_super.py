@@ -0,0 +1,28 @@
+from utils import permission_test
+
+
+def test_pipeline_super():
+    permission_test(
+        "/super/pipeline/ingest/lag",
+        fail_for=[
+            "student",
+            "professor",
+            "ta",
+        ],
+    )
+    permission_test(
+        "/super/pipeline/admission",
+        fail_for=[
+            "student",
+            "professor",
+            "ta",
+        ],
+    )
+    permission_test(
+        "/super/pipeline/pool",
+        fail_for=[
+            "student",
+            "professor",
+            "ta",
+        ],
+    )
@@ -1,22 +1,43 @@
 #!/usr/bin/python3
 
 import os
+import shlex
 import string
 import subprocess
 import traceback
 
 from flask import Flask, Response, request, make_response
 
+from claim import claim_session
+
 NETID = os.environ.get('NETID', default=None)
 ADMIN = os.environ.get('ANUBIS_ADMIN', default=None) == 'ON'
+POOL = os.environ.get('ANUBIS_POOL', default=None) == 'ON'
 GIT_REPO = os.environ.get('GIT_REPO', default='')
 GIT_REPO_PATH = '/home/anubis/' + GIT_REPO.split('/')[-1]
 print(f'GIT_REPO = {GIT_REPO}')
 print(f'GIT_REPO_PATH = {GIT_REPO_PATH}')
 
+# Warm pool IDEs get their session env once they are claimed
+SESSION_ENV_PATH = '/home/theia/session.env'
+
 app = Flask(__name__)
 
 
+def load_session_env():
+    global NETID, GIT_REPO, GIT_REPO_PATH
+
+    if GIT_REPO != '' or not os.path.isfile(SESSION_ENV_PATH):
+        return
+
+    with open(SESSION_ENV_PATH) as f:
+        env = dict(shlex.split(line)[1].split('=', 1) for line in f if line.strip() != '')
+
+    NETID = env.get('NETID', None)
+    GIT_REPO = env.get('GIT_REPO', '')
+    GIT_REPO_PATH = '/home/anubis/' + GIT_REPO.split('/')[-1]
+
+
 def text_response(message: str, status_code: int = 200) -> Response:
     r = make_response(message + '\n')
     r.status_code = status_code
@@ -33,6 +54,8 @@ def relatively_safe_filename(filename: str) -> str:
 
 @app.route('/', methods=['POST'])
 def index():
+    load_session_env()
+
     # Get options from the form
     message: str = request.form.get('message', default='Anubis Cloud IDE Autosave').strip()
     push_only: bool = request.form.get('push_only', default='false').lower() == 'true'
@@ -102,6 +125,19 @@ def index():
     return text_response(output)
 
 
+if POOL:
+    @app.route('/pool/claim', methods=['POST'])
+    def pool_claim():
+        # The api posts the session env when it claims this pod, and
+        # routes the session to it once the repo is cloned.
+        env: dict = request.json
+        if not claim_session(env):
+            return text_response('Failed to claim pool IDE', 500)
+
+        load_session_env()
+        return text_response('Claimed')
+
+
 if ADMIN:
     @app.route('/clone', methods=['POST'])
     def clone():
@@ -13,6 +13,11 @@ fi
 
 set +e
 while true; do
+    # Warm pool IDEs get their session env once they are claimed
+    if [ -f /home/theia/session.env ]; then
+        . /home/theia/session.env
+    fi
+
     if [ "${AUTOSAVE}" = "ON" ] && [ -n "${GIT_CRED}" ]; then
         /autosave.sh
     fi
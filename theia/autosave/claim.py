@@ -0,0 +1,137 @@
+#!/usr/bin/python3
+
+# Warm pool handshake. Pool IDE pods are started before they belong to
+# a session. When one is claimed, the api posts the session env to the
+# autosave server, which clones the session repo and writes the env for
+# the autosave loop and server before it answers.
+#
+# The session env is also put in an annotation on the pod, which shows
+# up in the downward api volume. If the sidecar restarts, this picks
+# the session back up from there.
+
+import fcntl
+import json
+import os
+import shlex
+import subprocess
+import time
+
+ANNOTATIONS_PATH = '/etc/anubis/pool/annotations'
+SESSION_ANNOTATION = 'anubis/theia-session'
+
+# Read by the autosave loop and server. Kept out of the student home.
+SESSION_ENV_PATH = '/home/theia/session.env'
+
+# Can be sourced by shells in the IDE
+IDE_ENV_PATH = '/home/anubis/.anubis-session'
+
+# Held while a session is claimed, so the server and the annotation
+# watch do not both clone the repo
+CLAIM_LOCK_PATH = '/home/theia/claim.lock'
+
+
+def read_session_env() -> dict | None:
+    try:
+        with open(ANNOTATIONS_PATH) as f:
+            lines = f.readlines()
+    except OSError:
+        return None
+
+    # Annotations are written as key="quoted value", one per line
+    for line in lines:
+        key, _, value = line.strip().partition('=')
+        if key == SESSION_ANNOTATION:
+            return json.loads(json.loads(value))
+
+    return None
+
+
+def write_env(path: str, env: dict):
+    with open(path + '.tmp', 'w') as f:
+        for key, value in env.items():
+            f.write(f'export {key}={shlex.quote(value)}\n')
+    os.rename(path + '.tmp', path)
+
+
+def clone_repo(git_repo: str) -> bool:
+    repo_path = os.path.join('/home/anubis', git_repo.split('/')[-1])
+    if os.path.isdir(os.path.join(repo_path, '.git')):
+        return True
+
+    try:
+        r = subprocess.run(
+            ['git', '-c', 'core.hooksPath=/dev/null', '-c', 'alias.clone=clone', 'clone', git_repo],
+            cwd='/home/anubis',
+            timeout=60,
+        )
+    except subprocess.TimeoutExpired:
+        return False
+
+    return r.returncode == 0
+
+
+def read_env(path: str) -> dict:
+    with open(path) as f:
+        return dict(shlex.split(line)[1].split('=', 1) for line in f if line.strip() != '')
+
+
+def claim_session(env: dict) -> bool:
+    """
+    Clone the repo of the session this pod was claimed for, and write
+    the session env. Claiming the same session again does nothing.
+    A pod that was claimed by a different session refuses.
+
+    Returns True once the repo is cloned and the env written.
+    """
+    with open(CLAIM_LOCK_PATH, 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+
+        if os.path.isfile(SESSION_ENV_PATH):
+            claimed_session_id = read_env(SESSION_ENV_PATH).get('SESSION_ID', None)
+            if claimed_session_id != env['SESSION_ID']:
+                print(f'already claimed for session {claimed_session_id}, refusing {env["SESSION_ID"]}', flush=True)
+                return False
+            return True
+
+        print(f'claimed for session {env["SESSION_ID"]}', flush=True)
+
+        git_cred = os.environ.get('GIT_CRED', default='')
+        if git_cred != '' and not os.path.isfile('/home/theia/.git-credentials'):
+            with open('/home/theia/.git-credentials', 'w') as f:
+                f.write(git_cred + '\n')
+
+        if env['GIT_REPO'] != '' and not clone_repo(env['GIT_REPO']):
+            print(f'failed to clone {env["GIT_REPO"]}', flush=True)
+            return False
+
+        write_env(IDE_ENV_PATH, {
+            key: env[key]
+            for key in ('REPO_NAME', 'ANUBIS_ASSIGNMENT_NAME', 'COURSE_CODE')
+        })
+        write_env(SESSION_ENV_PATH, {
+            key: env[key]
+            for key in ('SESSION_ID', 'NETID', 'GIT_REPO', 'AUTOSAVE')
+        })
+
+    return True
+
+
+def main():
+    if os.environ.get('ANUBIS_POOL', default='OFF') != 'ON':
+        return
+
+    # Already claimed before a restart
+    if os.path.isfile(SESSION_ENV_PATH):
+        return
+
+    while (env := read_session_env()) is None:
+        # Claimed through the autosave server
+        if os.path.isfile(SESSION_ENV_PATH):
+            return
+        time.sleep(1)
+
+    claim_session(env)
+
+
+if __name__ == '__main__':
+    main()
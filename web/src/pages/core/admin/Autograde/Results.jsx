@@ -164,6 +164,22 @@ export default function Results() {
     history.push(`/error`);
   }
 
+  // The list view only has the compact summaries. The export
+  // pulls the full results, with the submission data and links.
+  const exportData = () => {
+    axios.get(`/api/admin/autograde/export/${assignmentId}`).then((response) => {
+      const data = standardStatusHandler(response, enqueueSnackbar);
+      if (data?.stats) {
+        downloadTextFile(
+          `anubis-autograde-${assignment?.course_id}-${assignment?.name}` +
+          `-${nonStupidDatetimeFormat(new Date())}.json`,
+          JSON.stringify(data.stats),
+          'application/json',
+        );
+      }
+    }).catch(standardErrorHandler(enqueueSnackbar));
+  };
+
   const clearCache = () => {
     axios.get(`/api/admin/autograde/cache-reset/${assignmentId}`).then((response) => {
       const data = standardStatusHandler(response, enqueueSnackbar);
@@ -233,12 +249,7 @@ export default function Results() {
               startIcon={<ArchiveIcon/>}
               color={'primary'}
               variant={'contained'}
-              onClick={() => downloadTextFile(
-                `anubis-autograde-${assignment?.course_id}-${assignment?.name}` +
-                `-${nonStupidDatetimeFormat(new Date())}.json`,
-                JSON.stringify(stats),
-                'application/json',
-              )}
+              onClick={exportData}
             >
               Autograde Data
             </Button>